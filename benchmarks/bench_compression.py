@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Benchmark of the compression codecs used to transfer files by SSHContext.
+
+The payloads mimic the files uploaded in a dp-gen iteration: 
+a text LAMMPS configuration (conf.lmp) and a binary model (graph.pb, float32 weights).
+For each codec, the tar archive of a payload is compressed and decompressed in memory 
+through CompressionCodec, and the throughput (MB of uncompressed data per second) is reported.
+
+Usage: python benchmarks/bench_compression.py [--size-mb 32]
+"""
+import os, sys, io, time, random, array, tarfile, tempfile, argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dpdispatcher.compression import CompressionCodec, check_codec_available
+
+def make_conf_lmp(fname, size):
+    random.seed(42)
+    with open(fname, 'w') as fp:
+        fp.write("# LAMMPS data file\n\n%d atoms\n2 atom types\n\n" % (size // 48))
+        fp.write("0.0 20.0 xlo xhi\n0.0 20.0 ylo yhi\n0.0 20.0 zlo zhi\n\nAtoms # atomic\n\n")
+        ii = 0
+        while fp.tell() < size:
+            ii += 1
+            fp.write("%d %d %.10f %.10f %.10f\n" % (ii, random.randint(1, 2), 
+                random.uniform(0, 20), random.uniform(0, 20), random.uniform(0, 20)))
+
+def make_graph_pb(fname, size):
+    random.seed(42)
+    weights = array.array('f', (random.gauss(0, 0.1) for ii in range(size // 4)))
+    with open(fname, 'wb') as fp:
+        fp.write(b'\x0a\x12' + b'deepmd model graph' * 8)
+        weights.tofile(fp)
+
+def make_tar(fname):
+    fileobj = io.BytesIO()
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        tar.add(fname, arcname=os.path.basename(fname))
+    return fileobj.getvalue()
+
+def bench_codec(codec, data):
+    start = time.perf_counter()
+    compressed = io.BytesIO()
+    with codec.open_writer(compressed) as writer:
+        for ii in range(0, len(data), 65536):
+            writer.write(data[ii:ii+65536])
+    compress_time = time.perf_counter() - start
+    start = time.perf_counter()
+    reader = codec.open_reader(io.BytesIO(compressed.getvalue()))
+    while reader.read(65536):
+        pass
+    decompress_time = time.perf_counter() - start
+    return len(compressed.getvalue()), compress_time, decompress_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=32, help='the size of each payload in MB')
+    args = parser.parse_args()
+    size = int(args.size_mb * 1024 * 1024)
+
+    codec_list = [('none', None), ('gzip', 1), ('gzip', 6), ('gzip', 9), ('bz2', 9), ('xz', 0), ('xz', 6), ('zstd', 3), ('lz4', 1)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        payload_dict = {'conf.lmp': make_conf_lmp, 'graph.pb': make_graph_pb}
+        for payload_name, make_payload in payload_dict.items():
+            fname = os.path.join(tmp_dir, payload_name)
+            make_payload(fname, size)
+            data = make_tar(fname)
+            auto_codec = CompressionCodec('auto').resolve([fname])
+            print("payload %s, %.1f MB, auto codec: %s" % (payload_name, len(data) / 1e6, auto_codec.name))
+            print("%-10s %6s %8s %18s %20s" % ('codec', 'level', 'ratio', 'compress (MB/s)', 'decompress (MB/s)'))
+            for name, level in codec_list:
+                if not check_codec_available(name):
+                    print("%-10s %6s %s" % (name, '', 'not installed'))
+                    continue
+                codec = CompressionCodec(name, level)
+                compressed_size, compress_time, decompress_time = bench_codec(codec, data)
+                print("%-10s %6s %8.3f %18.1f %20.1f" % (name, codec.level, len(data) / compressed_size, 
+                    len(data) / 1e6 / compress_time, len(data) / 1e6 / decompress_time))
+            print()
+
+if __name__ == '__main__':
+    main()
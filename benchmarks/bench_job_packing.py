@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Benchmark of the packing strategies of Submission.generate_jobs.
+
+The tasks have heavy-tailed durations (Pareto distributed, like MD runs of very different lengths),
+and the tasks of a job run one after another, so the makespan of a job is the sum of the durations of its tasks.
+The jobs are generated with the default random packing, and with LPT and FFD packing from cost estimates,
+either exact or with a lognormal error (as estimates from a runtime history would have).
+The spread of the job makespans is reported; the largest one is the makespan of the submission
+when all the jobs run at the same time.
+
+Usage: python benchmarks/bench_job_packing.py [--tasks 2000] [--group-size 20] [--pareto-shape 1.5] [--estimate-error 0.5]
+"""
+import os, sys, random, argparse, statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dpdispatcher.submission import Submission, Task, Resources
+
+def make_submission(duration_list, group_size):
+    resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=group_size)
+    submission = Submission(work_base='.', resources=resources)
+    submission.register_task_list([Task(command='sleep %.6f' % duration, task_work_path='task%05d/' % ii)
+        for ii, duration in enumerate(duration_list)])
+    return submission
+
+def get_job_makespans(submission, duration_dict):
+    return [sum([duration_dict[task.task_hash] for task in job.job_task_list]) for job in submission.belonging_jobs]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=2000)
+    parser.add_argument('--group-size', type=int, default=20)
+    parser.add_argument('--pareto-shape', type=float, default=1.5, help='the smaller, the heavier the tail')
+    parser.add_argument('--estimate-error', type=float, default=0.5, help='the sigma of the lognormal error of the estimates')
+    args = parser.parse_args()
+
+    rng = random.Random(2021)
+    duration_list = [rng.paretovariate(args.pareto_shape) for ii in range(args.tasks)]
+    estimate_list = [duration * rng.lognormvariate(0, args.estimate_error) for duration in duration_list]
+
+    print("%d tasks, group_size %d, task duration: mean %.2f, max %.2f" %
+        (args.tasks, args.group_size, statistics.mean(duration_list), max(duration_list)))
+    print("%-24s %6s %10s %10s %8s %10s %10s" % ('packing', 'jobs', 'mean', 'stdev', 'cv', 'max/min', 'makespan'))
+    for packing, estimate in [('random', None), ('lpt', 'exact'), ('ffd', 'exact'), ('lpt', 'noisy'), ('ffd', 'noisy')]:
+        submission = make_submission(duration_list, args.group_size)
+        duration_dict = {task.task_hash: duration for task, duration in zip(submission.belonging_tasks, duration_list)}
+        if estimate is None:
+            submission.generate_jobs(packing=packing)
+        else:
+            cost_dict = {task.task_hash: cost for task, cost in zip(submission.belonging_tasks,
+                duration_list if estimate == 'exact' else estimate_list)}
+            submission.generate_jobs(packing=packing, task_cost=lambda task: cost_dict[task.task_hash])
+        makespan_list = get_job_makespans(submission, duration_dict)
+        mean = statistics.mean(makespan_list)
+        stdev = statistics.pstdev(makespan_list)
+        name = packing if estimate is None else '%s (%s estimate)' % (packing, estimate)
+        print("%-24s %6d %10.2f %10.2f %8.3f %10.2f %10.2f" % (name, len(makespan_list), mean, stdev, stdev / mean,
+            max(makespan_list) / min(makespan_list), max(makespan_list)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""Benchmark of the hashing of a large submission.
+
+The submission is recovered from its serialized dictionary (as from the submission json) and bound to no batch,
+as try_recover_from_json does; then its hash is asked for again, and once more after one task is changed.
+The time of each step is reported, with the submission hash, which must not depend on the implementation.
+
+Usage: python benchmarks/bench_submission_hash.py [--tasks 100000] [--group-size 10]
+"""
+import os, sys, json, time, argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dpdispatcher.submission import Submission, Task, Resources
+
+def timeit(func):
+    """the seconds taken by func, and its result."""
+    start_time = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start_time, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=100000)
+    parser.add_argument('--group-size', type=int, default=10)
+    args = parser.parse_args()
+
+    resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=1, queue_name='normal', group_size=args.group_size)
+    submission = Submission(work_base='iter.000000/01.model_devi', resources=resources, forward_common_files=['graph.000.pb'])
+    submission.register_task_list([Task(command='lmp -i input.lammps -v restart 0', task_work_path='task.000.%06d' % ii,
+        forward_files=['conf.lmp', 'input.lammps'], backward_files=['model_devi.out', 'model_devi.log', 'traj'])
+        for ii in range(args.tasks)])
+    submission.generate_jobs()
+    submission_dict = json.loads(json.dumps(submission.serialize()))
+
+    recover_time, recovered_submission = timeit(lambda: Submission.deserialize(submission_dict=submission_dict).bind_batch(None))
+    rehash_time, submission_hash = timeit(recovered_submission.get_hash)
+    task = recovered_submission.belonging_jobs[0].job_task_list[0]
+    task.command = task.command + ' -v seed 1'
+    change_time, changed_hash = timeit(recovered_submission.get_hash)
+    if submission_hash != submission.submission_hash or changed_hash == submission_hash:
+        raise RuntimeError("the submission hash is wrong")
+
+    print("%d tasks, %d jobs, submission hash %s" % (args.tasks, len(submission.belonging_jobs), submission_hash))
+    print("%-28s %10s" % ('step', 'seconds'))
+    for step, step_time in [('recover and bind', recover_time), ('hash again', rehash_time), ('hash after a task change', change_time)]:
+        print("%-28s %10.3f" % (step, step_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Benchmark of the memory taken by the tasks and the jobs of a large submission.
+
+The tasks are registered, the jobs are generated, and the submission is recovered from its serialized dictionary
+(as from the submission json); the memory allocated by each step is measured with tracemalloc and reported per task.
+The tasks share the same forward and backward file names, as the tasks of dp-gen do.
+
+Usage: python benchmarks/bench_task_memory.py [--tasks 100000] [--group-size 10]
+"""
+import os, sys, json, argparse, tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dpdispatcher.submission import Submission, Task, Resources
+
+def measure(func):
+    """the bytes allocated (and still in use) by func, and its result."""
+    tracemalloc.start()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    result = func()
+    end_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return end_bytes - start_bytes, result
+
+def measure_task_memory(task_num, group_size):
+    """the bytes per task allocated by each step, in a dict keyed by the step name."""
+    resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=1, queue_name='normal', group_size=group_size)
+    submission = Submission(work_base='iter.000000/01.model_devi', resources=resources, forward_common_files=['graph.000.pb'])
+
+    def register_tasks():
+        task_list = [Task(command='lmp -i input.lammps -v restart 0', task_work_path='task.000.%06d' % ii,
+            forward_files=['conf.lmp', 'input.lammps'], backward_files=['model_devi.out', 'model_devi.log', 'traj'])
+            for ii in range(task_num)]
+        submission.register_task_list(task_list)
+    register_bytes, _ = measure(register_tasks)
+    generate_bytes, _ = measure(submission.generate_jobs)
+    submission_dict = json.loads(json.dumps(submission.serialize()))
+    recover_bytes, recovered_submission = measure(lambda: Submission.deserialize(submission_dict=submission_dict))
+    if recovered_submission.submission_hash != submission.submission_hash:
+        raise RuntimeError("the recovered submission has another hash")
+    print("%d tasks, %d jobs, submission hash %s" % (task_num, len(submission.belonging_jobs), submission.submission_hash))
+    return {'register tasks': register_bytes / task_num, 'generate jobs': generate_bytes / task_num, 'recover': recover_bytes / task_num}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=100000)
+    parser.add_argument('--group-size', type=int, default=10)
+    args = parser.parse_args()
+
+    memory_dict = measure_task_memory(task_num=args.tasks, group_size=args.group_size)
+    print("%-20s %12s %14s" % ('step', 'MiB', 'bytes per task'))
+    for step, task_bytes in memory_dict.items():
+        print("%-20s %12.1f %14.1f" % (step, task_bytes * args.tasks / 2**20, task_bytes))
+
+if __name__ == '__main__':
+    main()
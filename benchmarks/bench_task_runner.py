@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Benchmark of the task runners of the generated job scripts.
+
+A job of tasks with heterogeneous durations (most tasks are short, a few are stragglers,
+like LAMMPS runs of different lengths) is run with the Shell batch, once with the 'wave' task runner
+and once with the 'dynamic' one, and the makespan of the job script is reported.
+The tasks only sleep, so the makespan measures the scheduling inside the script.
+
+Usage: python benchmarks/bench_task_runner.py [--tasks 16] [--task-need-resources 0.25] [--time-scale 0.2]
+"""
+import os, sys, time, random, shutil, tempfile, argparse
+import subprocess as sp
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dpdispatcher.lazy_local_context import LazyLocalContext
+from dpdispatcher.shell import Shell
+from dpdispatcher.submission import Job, Task, Resources
+
+def make_duration_list(task_num, time_scale):
+    random.seed(42)
+    duration_list = []
+    for ii in range(task_num):
+        # one task in five is a straggler running 4 to 8 times longer
+        if random.random() < 0.2:
+            duration_list.append(random.uniform(4, 8) * time_scale)
+        else:
+            duration_list.append(random.uniform(0.5, 1.5) * time_scale)
+    return duration_list
+
+def make_job(duration_list, task_need_resources, task_runner):
+    resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal',
+        group_size=len(duration_list), task_runner=task_runner)
+    task_list = [Task(command='sleep %.3f' % duration, task_work_path='task%03d/' % ii,
+        task_need_resources=task_need_resources) for ii, duration in enumerate(duration_list)]
+    return Job(job_task_list=task_list, resources=resources)
+
+def run_job(job):
+    work_dir = tempfile.mkdtemp(prefix='bench_task_runner_')
+    try:
+        for task in job.job_task_list:
+            os.makedirs(os.path.join(work_dir, task.task_work_path))
+        script = Shell(context=LazyLocalContext(work_dir, None)).gen_script(job)
+        with open(os.path.join(work_dir, job.script_file_name), 'w') as fp:
+            fp.write(script)
+        start_time = time.perf_counter()
+        sp.check_call(['bash', job.script_file_name], cwd=work_dir)
+        return time.perf_counter() - start_time
+    finally:
+        shutil.rmtree(work_dir)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=16)
+    parser.add_argument('--task-need-resources', type=float, default=0.25)
+    parser.add_argument('--time-scale', type=float, default=0.2, help='the seconds of a typical short task')
+    args = parser.parse_args()
+
+    duration_list = make_duration_list(args.tasks, args.time_scale)
+    slots = int(round(1 / args.task_need_resources))
+    print("%d tasks, %d slots, total task time %.2f s, longest task %.2f s" %
+        (args.tasks, slots, sum(duration_list), max(duration_list)))
+    print("%-8s %12s" % ('runner', 'makespan(s)'))
+    makespan_dict = {}
+    for task_runner in ['wave', 'dynamic']:
+        makespan_dict[task_runner] = run_job(make_job(duration_list, args.task_need_resources, task_runner))
+        print("%-8s %12.2f" % (task_runner, makespan_dict[task_runner]))
+    print("makespan reduced by %.1f%%" % (100 * (1 - makespan_dict['dynamic'] / makespan_dict['wave'])))
+
+if __name__ == '__main__':
+    main()
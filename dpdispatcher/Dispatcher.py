@@ -11,6 +11,7 @@ from dpdispatcher.Shell import Shell
 from dpdispatcher.AWS import AWS 
 from dpdispatcher.JobStatus import JobStatus
 from dpdispatcher import dlog
+from dpdispatcher.poll_policy import FixedPollPolicy
 from hashlib import sha1
 
 def _split_tasks(tasks,
@@ -33,8 +34,13 @@ class Dispatcher(object):
                   remote_profile,
                   context_type = 'local',
                   batch_type = 'slurm', 
-                  job_record = 'jr.json'):
+                  job_record = 'jr.json',
+                  poll_policy = None):
         self.remote_profile = remote_profile
+        # decides the interval between two checks of the jobs in run_jobs, see dpdispatcher.poll_policy
+        if poll_policy is None:
+            poll_policy = FixedPollPolicy(interval=60)
+        self.poll_policy = poll_policy
 
         if context_type == 'local':
             self.session = LocalSession(remote_profile)
@@ -88,8 +94,17 @@ class Dispatcher(object):
                                        forward_task_deference,
                                        outlog,
                                        errlog)
-        while not self.all_finished(job_handler, mark_failure) :
-            time.sleep(60)
+        while True :
+            query_start_time = time.monotonic()
+            if self.all_finished(job_handler, mark_failure) :
+                break
+            # the duration includes the downloads of the jobs just finished, which only lengthens the next interval
+            query_duration = time.monotonic() - query_start_time
+            job_record = job_handler['job_record']
+            # a chunk changes state when it finishes or is resubmitted
+            job_state_dict = {chunk_hash: (job_record.check_finished(chunk_hash), job_record.check_nfail(chunk_hash))
+                for chunk_hash in job_record.record}
+            time.sleep(self.poll_policy.next_interval(job_state_dict, query_duration))
         # delete path map file when job finish
         # _pmap.delete()
 
@@ -1,12 +1,271 @@
-
-import os,sys,time,random,uuid
+import os,sys,time,random,uuid,math,shlex,json
+from hashlib import sha1
 
 from dpdispatcher.JobStatus import JobStatus
 from dpdispatcher import dlog
+from dpdispatcher.task_telemetry import task_telemetry_header_template, get_task_telemetry_file
+
+# the resources of a node are divided into this many units in the dynamic task runner,
+# and each task takes ceil(task_need_resources * units) of them
+dynamic_runner_capacity_units = 1000
+
+# bash functions of the dynamic task runner: a task is started as soon as enough units are free,
+# instead of waiting for the whole wave of tasks before it to finish.
+# Besides the units of the node, a task may take devices from the pools (for example, the GPUs):
+# dp_<pool>_free holds the free units of each device of the pool,
+# and the indices of the devices given to the task are put in dp_alloc_<pool>.
+# The pools live in the job script process, which is the only one allocating, so no lock is needed.
+dynamic_runner_header_template="""
+dp_slot_capacity={capacity_units}
+dp_slot_in_use=0
+dp_slot_pids=()
+dp_slot_units=()
+dp_slot_allocs=()
+{pool_lines}
+dp_pool_try_alloc() {{
+  # $1: pool, $2: the number of devices, $3: the units taken on each device
+  local -n dp_free=dp_$1_free
+  local ii found=()
+  for ii in "${{!dp_free[@]}}"; do
+    if [ ${{dp_free[ii]}} -ge $3 ]; then
+      found+=($ii)
+      [ ${{#found[@]}} -ge $2 ] && break
+    fi
+  done
+  [ ${{#found[@]}} -lt $2 ] && return 1
+  for ii in "${{found[@]}}"; do
+    dp_free[ii]=$((dp_free[ii] - $3))
+  done
+  printf -v dp_alloc_$1 '%s' "$(IFS=,; echo "${{found[*]}}")"
+  dp_alloc_list+=("$1:$(IFS=,; echo "${{found[*]}}"):$3")
+}}
+dp_pool_free() {{
+  # $1: pool:devices:units, as recorded by dp_pool_try_alloc
+  local pool=${{1%%:*}} rest=${{1#*:}}
+  local units=${{rest#*:}} ii
+  local -n dp_free=dp_${{pool}}_free
+  for ii in ${{rest%%:*}}; do
+    dp_free[ii]=$((dp_free[ii] + units))
+  done
+}}
+dp_try_acquire() {{
+  # $1: the units of the node, followed by the triples (pool, number of devices, units on each device)
+  [ $((dp_slot_in_use + $1)) -gt $dp_slot_capacity ] && return 1
+  dp_alloc_list=()
+  shift
+  while [ $# -gt 0 ]; do
+    if ! dp_pool_try_alloc $1 $2 $3; then
+      local alloc
+      for alloc in "${{dp_alloc_list[@]}}"; do
+        dp_pool_free "${{alloc//,/ }}"
+      done
+      return 1
+    fi
+    shift 3
+  done
+  return 0
+}}
+dp_release_slots() {{
+  local running=" $(jobs -pr | tr '\\n' ' ') "
+  local ii alloc
+  for ii in "${{!dp_slot_pids[@]}}"; do
+    if [[ "$running" != *" ${{dp_slot_pids[$ii]}} "* ]]; then
+      dp_slot_in_use=$((dp_slot_in_use - dp_slot_units[ii]))
+      for alloc in ${{dp_slot_allocs[ii]}}; do
+        dp_pool_free "${{alloc//,/ }}"
+      done
+      unset 'dp_slot_pids[ii]' 'dp_slot_units[ii]' 'dp_slot_allocs[ii]'
+    fi
+  done
+}}
+dp_acquire_slot() {{
+  dp_release_slots
+  while ! dp_try_acquire "$@"; do
+    # wait -n needs bash 4.3
+    wait -n 2>/dev/null || sleep 1
+    dp_release_slots
+  done
+}}
+dp_register_slot() {{
+  dp_slot_pids+=($1)
+  dp_slot_units+=($2)
+  dp_slot_allocs+=("${{dp_alloc_list[*]}}")
+  dp_slot_in_use=$((dp_slot_in_use + $2))
+}}
+"""
+
+dynamic_runner_command_template="""
+dp_acquire_slot {task_units}{pool_args}
+(
+cd $REMOTE_ROOT
+cd {task_work_path}
+test $? -ne 0 && exit 1
+if [ ! -f {task_tag_finished} ] ;then
+  {command_env} {command}  1>> {outlog} 2>> {errlog} 
+  if test $? -ne 0; then touch {task_tag_finished}; fi
+  touch {task_tag_finished}
+fi
+) &
+dp_register_slot $! {task_units}
+"""
+
+# the cores the job may use on the node (as given by the scheduler, for example in a cgroup), read when the job script starts.
+# The tasks are pinned to the cores at the offsets computed for them (see get_command_cpu_affinity and the dynamic cpu pool)
+# in dp_cpu_allowed, so that they stay in the cores of the job on a shared node.
+cpu_affinity_header_template="""
+dp_cpu_allowed=()
+for dp_cpu_range in $(grep Cpus_allowed_list /proc/$$/status | cut -f2 | tr ',' ' '); do
+  dp_cpu_allowed+=($(seq ${{dp_cpu_range%-*}} ${{dp_cpu_range#*-}}))
+done
+if [ ${{#dp_cpu_allowed[@]}} -lt {cpu_per_node} ]; then
+  echo "the job may use ${{#dp_cpu_allowed[@]}} cores, less than cpu_per_node {cpu_per_node}; the tasks can not be pinned" >&2
+  exit 1
+fi
+dp_cpu_list() {{
+  # $1: the offsets of the cores, separated by commas
+  local ii cpus=()
+  for ii in ${{1//,/ }}; do
+    cpus+=(${{dp_cpu_allowed[ii]}})
+  done
+  (IFS=,; echo "${{cpus[*]}}")
+}}
+"""
+
+# the pilot runner: the job script claims the tasks from a queue shared by the pilot jobs of the submission,
+# and runs them with the functions of the dynamic task runner until the queue drains.
+# The queue is a directory with a file for each task (see pilot_task_template); a pilot claims a task by renaming
+# its file into the claimed directory with the pilot id (the job hash) appended. The rename is atomic,
+# so each task is claimed by one pilot only. The file is removed after the task has run, and the claims left by
+# a killed pilot are put back to the queue when its job is resubmitted.
+# The queue is seeded by the first pilot starting: the files are written into a temporary directory
+# renamed to the queue at once; the queue holds the .seeded file, so it is never replaced by a later seed.
+# A pilot exits when no task is left in the queue and the tasks of its own job are finished (or lost),
+# so that its job_tag_finished still means that the tasks of the job are done.
+pilot_runner_template="""
+dp_pilot_root=$REMOTE_ROOT/{pilot_queue_name}
+dp_pilot_id={pilot_id}
+dp_pilot_task_hashes=({task_hashes})
+dp_pilot_task_tags=({task_tags})
+if [ ! -d $dp_pilot_root/queue ]; then
+  mkdir -p $dp_pilot_root/claimed
+  dp_pilot_seed=$(mktemp -d $dp_pilot_root/seed.XXXXXX)
+  touch $dp_pilot_seed/.seeded
+  (cd $dp_pilot_seed && . $REMOTE_ROOT/{pilot_queue_name}.sh)
+  mv -T $dp_pilot_seed $dp_pilot_root/queue 2>/dev/null || rm -rf $dp_pilot_seed
+fi
+for dp_claimed in $dp_pilot_root/claimed/*.$dp_pilot_id; do
+  [ -e "$dp_claimed" ] && mv "$dp_claimed" $dp_pilot_root/queue/$(basename "$dp_claimed" .$dp_pilot_id)
+done
+dp_pilot_claim() {{
+  local entry
+  for entry in $dp_pilot_root/queue/*; do
+    [ -e "$entry" ] || return 1
+    dp_claimed=$dp_pilot_root/claimed/${{entry##*/}}.$dp_pilot_id
+    mv "$entry" "$dp_claimed" 2>/dev/null && return 0
+  done
+  return 1
+}}
+dp_pilot_pending() {{
+  # whether a task of the job is neither finished nor lost: it is still in the queue or claimed
+  local ii claimed
+  for ii in "${{!dp_pilot_task_hashes[@]}}"; do
+    [ -f $REMOTE_ROOT/${{dp_pilot_task_tags[ii]}} ] && continue
+    [ -e $dp_pilot_root/queue/${{dp_pilot_task_hashes[ii]}} ] && return 0
+    for claimed in $dp_pilot_root/claimed/${{dp_pilot_task_hashes[ii]}}.*; do
+      [ -e "$claimed" ] && return 0
+    done
+  done
+  return 1
+}}
+while true; do
+  if dp_pilot_claim; then
+    read -r dp_slot_tag dp_task_units dp_pool_args < "$dp_claimed"
+    dp_acquire_slot $dp_task_units $dp_pool_args
+    ( ( . "$dp_claimed" ) ; rm -f "$dp_claimed" ) &
+    dp_register_slot $! $dp_task_units
+  elif dp_pilot_pending; then
+    wait -n 2>/dev/null || sleep {poll_interval}
+    dp_release_slots
+  else
+    break
+  fi
+done
+"""
+
+# the file of a task in the pilot queue: the slot it takes (as the arguments of dp_acquire_slot), and the commands running it
+pilot_task_template="""\
+#dp_slot {task_units}{pool_args}
+cd $REMOTE_ROOT
+cd {task_work_path}
+test $? -ne 0 && exit 1
+if [ ! -f {task_tag_finished} ] ;then
+  {command_env} {command}  1>> {outlog} 2>> {errlog}
+  if test $? -ne 0; then touch {task_tag_finished}; fi
+  touch {task_tag_finished}
+fi
+"""
+
+pilot_queue_task_template="""\
+cat > {task_hash} <<'DP_PILOT_TASK_EOF'
+{pilot_task}DP_PILOT_TASK_EOF
+"""
+
+# the seconds a pilot waiting for the tasks claimed by other pilots sleeps between two checks
+pilot_poll_interval = 5
+
+# the array script runs the body of the job script of the array element given by {array_index_var}
+array_script_template="""\
+{script_header}
+{script_env}
+case ${array_index_var} in
+{script_case_list}
+*)
+  echo "no job for the array index ${array_index_var}" >&2
+  exit 1
+  ;;
+esac
+"""
+
+array_script_case_template="""\
+{array_index})
+{script_body}
+;;
+"""
+
 class Batch(object) :
+    # the maximum number of job ids passed to one scheduler query in check_status_many
+    status_query_chunk_size = 500
+
     def __init__ (self,
-                  context):
+                  context,
+                  *,
+                  if_job_array=False,
+                  array_throttle=None,
+                  max_array_size=1000):
+        """
+        Parameters
+        ----------
+        context : 
+            the context of the computer where the jobs run.
+        if_job_array : bool
+            if True, the jobs submitted together with the same resources are submitted as one job array
+            (see do_submit_many), so that one submission command is run instead of one per job.
+            Only the batches implementing do_submit_array support it.
+        array_throttle : int or None
+            the largest number of the elements of a job array running at the same time; None for no limit.
+        max_array_size : int
+            the largest number of the elements of a job array; more jobs are submitted as several arrays.
+            It must not be larger than the limit of the scheduler (MaxArraySize of slurm, 1001 by default,
+            MAX_JOB_ARRAY_SIZE of LSF, 1000 by default, or max_array_size of PBS).
+        """
+        if if_job_array and type(self).do_submit_array is Batch.do_submit_array:
+            raise RuntimeError("{batch} does not support if_job_array".format(batch=type(self).__name__))
         self.context = context
+        self.if_job_array = if_job_array
+        self.array_throttle = array_throttle
+        if max_array_size < 1:
+            raise RuntimeError("max_array_size must be positive, got {max_array_size}".format(max_array_size=max_array_size))
+        self.max_array_size = max_array_size
         # self.uuid_names = uuid_names
         self.upload_tag_name = '%s_job_tag_upload' % self.context.job_uuid
         self.finish_tag_name = '%s_job_tag_finished' % self.context.job_uuid
@@ -15,6 +274,34 @@ class Batch(object) :
 
     def check_status(self, job) :
         raise NotImplementedError('abstract method check_status should be implemented by derived class')        
+
+    def check_status_many(self, jobs):
+        """check the status of many jobs at once.
+        Derived classes with a scheduler that accepts several job ids in one query
+        (for example, squeue -j id1,id2) should override this method,
+        so that one poll cycle costs one round-trip instead of one per job.
+
+        Parameters
+        ----------
+        jobs : list of Job
+            the jobs to be checked
+
+        Returns
+        -------
+        job_state_dict : dict
+            the JobStatus of each job, indexed by job.job_hash
+        """
+        job_state_dict = {}
+        for job in jobs:
+            job_state_dict[job.job_hash] = self.check_status(job)
+        return job_state_dict
+
+    def _split_job_id_chunks(self, jobs):
+        """split the submitted jobs into chunks of at most status_query_chunk_size jobs,
+        so that the query command line does not exceed the argv limit.
+        """
+        chunk_size = self.status_query_chunk_size
+        return [jobs[ii:ii+chunk_size] for ii in range(0, len(jobs), chunk_size)]
         
     def default_resources(self, res) :
         raise NotImplementedError('abstract method sub_script_head should be implemented by derived class')        
@@ -34,15 +321,322 @@ class Batch(object) :
     def gen_script(self):
         raise NotImplementedError('abstract method gen_script should be implemented by derived class')        
 
+    def do_submit_array(self, jobs):
+        """submit the jobs as one job array.
+
+        Returns
+        -------
+        job_id_dict : dict
+            the job id of the array element of each job, indexed by job.job_hash
+        """
+        raise NotImplementedError('abstract method do_submit_array should be implemented by derived class')
+
+    def do_submit_many(self, jobs):
+        """submit many jobs. If self.if_job_array is True, the jobs with the same resources
+        are submitted as job arrays of at most self.max_array_size jobs with do_submit_array;
+        otherwise the jobs are submitted one by one. The jobs of an array rejected by the scheduler
+        are submitted one by one instead.
+
+        Returns
+        -------
+        job_id_dict : dict
+            the job id of each job, indexed by job.job_hash
+        """
+        job_id_dict = {}
+        if not self.if_job_array:
+            for job in jobs:
+                job_id_dict[job.job_hash] = self.do_submit(job)
+            return job_id_dict
+        job_group_dict = {}
+        for job in jobs:
+            job_group_dict.setdefault(json.dumps(job.resources.serialize(), sort_keys=True), []).append(job)
+        for job_group in job_group_dict.values():
+            for ii in range(0, len(job_group), self.max_array_size):
+                job_id_dict.update(self._submit_array_chunk(job_group[ii:ii+self.max_array_size]))
+        return job_id_dict
+
+    def _submit_array_chunk(self, jobs):
+        """submit the jobs as one job array, or one by one if there is one job or the array is rejected."""
+        if len(jobs) > 1:
+            try:
+                return self.do_submit_array(jobs)
+            except RuntimeError as e:
+                dlog.warning("the job array of {job_num} jobs is rejected, and the jobs are submitted one by one: {error}".format(
+                    job_num=len(jobs), error=e))
+        return {job.job_hash: self.do_submit(job) for job in jobs}
+
+    def get_array_hash(self, jobs):
+        return sha1(' '.join([job.job_hash for job in jobs]).encode('utf-8')).hexdigest()
+
+    def gen_array_script(self, jobs, array_index_var, first_index=0):
+        """generate the script of a job array, which runs the body of the script of the job
+        (see gen_script_body) given by the array index. The header and the environment are those of the first job;
+        the jobs of an array have the same resources.
+
+        Parameters
+        ----------
+        jobs : list of Job
+            the jobs of the array, the first one at first_index.
+        array_index_var : str
+            the environment variable of the array index set by the scheduler, for example SLURM_ARRAY_TASK_ID.
+        first_index : int
+            the array index of the first job.
+        """
+        script_case_list = [array_script_case_template.format(array_index=first_index + ii, script_body=self.gen_script_body(job))
+            for ii, job in enumerate(jobs)]
+        return array_script_template.format(script_header=self.gen_array_script_header(jobs[0]),
+            script_env=self.gen_script_env(jobs[0]), array_index_var=array_index_var,
+            script_case_list=''.join(script_case_list))
+
+    def gen_array_script_header(self, job):
+        """the header of the script of a job array, the header of the script of the job by default."""
+        return self.gen_script_header(job)
+
     def check_finish_tag(self) :
         raise NotImplementedError('abstract method check_finish_tag should be implemented by derived class')        
 
-    def get_command_env_cuda_devices(self, resources, task):
+    def check_finish_tag_many(self, jobs):
+        """check the job_tag_finished files of many jobs with one context.check_files_exist call.
+
+        Returns
+        -------
+        if_finished_dict : dict
+            whether each job has finished, indexed by job.job_hash
+        """
+        job_tag_finished_dict = {job.job_hash: job.job_hash + '_job_tag_finished' for job in jobs}
+        if_exist_dict = self.context.check_files_exist(list(job_tag_finished_dict.values()))
+        return {job_hash: if_exist_dict[job_tag_finished] for job_hash, job_tag_finished in job_tag_finished_dict.items()}
+
+    def _get_left_job_state_many(self, jobs):
+        """the jobs have left the scheduler queue; decide whether they finished or were terminated 
+        by probing all their finish tags at once.
+        """
+        if_finished_dict = self.check_finish_tag_many(jobs)
+        job_state_dict = {}
+        for job in jobs:
+            if if_finished_dict[job.job_hash]:
+                job_state_dict[job.job_hash] = JobStatus.finished
+            else:
+                job_state_dict[job.job_hash] = JobStatus.terminated
+        return job_state_dict
+
+    def gen_script_command(self, job, resources, script_command_template, script_wait):
+        """generate the part of the job script running the tasks.
+
+        With the default 'wave' task runner, the tasks are started in the background until the next task
+        would exceed the resources (the resources in use by the wave + task_need_resources > 1); then script_wait blocks until all the started tasks finish.
+        With the 'dynamic' task runner (resources.task_runner), a task starts as soon as the tasks finished free enough resources.
+        With the 'pilot' task runner, the job runs the tasks claimed from the queue shared by the pilot jobs, see gen_script_command_pilot.
+
+        Parameters
+        ----------
+        job : Job
+            the job whose tasks are run.
+        resources : Resources
+            the resources of the job.
+        script_command_template : str
+            the template of the commands running one task in the background.
+        script_wait : str
+            the barrier between two waves of tasks.
+        """
+        if resources.task_runner == 'dynamic':
+            return self.gen_script_command_dynamic(job, resources)
+        if resources.task_runner == 'pilot':
+            return self.gen_script_command_pilot(job, resources)
+        script_command = self.gen_script_telemetry_header(resources)
+        script_command += self.gen_cpu_affinity_header(resources)
+        # the resources in use by the tasks of the wave
+        in_use = 0
+        for task in job.job_task_list:
+            command_env = ""
+            task_need_resources = task.task_need_resources
+            # the tolerance avoids an extra wave when the float resources add up to 1 with a rounding error
+            if in_use+task_need_resources > 1 + 1e-9:
+                script_command += script_wait
+                in_use = 0
+
+            command_env += self.get_command_env_cuda_devices(resources=resources, task=task, in_use=in_use)
+
+            command_env += "export DP_TASK_NEED_RESOURCES={task_need_resources} ;".format(task_need_resources=task.task_need_resources)
+
+            affinity_env, command_prefix = self.get_command_cpu_affinity(resources=resources, task=task, in_use=in_use)
+            command_env += affinity_env
+
+            task_tag_finished = task.task_hash + '_task_tag_finished'
+
+            script_command += script_command_template.format(command_env=command_env,
+                task_work_path=task.task_work_path, command=self.gen_task_command(job, resources, task, command_prefix),
+                task_tag_finished=task_tag_finished,
+                outlog=task.outlog, errlog=task.errlog)
+            in_use += task_need_resources
+        return script_command
+
+    def gen_script_command_dynamic(self, job, resources):
+        """generate the part of the job script running the tasks with the dynamic task runner.
+        If resources.if_cuda_multi_devices is True (or resources.cpu_affinity is set), the GPUs (or the cores)
+        are given to the tasks at runtime from a pool of free GPUs (or cores), see get_dynamic_pool_args.
+        """
+        script_command = self.gen_dynamic_runner_header(resources)
+        for task in job.job_task_list:
+            script_command += dynamic_runner_command_template.format(**self.get_dynamic_task_dict(job, resources, task))
+        return script_command
+
+    def gen_dynamic_runner_header(self, resources):
+        pool_line_list = []
+        if resources.if_cuda_multi_devices is True:
+            pool_line_list.append("dp_gpu_free=({free_units})".format(
+                free_units=' '.join([str(dynamic_runner_capacity_units)] * resources.gpu_per_node)))
+        if resources.cpu_affinity is not None:
+            pool_line_list.append("dp_cpu_free=({free_units})".format(
+                free_units=' '.join([str(dynamic_runner_capacity_units)] * resources.cpu_per_node)))
+        script_command = self.gen_script_telemetry_header(resources)
+        script_command += self.gen_cpu_affinity_header(resources)
+        script_command += dynamic_runner_header_template.format(capacity_units=dynamic_runner_capacity_units,
+            pool_lines='\n'.join(pool_line_list))
+        return script_command
+
+    def get_dynamic_task_dict(self, job, resources, task):
+        """the fields of the templates running a task with the dynamic task runner (or in a pilot)."""
+        pool_args, command_env = self.get_dynamic_pool_args(resources=resources, task=task)
+        command_env += "export DP_TASK_NEED_RESOURCES={task_need_resources} ;".format(task_need_resources=task.task_need_resources)
+        command_prefix = ""
+        if resources.cpu_affinity is not None:
+            affinity_env, command_prefix = self.get_cpu_affinity_command(resources=resources, cpu_offsets='$dp_alloc_cpu')
+            command_env += affinity_env
+        task_units = min(math.ceil(task.task_need_resources * dynamic_runner_capacity_units - 1e-6), dynamic_runner_capacity_units)
+        task_tag_finished = task.task_hash + '_task_tag_finished'
+        return dict(command_env=command_env,
+            task_units=max(task_units, 1), pool_args=''.join([' %s %d %d' % pool_arg for pool_arg in pool_args]),
+            task_work_path=task.task_work_path, command=self.gen_task_command(job, resources, task, command_prefix),
+            task_tag_finished=task_tag_finished, outlog=task.outlog, errlog=task.errlog)
+
+    def gen_script_command_pilot(self, job, resources):
+        """generate the part of the job script of a pilot job, which claims the tasks from the queue of the
+        pilot jobs of the submission (written by Submission.write_pilot_queue) and runs them until the queue drains,
+        see pilot_runner_template. The tasks of the job are the ones the pilot waits for before it exits,
+        but it runs the tasks of any job. A task is claimed before enough resources of the node are free to start it.
+        """
+        if job.pilot_queue_name is None:
+            raise RuntimeError("the pilot queue of job {job_hash} is not written, see Submission.write_pilot_queue".format(job_hash=job.job_hash))
+        script_command = self.gen_dynamic_runner_header(resources)
+        script_command += pilot_runner_template.format(pilot_queue_name=job.pilot_queue_name, pilot_id=job.job_hash,
+            task_hashes=' '.join([task.task_hash for task in job.job_task_list]),
+            task_tags=' '.join([os.path.join(task.task_work_path, task.task_hash + '_task_tag_finished') for task in job.job_task_list]),
+            poll_interval=pilot_poll_interval)
+        return script_command
+
+    def gen_pilot_queue_script(self, jobs):
+        """generate the script seeding the pilot queue: run in the queue directory,
+        it writes the file of each task of the jobs (see pilot_task_template).
+        """
+        queue_task_list = []
+        for job in jobs:
+            resources = self.get_base_resources(job)
+            for task in job.job_task_list:
+                pilot_task = pilot_task_template.format(**self.get_dynamic_task_dict(job, resources, task))
+                queue_task_list.append(pilot_queue_task_template.format(task_hash=task.task_hash, pilot_task=pilot_task))
+        return ''.join(queue_task_list)
+
+    def get_base_resources(self, job):
+        """the Resources of the job, which the batches wrapping them (for example, in SlurmResources) unwrap."""
+        return job.resources
+
+    def gen_cpu_affinity_header(self, resources):
+        if resources.cpu_affinity is not None:
+            return cpu_affinity_header_template.format(cpu_per_node=resources.cpu_per_node)
+        return ""
+
+    def gen_script_telemetry_header(self, resources):
+        if resources.if_telemetry is True:
+            return task_telemetry_header_template.format()
+        return ""
+
+    def gen_task_command(self, job, resources, task, command_prefix=""):
+        """the command of the task in the job script, after command_prefix (for example, numactl).
+        If resources.if_telemetry is True, the command is run by dp_run_task in a new bash,
+        which appends the start time, end time, exit status and max RSS of the task to the telemetry record of the job.
+        """
+        if resources.if_telemetry is True:
+            return "dp_run_task $REMOTE_ROOT/{record} {task_hash} {command_prefix}bash -c {command}".format(
+                record=get_task_telemetry_file(job.job_hash), task_hash=task.task_hash,
+                command_prefix=command_prefix, command=shlex.quote(task.command))
+        return command_prefix + task.command
+
+    def get_dynamic_pool_args(self, resources, task):
+        """the devices a task takes from the pools of the dynamic task runner, and the environment exposing them to the task.
+
+        A task needs task_need_resources * gpu_per_node GPUs. If that is at least 1, it takes as many whole GPUs (rounded up);
+        otherwise it takes this fraction of one GPU, which is shared with other tasks, as in the static assignment.
+        With resources.cpu_affinity, a task takes whole cores only, see get_task_cpu_num.
+
+        Returns
+        -------
+        pool_args : list of tuple
+            (pool, the number of devices, the units taken on each device)
+        command_env : str
+            the commands exporting the devices to the task
+        """
+        pool_args = []
+        command_env = ""
+        if resources.if_cuda_multi_devices is True:
+            gpu_need = task.task_need_resources * resources.gpu_per_node
+            if gpu_need >= 1 - 1e-9:
+                gpu_num = min(math.ceil(gpu_need - 1e-9), resources.gpu_per_node)
+                pool_args.append(('gpu', gpu_num, dynamic_runner_capacity_units))
+            else:
+                pool_args.append(('gpu', 1, max(math.ceil(gpu_need * dynamic_runner_capacity_units - 1e-6), 1)))
+            command_env += "export CUDA_VISIBLE_DEVICES=$dp_alloc_gpu ;"
+        if resources.cpu_affinity is not None:
+            pool_args.append(('cpu', self.get_task_cpu_num(resources=resources, task=task), dynamic_runner_capacity_units))
+        return pool_args, command_env
+
+    def get_task_cpu_num(self, resources, task):
+        """the number of cores a task is pinned to: floor(task_need_resources * cpu_per_node)."""
+        cpu_num = min(int(task.task_need_resources * resources.cpu_per_node + 1e-9), resources.cpu_per_node)
+        if cpu_num < 1:
+            raise RuntimeError("task {task_hash} needs less than one core (task_need_resources {task_need_resources}, cpu_per_node {cpu_per_node}), "
+                "it can not be pinned with cpu_affinity".format(task_hash=task.task_hash,
+                task_need_resources=task.task_need_resources, cpu_per_node=resources.cpu_per_node))
+        return cpu_num
+
+    def get_cpu_affinity_command(self, resources, cpu_offsets):
+        """pin the task to the cores at cpu_offsets (separated by commas) in the cores the job may use,
+        see cpu_affinity_header_template.
+
+        Returns
+        -------
+        command_env : str
+            the commands run before the task command.
+        command_prefix : str
+            the prefix of the task command.
+        """
+        cpu_list = '$(dp_cpu_list {cpu_offsets})'.format(cpu_offsets=cpu_offsets)
+        if resources.cpu_affinity == 'taskset':
+            # the background shell running the task is pinned, so that every command of the task inherits the affinity;
+            # the task is not run (and its task_tag_finished not touched) unpinned
+            return "taskset -pc {cpu_list} $BASHPID >/dev/null || exit 1 ;".format(cpu_list=cpu_list), ""
+        elif resources.cpu_affinity == 'numactl':
+            return "", "numactl --physcpubind={cpu_list} --localalloc ".format(cpu_list=cpu_list)
+        return "", ""
+
+    def get_command_cpu_affinity(self, resources, task, in_use):
+        """pin the task of the wave to the cores following the ones of the tasks before it in the wave.
+        The offset of the first core of a task is floor(in_use * cpu_per_node + 0.5), so the core sets of a wave never overlap.
+        """
+        if resources.cpu_affinity is None:
+            return "", ""
+        cpu_num = self.get_task_cpu_num(resources=resources, task=task)
+        first_cpu = int(in_use * resources.cpu_per_node + 0.5)
+        cpu_offsets = ','.join([str(ii) for ii in range(first_cpu, first_cpu + cpu_num)])
+        return self.get_cpu_affinity_command(resources=resources, cpu_offsets=cpu_offsets)
+
+    def get_command_env_cuda_devices(self, resources, task, in_use):
+        """give the task of the wave the GPUs following the ones of the tasks before it, which use in_use of the resources."""
         task_need_resources = task.task_need_resources
         command_env=""
         if resources.if_cuda_multi_devices is True:
-            min_CUDA_VISIBLE_DEVICES = int(resources.in_use*resources.gpu_per_node)
-            max_CUDA_VISIBLE_DEVICES = int((resources.in_use + task_need_resources)*resources.gpu_per_node-0.000000001)
+            min_CUDA_VISIBLE_DEVICES = int(in_use*resources.gpu_per_node)
+            max_CUDA_VISIBLE_DEVICES = int((in_use + task_need_resources)*resources.gpu_per_node-0.000000001)
             list_CUDA_VISIBLE_DEVICES  = list(range(min_CUDA_VISIBLE_DEVICES, max_CUDA_VISIBLE_DEVICES+1))
             if len(list_CUDA_VISIBLE_DEVICES) == 0:
                 raise RuntimeError("list_CUDA_VISIBLE_DEVICES can not be empty")
@@ -0,0 +1,293 @@
+import os, math, zlib, bz2, lzma
+from collections import Counter
+
+# remote_compress_cmd/remote_decompress_cmd are the filters run by the shell of the remote machine.
+compression_codec_dict = {
+    'none': {'suffix': '.tar', 'default_level': None, 'min_level': None, 'max_level': None,
+        'remote_compress_cmd': None, 'remote_decompress_cmd': None},
+    'gzip': {'suffix': '.tgz', 'default_level': 6, 'min_level': 1, 'max_level': 9,
+        'remote_compress_cmd': 'gzip -{level}', 'remote_decompress_cmd': 'gzip -d'},
+    'bz2': {'suffix': '.tar.bz2', 'default_level': 9, 'min_level': 1, 'max_level': 9,
+        'remote_compress_cmd': 'bzip2 -{level}', 'remote_decompress_cmd': 'bzip2 -d'},
+    'xz': {'suffix': '.tar.xz', 'default_level': 6, 'min_level': 0, 'max_level': 9,
+        'remote_compress_cmd': 'xz -{level}', 'remote_decompress_cmd': 'xz -d'},
+    'zstd': {'suffix': '.tar.zst', 'default_level': 3, 'min_level': 1, 'max_level': 19,
+        'remote_compress_cmd': 'zstd -q -{level}', 'remote_decompress_cmd': 'zstd -q -d'},
+    'lz4': {'suffix': '.tar.lz4', 'default_level': 1, 'min_level': 1, 'max_level': 12,
+        'remote_compress_cmd': 'lz4 -q -{level}', 'remote_decompress_cmd': 'lz4 -q -d'},
+}
+
+# the codecs depending on optional python packages
+optional_codec_module_dict = {
+    'zstd': 'zstandard',
+    'lz4': 'lz4.frame',
+}
+
+# the sampled entropy (bits per byte) above which the files are regarded as incompressible;
+# for example, the float32 weights of a graph.pb sample at about 7.4 and gzip shrinks them by less than 10%
+incompressible_entropy_threshold = 7.0
+
+# runs "tar cf - {flist} | {compress_cmd}" with the output of compress_cmd going to {target}, 
+# and exits with the status of tar (not of compress_cmd), also in POSIX shells without pipefail.
+remote_archive_pipe_template = "{{ status=$( {{ {{ tar cf - {flist}; echo $? >&4; }} | {compress_cmd} >&3; }} 4>&1 ); }} 3>{target}; exit $status"
+
+def check_codec_available(name):
+    """check whether the python package needed by the codec is installed.
+    """
+    module_name = optional_codec_module_dict.get(name, None)
+    if module_name is None:
+        return True
+    try:
+        __import__(module_name)
+    except ImportError:
+        return False
+    return True
+
+def sample_entropy(file_list, sample_size=65536, max_sample_files=16):
+    """estimate the Shannon entropy (bits per byte) of the files from the head of each file.
+    The entropy of each sampled file is weighted by the file size.
+
+    Parameters
+    ----------
+    file_list : list of path-like
+        the files to be sampled; directories and missing files are skipped.
+    sample_size : int
+        the number of bytes read from each file.
+    max_sample_files : int
+        at most this number of files are sampled.
+
+    Returns
+    -------
+    entropy : float or None
+        the weighted entropy, None if no file can be sampled.
+    """
+    total_entropy = 0.
+    total_weight = 0
+    sample_files_count = 0
+    for fname in file_list:
+        if sample_files_count >= max_sample_files:
+            break
+        if not os.path.isfile(fname):
+            continue
+        with open(fname, 'rb') as fp:
+            data = fp.read(sample_size)
+        if len(data) == 0:
+            continue
+        sample_files_count += 1
+        entropy = 0.
+        for count in Counter(data).values():
+            p = count / len(data)
+            entropy -= p * math.log2(p)
+        weight = os.path.getsize(fname)
+        total_entropy += entropy * weight
+        total_weight += weight
+    if total_weight == 0:
+        return None
+    return total_entropy / total_weight
+
+
+class _NoneCompressor(object):
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class _LZ4Compressor(object):
+    """lz4.frame.LZ4FrameCompressor with the compressobj interface of zlib."""
+    def __init__(self, level):
+        import lz4.frame
+        self.compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self.header = self.compressor.begin()
+
+    def compress(self, data):
+        header, self.header = self.header, b''
+        return header + self.compressor.compress(data)
+
+    def flush(self):
+        header, self.header = self.header, b''
+        return header + self.compressor.flush()
+
+
+class CompressWriter(object):
+    """a write-only file object compressing the data written into it before passing it to fileobj.
+    close() flushes the compressor but does not close fileobj.
+    """
+    def __init__(self, fileobj, compressor):
+        self.fileobj = fileobj
+        self.compressor = compressor
+        self.closed = False
+
+    def write(self, data):
+        compressed_data = self.compressor.compress(data)
+        if compressed_data:
+            self.fileobj.write(compressed_data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            compressed_data = self.compressor.flush()
+            if compressed_data:
+                self.fileobj.write(compressed_data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class DecompressReader(object):
+    """a read-only file object decompressing the data read from fileobj.
+    """
+    def __init__(self, fileobj, decompressor, chunk_size=65536):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and not self.eof:
+            data = self.fileobj.read(self.chunk_size)
+            if not data:
+                self.eof = True
+                break
+            self.buffer += self.decompressor.decompress(data)
+        if size < 0 or size >= len(self.buffer):
+            ret = bytes(self.buffer)
+            self.buffer = bytearray()
+        else:
+            ret = bytes(self.buffer[:size])
+            del self.buffer[:size]
+        return ret
+
+
+class CompressionCodec(object):
+    """the compression applied to the tar archives transferred between the local and the remote machine.
+
+    Parameters
+    ----------
+    name : str
+        one of 'none', 'gzip', 'bz2', 'xz', 'zstd', 'lz4' and 'auto'.
+        'zstd' and 'lz4' need the python package zstandard and lz4 locally, and the zstd and lz4 command remotely.
+        'auto' samples the entropy of the files to upload; it uses 'none' for incompressible files
+        (for example, binary model files) and 'gzip' otherwise.
+    level : int
+        the compression level. If None, the default level of the codec is used.
+    """
+    def __init__(self, name='gzip', level=None):
+        if name != 'auto' and name not in compression_codec_dict:
+            raise RuntimeError("unknown compression codec {name}, must be one of {names}".format(
+                name=name, names=list(compression_codec_dict.keys()) + ['auto']))
+        if not check_codec_available(name):
+            raise RuntimeError("compression codec {name} needs the python package {module}".format(
+                name=name, module=optional_codec_module_dict[name]))
+        self.name = name
+        codec_dict = compression_codec_dict['gzip' if name == 'auto' else name]
+        if level is None:
+            level = codec_dict['default_level']
+        elif codec_dict['min_level'] is None:
+            raise RuntimeError("compression codec {name} does not support levels".format(name=name))
+        elif not (codec_dict['min_level'] <= level <= codec_dict['max_level']):
+            raise RuntimeError("compression level of {name} must be in the range [{min_level}, {max_level}]".format(
+                name=name, min_level=codec_dict['min_level'], max_level=codec_dict['max_level']))
+        self.level = level
+
+    def __repr__(self):
+        return "CompressionCodec(name={name}, level={level})".format(name=self.name, level=self.level)
+
+    def resolve(self, file_list=[]):
+        """return the concrete codec. Only the 'auto' codec depends on file_list.
+        """
+        if self.name != 'auto':
+            return self
+        entropy = sample_entropy(file_list)
+        if entropy is not None and entropy > incompressible_entropy_threshold:
+            return CompressionCodec('none')
+        return CompressionCodec('gzip', self.level)
+
+    @property
+    def suffix(self):
+        return compression_codec_dict[self.name]['suffix']
+
+    def get_remote_compress_cmd(self):
+        cmd = compression_codec_dict[self.name]['remote_compress_cmd']
+        if cmd is None:
+            return None
+        return cmd.format(level=self.level)
+
+    def get_remote_decompress_cmd(self):
+        return compression_codec_dict[self.name]['remote_decompress_cmd']
+
+    def get_compressor(self):
+        if self.name == 'none':
+            return None
+        elif self.name == 'gzip':
+            return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif self.name == 'bz2':
+            return bz2.BZ2Compressor(self.level)
+        elif self.name == 'xz':
+            return lzma.LZMACompressor(preset=self.level)
+        elif self.name == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor(level=self.level).compressobj()
+        elif self.name == 'lz4':
+            return _LZ4Compressor(self.level)
+        raise RuntimeError("compression codec {name} must be resolved before use".format(name=self.name))
+
+    def get_decompressor(self):
+        if self.name == 'none':
+            return None
+        elif self.name == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.name == 'bz2':
+            return bz2.BZ2Decompressor()
+        elif self.name == 'xz':
+            return lzma.LZMADecompressor()
+        elif self.name == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().decompressobj()
+        elif self.name == 'lz4':
+            import lz4.frame
+            return lz4.frame.LZ4FrameDecompressor()
+        raise RuntimeError("compression codec {name} must be resolved before use".format(name=self.name))
+
+    def open_writer(self, fileobj):
+        """wrap fileobj, so that the data written are compressed. Use it with the with statement."""
+        compressor = self.get_compressor()
+        if compressor is None:
+            compressor = _NoneCompressor()
+        return CompressWriter(fileobj, compressor)
+
+    def open_reader(self, fileobj):
+        """wrap fileobj, so that the data read are decompressed."""
+        decompressor = self.get_decompressor()
+        if decompressor is None:
+            return fileobj
+        return DecompressReader(fileobj, decompressor)
+
+    def get_remote_extract_cmd(self, extract_dir, archive_file=None):
+        """the remote command to extract an archive compressed by this codec into extract_dir.
+        The archive is read from archive_file, or from stdin if archive_file is None.
+        """
+        decompress_cmd = self.get_remote_decompress_cmd()
+        if decompress_cmd is None:
+            return 'tar xf {archive} -C {extract_dir}'.format(
+                archive='-' if archive_file is None else archive_file, extract_dir=extract_dir)
+        # a failure of decompress_cmd truncates the archive, which makes tar fail
+        return '{decompress_cmd} {redirect} | tar xf - -C {extract_dir}'.format(
+            decompress_cmd=decompress_cmd, redirect='' if archive_file is None else '< ' + archive_file, extract_dir=extract_dir)
+
+    def get_remote_archive_cmd(self, flist, archive_file=None):
+        """the remote command to archive the files in flist with this codec.
+        The archive is written to archive_file, or to stdout if archive_file is None.
+        """
+        compress_cmd = self.get_remote_compress_cmd()
+        if compress_cmd is None:
+            return 'tar cf {archive} {flist}'.format(
+                archive='-' if archive_file is None else archive_file, flist=flist)
+        return remote_archive_pipe_template.format(
+            flist=flist, compress_cmd=compress_cmd, target='&1' if archive_file is None else archive_file)
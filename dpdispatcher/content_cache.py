@@ -0,0 +1,198 @@
+import os, shutil, uuid, json
+
+from dpdispatcher.utils import get_sha256
+
+# the content-addressed store lies in this directory under the session root;
+# each entry is a read-only file named after the sha256 hex digest of its content.
+cache_dir_name = '.cas'
+
+# the index of the store, a json file in its directory: the [size, mtime] of each entry
+# when its content was last found to have the sha256 it is named after (see LocalContentCache.check_entry).
+# The mtime is in ns in a local store, and in seconds in a remote one (see SSHContext._put_files_cached);
+# a record written by the other does not match, and the entry is only hashed once more.
+cache_index_name = 'index.json'
+
+# the default size cap of the store
+default_cache_max_bytes = 20 * 1024 * 1024 * 1024
+
+def get_evicted_entries(entry_list, max_bytes, keep_entries=()):
+    """select the least recently used entries to remove, until the total size is within max_bytes.
+
+    Parameters
+    ----------
+    entry_list : list of tuple
+        (name, size, mtime) of each entry; the mtime is refreshed each time the entry is used.
+    max_bytes : int
+        the size cap of the store.
+    keep_entries : collection of str
+        the entries in use, which are never evicted.
+
+    Returns
+    -------
+    evicted_entry_list : list of str
+        the names of the entries to remove, the least recently used first.
+    """
+    total_bytes = sum([entry[1] for entry in entry_list])
+    evicted_entry_list = []
+    for name, size, mtime in sorted(entry_list, key=lambda entry: (entry[2], entry[0])):
+        if total_bytes <= max_bytes:
+            break
+        if name in keep_entries:
+            continue
+        evicted_entry_list.append(name)
+        total_bytes -= size
+    return evicted_entry_list
+
+
+class LocalContentCache(object):
+    """a content-addressed store of files on the local file system.
+
+    Parameters
+    ----------
+    cache_root : path-like
+        the directory of the store.
+    max_bytes : int
+        the size cap of the store; the least recently used entries beyond it are removed by evict().
+    """
+    def __init__(self, cache_root, max_bytes=default_cache_max_bytes):
+        self.cache_root = cache_root
+        self.max_bytes = max_bytes
+        # the index of the store, read at its first use, and the records changed since, written by save_index
+        self._index = None
+        self._index_update_dict = {}
+
+    def get_entry_path(self, sha256):
+        return os.path.join(self.cache_root, sha256)
+
+    def has_entry(self, sha256):
+        return os.path.isfile(self.get_entry_path(sha256))
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = _read_index(os.path.join(self.cache_root, cache_index_name))
+        return self._index
+
+    def _set_index_record(self, sha256, record):
+        """set the [size, mtime] of the entry in the index, or remove the entry from the index if record is None."""
+        if record is None:
+            self._get_index().pop(sha256, None)
+        else:
+            self._get_index()[sha256] = record
+        self._index_update_dict[sha256] = record
+
+    def _get_entry_record(self, entry_path):
+        entry_stat = os.stat(entry_path)
+        return [entry_stat.st_size, entry_stat.st_mtime_ns]
+
+    def check_entry(self, sha256):
+        """whether the entry exists and its content still has the sha256 it is named after.
+        The linked files are the same inode as the entry, so a writer ignoring its mode (a job running as root,
+        or one doing chmod u+w) changes the entry for all its later users; such an entry is removed, to be added again.
+        The content is only hashed when the size or the mtime of the entry is not the one in the index,
+        that is once after the entry is changed; see save_index.
+        """
+        entry_path = self.get_entry_path(sha256)
+        if not os.path.isfile(entry_path):
+            return False
+        entry_record = self._get_entry_record(entry_path)
+        if self._get_index().get(sha256, None) == entry_record:
+            return True
+        if get_sha256(entry_path) == sha256:
+            self._set_index_record(sha256, entry_record)
+            return True
+        os.remove(entry_path)
+        self._set_index_record(sha256, None)
+        return False
+
+    def add_entry(self, fname, sha256):
+        """copy the file fname into the store, unless the entry already exists."""
+        entry_path = self.get_entry_path(sha256)
+        if os.path.isfile(entry_path):
+            return
+        os.makedirs(self.cache_root, exist_ok=True)
+        # copy to a temporary name first, so that no reader ever sees a partial entry
+        temp_path = entry_path + '.' + uuid.uuid4().hex
+        shutil.copyfile(fname, temp_path)
+        os.chmod(temp_path, 0o444)
+        os.replace(temp_path, entry_path)
+        # the content was hashed by the caller
+        self._set_index_record(sha256, self._get_entry_record(entry_path))
+
+    def touch_entry(self, sha256):
+        """mark the entry as recently used. Its record in the index follows the new mtime if the entry was not changed."""
+        entry_path = self.get_entry_path(sha256)
+        entry_record = self._get_entry_record(entry_path)
+        os.utime(entry_path)
+        if self._get_index().get(sha256, None) == entry_record:
+            self._set_index_record(sha256, self._get_entry_record(entry_path))
+
+    def link_entry(self, sha256, fname):
+        """hardlink the entry to fname (copy it if hardlinks are not possible) and mark it as recently used.
+        The entry is read-only, and so is the linked file, which is the same inode; check the entry (see check_entry) first.
+        """
+        entry_path = self.get_entry_path(sha256)
+        self.touch_entry(sha256)
+        if os.path.lexists(fname):
+            os.remove(fname)
+        dirname = os.path.dirname(fname)
+        if dirname != "":
+            os.makedirs(dirname, exist_ok=True)
+        try:
+            os.link(entry_path, fname)
+        except OSError:
+            shutil.copyfile(entry_path, fname)
+
+    def list_entries(self):
+        entry_list = []
+        if not os.path.isdir(self.cache_root):
+            return entry_list
+        with os.scandir(self.cache_root) as entries:
+            for entry in entries:
+                if entry.is_file() and len(entry.name) == 64:
+                    entry_stat = entry.stat()
+                    entry_list.append((entry.name, entry_stat.st_size, entry_stat.st_mtime))
+        return entry_list
+
+    def evict(self, keep_entries=()):
+        """remove the least recently used entries beyond max_bytes, and save the index (see save_index)."""
+        entry_list = self.list_entries()
+        evicted_entry_list = get_evicted_entries(entry_list, self.max_bytes, keep_entries=keep_entries)
+        for name in evicted_entry_list:
+            os.remove(self.get_entry_path(name))
+        # the entries evicted, here or by another process, leave the index
+        left_entry_set = set([entry[0] for entry in entry_list]) - set(evicted_entry_list)
+        for sha256 in list(self._get_index().keys()):
+            if sha256 not in left_entry_set:
+                self._set_index_record(sha256, None)
+        self.save_index()
+        return evicted_entry_list
+
+    def save_index(self):
+        """write the records of the index changed since it was read. The index may be shared by several processes:
+        it is read again and the changes are merged into it, and the one written replaces it at once.
+        A record lost to another process only makes the entry be hashed once more.
+        """
+        if len(self._index_update_dict) == 0:
+            return
+        index_path = os.path.join(self.cache_root, cache_index_name)
+        index = _read_index(index_path)
+        for sha256, record in self._index_update_dict.items():
+            if record is None:
+                index.pop(sha256, None)
+            else:
+                index[sha256] = record
+        os.makedirs(self.cache_root, exist_ok=True)
+        temp_path = index_path + '.' + uuid.uuid4().hex
+        with open(temp_path, 'w') as fp:
+            json.dump(index, fp)
+        os.replace(temp_path, index_path)
+        self._index = index
+        self._index_update_dict = {}
+
+
+def _read_index(index_path):
+    try:
+        with open(index_path, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
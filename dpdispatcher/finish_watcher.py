@@ -0,0 +1,145 @@
+import os, sys, time, select, struct
+import ctypes, ctypes.util
+from dpdispatcher import dlog
+
+# the suffix of the files touched by the job scripts when the jobs finish
+job_tag_finished_suffix = '_job_tag_finished'
+
+# ref: /usr/include/linux/inotify.h
+inotify_flag_dict = {
+    'IN_ATTRIB': 0x00000004,
+    'IN_MOVED_TO': 0x00000080,
+    'IN_CREATE': 0x00000100,
+    'IN_Q_OVERFLOW': 0x00004000,
+    'IN_NONBLOCK': 0o4000,
+    'IN_CLOEXEC': 0o2000000,
+}
+
+inotify_event_struct = struct.Struct('iIII')
+
+def _load_inotify_libc():
+    """the libc with the inotify functions, None if inotify is not available (for example, not on linux)."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FinishTagWatcher(object):
+    """wait for the job_tag_finished files to appear in a local directory,
+    so that the dispatcher wakes up as soon as a job finishes instead of sleeping a fixed interval.
+
+    inotify is used through ctypes on linux. Otherwise (or if inotify fails) the directory is polled:
+    each poll costs one os.stat of the directory, and the directory is only listed when its mtime changes.
+
+    Parameters
+    ----------
+    watch_dir : path-like
+        the directory where the job_tag_finished files are created.
+    poll_interval : float
+        the interval (seconds) between two polls when inotify is not used.
+    use_inotify : bool
+        whether to try inotify before falling back to polling.
+    """
+    def __init__(self, watch_dir, poll_interval=0.5, use_inotify=True):
+        self.watch_dir = watch_dir
+        self.poll_interval = poll_interval
+        self.inotify_fd = None
+        if use_inotify:
+            self.inotify_fd = self._init_inotify()
+        if self.inotify_fd is None:
+            self.dir_mtime_ns = None
+            self.tag_set = set()
+            self._check_new_tags()
+
+    @property
+    def backend(self):
+        return 'inotify' if self.inotify_fd is not None else 'polling'
+
+    def _init_inotify(self):
+        libc = _load_inotify_libc()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(inotify_flag_dict['IN_NONBLOCK'] | inotify_flag_dict['IN_CLOEXEC'])
+        if fd < 0:
+            dlog.debug('inotify_init1 fails with errno %d, fall back to polling' % ctypes.get_errno())
+            return None
+        mask = inotify_flag_dict['IN_CREATE'] | inotify_flag_dict['IN_MOVED_TO'] | inotify_flag_dict['IN_ATTRIB']
+        wd = libc.inotify_add_watch(fd, os.fsencode(self.watch_dir), mask)
+        if wd < 0:
+            dlog.debug('inotify_add_watch %s fails with errno %d, fall back to polling' % (self.watch_dir, ctypes.get_errno()))
+            os.close(fd)
+            return None
+        return fd
+
+    def wait(self, timeout):
+        """block until a job_tag_finished file appears or timeout (seconds) passes.
+
+        Returns
+        -------
+        if_found : bool
+            True if a job_tag_finished file appeared, False on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        if self.inotify_fd is not None:
+            return self._wait_inotify(deadline)
+        return self._wait_polling(deadline)
+
+    def _wait_inotify(self, deadline):
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self.inotify_fd], [], [], remaining)
+            if not readable:
+                return False
+            try:
+                data = os.read(self.inotify_fd, 65536)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_len = inotify_event_struct.unpack_from(data, offset)
+                offset += inotify_event_struct.size
+                name = data[offset:offset+name_len].rstrip(b'\0').decode('utf-8', 'replace')
+                offset += name_len
+                if (mask & inotify_flag_dict['IN_Q_OVERFLOW']) or name.endswith(job_tag_finished_suffix):
+                    return True
+
+    def _wait_polling(self, deadline):
+        while True:
+            if self._check_new_tags():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def _check_new_tags(self):
+        try:
+            dir_mtime_ns = os.stat(self.watch_dir).st_mtime_ns
+        except OSError:
+            return False
+        # on file systems with a coarse mtime, a file created in the same tick as the last listing
+        # leaves the mtime unchanged, so a recently modified directory is always listed
+        if dir_mtime_ns == self.dir_mtime_ns and time.time() - dir_mtime_ns / 1e9 > 2:
+            return False
+        self.dir_mtime_ns = dir_mtime_ns
+        tag_set = set()
+        with os.scandir(self.watch_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(job_tag_finished_suffix):
+                    tag_set.add(entry.name)
+        if_new_tag = len(tag_set - self.tag_set) > 0
+        self.tag_set = tag_set
+        return if_new_tag
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
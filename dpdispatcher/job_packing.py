@@ -0,0 +1,57 @@
+import math, heapq
+
+# the packing strategies of Submission.generate_jobs
+packing_strategy_list = ['random', 'lpt', 'ffd']
+
+def pack_lpt(cost_list, group_size):
+    """longest processing time first: the tasks are taken from the most costly to the least,
+    and each goes to the job with the least total cost that has fewer than group_size tasks.
+    The number of jobs is the same as slicing the tasks into chunks of group_size.
+    Ties are broken by the task index and the job index, so that the packing is deterministic.
+
+    Parameters
+    ----------
+    cost_list : list of float
+        the cost of each task.
+    group_size : int
+        the largest number of tasks in a job.
+
+    Returns
+    -------
+    index_ll : list of list of int
+        the indices of the tasks of each job.
+    """
+    job_num = math.ceil(len(cost_list) / group_size)
+    index_ll = [[] for ii in range(job_num)]
+    job_heap = [(0., ii) for ii in range(job_num)]
+    for task_index in sorted(range(len(cost_list)), key=lambda ii: (-cost_list[ii], ii)):
+        job_cost, job_index = heapq.heappop(job_heap)
+        index_ll[job_index].append(task_index)
+        if len(index_ll[job_index]) < group_size:
+            heapq.heappush(job_heap, (job_cost + cost_list[task_index], job_index))
+    return index_ll
+
+def pack_ffd(cost_list, group_size):
+    """first fit decreasing: the tasks are taken from the most costly to the least,
+    and each goes to the first job where it fits, within the capacity and within group_size tasks;
+    a new job is opened when it fits nowhere. It takes O(tasks * jobs) time, while pack_lpt takes O(tasks * log(jobs)).
+    The capacity is the larger of the most costly task and the total cost divided by
+    the number of jobs of slicing the tasks into chunks of group_size, so there may be a few more jobs than that.
+
+    Parameters and Returns are the same as pack_lpt.
+    """
+    job_num = math.ceil(len(cost_list) / group_size)
+    capacity = max(max(cost_list), sum(cost_list) / job_num) * (1 + 1e-9)
+    index_ll = []
+    job_cost_list = []
+    for task_index in sorted(range(len(cost_list)), key=lambda ii: (-cost_list[ii], ii)):
+        for job_index in range(len(index_ll)):
+            if len(index_ll[job_index]) < group_size and job_cost_list[job_index] + cost_list[task_index] <= capacity:
+                break
+        else:
+            job_index = len(index_ll)
+            index_ll.append([])
+            job_cost_list.append(0.)
+        index_ll[job_index].append(task_index)
+        job_cost_list[job_index] += cost_list[task_index]
+    return index_ll
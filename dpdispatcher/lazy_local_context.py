@@ -2,6 +2,8 @@ import os,shutil,uuid
 import subprocess as sp
 from glob import glob
 from dpdispatcher import dlog
+from dpdispatcher.finish_watcher import FinishTagWatcher
+from dpdispatcher.local_context import check_files_exist_under
 
 class SPRetObj(object) :
     def __init__ (self,
@@ -46,7 +48,14 @@ class LazyLocalContext(object) :
     def upload(self,
                jobs,
                # local_up_files,
-               dereference = True) :
+               dereference = True,
+               *,
+               job_list=None) :
+        pass
+
+    def upload_job(self,
+                   job,
+                   dereference = True) :
         pass
 
     def download(self, 
@@ -54,7 +63,16 @@ class LazyLocalContext(object) :
                  # remote_down_files,
                  check_exists = False,
                  mark_failure = True,
-                 back_error=False) :
+                 back_error=False,
+                 *,
+                 job_list=None) :
+        pass
+
+    def download_job(self,
+                     job,
+                     check_exists = False,
+                     mark_failure = True,
+                     back_error=False) :
         pass
      #    for ii in job_dirs :
      #        for jj in remote_down_files :
@@ -104,6 +122,11 @@ class LazyLocalContext(object) :
         with open(os.path.join(self.local_root, self.submission.work_base, fname), 'w') as fp :
             fp.write(write_str)
 
+    def append_file(self, fname, write_str):
+        os.makedirs(os.path.join(self.local_root, self.submission.work_base), exist_ok = True)
+        with open(os.path.join(self.local_root, self.submission.work_base, fname), 'a') as fp :
+            fp.write(write_str)
+
     def read_file(self, fname):
         with open(os.path.join(self.local_root, self.submission.work_base, fname), 'r') as fp:
             ret = fp.read()
@@ -111,7 +134,27 @@ class LazyLocalContext(object) :
 
     def check_file_exists(self, fname):
         return os.path.isfile(os.path.join(self.local_root, fname))
+
+    def check_files_exist(self, fname_list):
+        """check whether many files exist. 
+        Each directory involved is listed with one os.scandir pass, instead of one stat per file.
+
+        Parameters
+        ----------
+        fname_list : list of str
+            the file names relative to local_root
+
+        Returns
+        -------
+        if_exist_dict : dict
+            whether each file exists, indexed by the file name
+        """
+        return check_files_exist_under(self.local_root, fname_list)
         
+    def create_finish_watcher(self):
+        """a watcher waking up as soon as a job_tag_finished file appears in remote_root."""
+        return FinishTagWatcher(self.remote_root)
+
     def call(self, cmd) :
         cwd = os.getcwd()
         os.chdir(self.local_root)
@@ -2,6 +2,42 @@ import os,shutil,uuid,hashlib
 import subprocess as sp
 from glob import glob
 from dpdispatcher import dlog
+from dpdispatcher.finish_watcher import FinishTagWatcher
+from dpdispatcher.content_cache import LocalContentCache, cache_dir_name, default_cache_max_bytes
+from dpdispatcher.utils import get_sha256_many, expand_file_list
+
+def check_files_exist_under(root, fname_list):
+    """check whether many files under root exist.
+    Each directory involved is listed with one os.scandir pass, instead of one stat per file.
+
+    Parameters
+    ----------
+    root : path-like
+        the directory the file names are relative to
+    fname_list : list of str
+        the file names relative to root
+
+    Returns
+    -------
+    if_exist_dict : dict
+        whether each file exists, indexed by the file name
+    """
+    dir_file_set_dict = {}
+    if_exist_dict = {}
+    for fname in fname_list:
+        dirname, basename = os.path.split(os.path.normpath(fname))
+        if dirname not in dir_file_set_dict:
+            file_set = set()
+            try:
+                with os.scandir(os.path.join(root, dirname)) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            file_set.add(entry.name)
+            except OSError:
+                pass
+            dir_file_set_dict[dirname] = file_set
+        if_exist_dict[fname] = basename in dir_file_set_dict[dirname]
+    return if_exist_dict
 
 class LocalSession (object) :
     def __init__ (self, jdata) :
@@ -43,10 +79,20 @@ class LocalContext(object) :
     def __init__ (self,
                   local_root,
                   work_profile,
-                  job_uuid = None) :
+                  job_uuid = None,
+                  *,
+                  remote_cache = False,
+                  remote_cache_max_bytes = default_cache_max_bytes) :
         """
         work_profile:
         local_root:
+        remote_cache: if True, the forward_common_files are kept in a content-addressed store 
+            (<work_root>/.cas/<sha256>) shared by all the submissions, and hardlinked from there
+            instead of symlinked to the local files. The entries are read-only, and so are the forward_common_files
+            in remote_root, which are the same inodes: do not use it for common files the jobs rewrite or append to.
+            An entry is checked against its sha256 before it is linked, and copied again if it was changed;
+            it is only hashed when its size or mtime changed since it was last checked, see LocalContentCache.check_entry.
+        remote_cache_max_bytes: the size cap of the store, the least recently used entries beyond it are removed.
         """
         assert(type(local_root) == str)
         self.temp_local_root = os.path.abspath(local_root)
@@ -54,6 +100,8 @@ class LocalContext(object) :
         self.work_profile = work_profile
         self.job_uuid = job_uuid
         self.submission = None
+        self.remote_cache = remote_cache
+        self.remote_cache_max_bytes = remote_cache_max_bytes
         # if job_uuid:
         #    self.job_uuid = job_uuid
         # else:
@@ -91,41 +139,63 @@ class LocalContext(object) :
    #      self._local_root =  os.path.join(, self.submission.submission_hash, self.submission.work_base)
    #      return self._local_root
 
-    def upload(self, submission):
+    def upload(self, submission, *, job_list=None):
+        """link the forward_files of the tasks and the forward_common_files of the submission into remote_root.
+        If job_list is given, only the tasks of these jobs are uploaded.
+        """
         os.makedirs(self.remote_root, exist_ok = True)
-        # os.makedirs(self.remote_root, exist_ok = True)
-        cwd = os.getcwd()
-        # job_dirs = [ ii.task_work_path for ii in submission.belonging_tasks]
-        for ii in submission.belonging_tasks:
-            local_job = os.path.join(self.local_root, ii.task_work_path)
-            remote_job = os.path.join(self.remote_root, ii.task_work_path)
-            os.makedirs(remote_job, exist_ok = True)
-            os.chdir(remote_job)
-            for jj in ii.forward_files :
-                if not os.path.exists(os.path.join(local_job, jj)):
-                    os.chdir(cwd)
-                    raise RuntimeError('cannot find upload file ' + os.path.join(local_job, jj))
-                if os.path.exists(os.path.join(remote_job, jj)) :
-                    os.remove(os.path.join(remote_job, jj))
-                _check_file_path(jj)
-                os.symlink(os.path.join(local_job, jj),
-                           os.path.join(remote_job, jj))
-        os.chdir(cwd)
+        if job_list is None:
+            task_list = submission.belonging_tasks
+        else:
+            task_list = [task for job in job_list for task in job.job_task_list]
+        for ii in task_list:
+            self._link_files(ii.task_work_path, ii.forward_files)
+
+        if self.remote_cache:
+            self._upload_cached(submission.forward_common_files)
+        else:
+            self._link_files('', submission.forward_common_files)
+
+    def upload_job(self, job):
+        """link the forward_files of the tasks of one job into remote_root. 
+        It does not change the working directory, so it may run in parallel threads.
+        """
+        for ii in job.job_task_list:
+            self._link_files(ii.task_work_path, ii.forward_files)
 
-        local_job = self.local_root
-        remote_job = self.remote_root
-        # os.makedirs(remote_job, exist_ok = True)
-        os.chdir(remote_job)
-        for jj in submission.forward_common_files :
+    def _link_files(self, work_path, files):
+        local_job = os.path.join(self.local_root, work_path)
+        remote_job = os.path.join(self.remote_root, work_path)
+        os.makedirs(remote_job, exist_ok = True)
+        for jj in files :
             if not os.path.exists(os.path.join(local_job, jj)):
-                os.chdir(cwd)
                 raise RuntimeError('cannot find upload file ' + os.path.join(local_job, jj))
             if os.path.exists(os.path.join(remote_job, jj)) :
                 os.remove(os.path.join(remote_job, jj))
-            _check_file_path(jj)
+            _check_file_path(os.path.join(remote_job, jj))
             os.symlink(os.path.join(local_job, jj),
                        os.path.join(remote_job, jj))
-        os.chdir(cwd)
+
+    def _upload_cached(self, files):
+        """hardlink the files into remote_root through the content-addressed store, 
+        copying only the files whose content is not stored yet.
+        """
+        for jj in files:
+            if not os.path.exists(os.path.join(self.local_root, jj)):
+                raise RuntimeError('cannot find upload file ' + os.path.join(self.local_root, jj))
+        cache = LocalContentCache(os.path.join(self.temp_remote_root, cache_dir_name), max_bytes=self.remote_cache_max_bytes)
+        local_file_list = expand_file_list(self.local_root, files)
+        sha256_dict = get_sha256_many([os.path.join(self.local_root, jj) for jj in local_file_list])
+        hit_count = 0
+        for jj in local_file_list:
+            sha256 = sha256_dict[os.path.join(self.local_root, jj)]
+            if cache.check_entry(sha256):
+                hit_count += 1
+            else:
+                cache.add_entry(os.path.join(self.local_root, jj), sha256)
+            cache.link_entry(sha256, os.path.join(self.remote_root, jj))
+        dlog.info('remote cache: %d of %d files found in %s' % (hit_count, len(local_file_list), cache.cache_root))
+        cache.evict(keep_entries=set(sha256_dict.values()))
 
     def upload_(self,
                job_dirs,
@@ -153,15 +223,49 @@ class LocalContext(object) :
                  submission,
                  check_exists = False,
                  mark_failure = True,
-                 back_error=False) :
+                 back_error=False,
+                 *,
+                 job_list=None) :
+        """download the backward_files of the tasks and the backward_common_files of the submission.
+        If job_list is given, only the tasks of these jobs are downloaded.
+        """
+        if job_list is None:
+            task_list = submission.belonging_tasks
+            job_list = submission.belonging_jobs
+        else:
+            task_list = [task for job in job_list for task in job.job_task_list]
+        work_file_list = [(task.task_work_path, task.backward_files) for task in task_list]
+        work_file_list.append(('', submission.backward_common_files))
+        work_file_list.append(('', self._get_existing_job_files(job_list)))
+        self._download_files(work_file_list, check_exists=check_exists, mark_failure=mark_failure, back_error=back_error)
+
+    def download_job(self,
+                     job,
+                     check_exists = False,
+                     mark_failure = True,
+                     back_error=False) :
+        """download the backward_files of the tasks of one job."""
+        work_file_list = [(task.task_work_path, task.backward_files) for task in job.job_task_list]
+        work_file_list.append(('', self._get_existing_job_files([job])))
+        self._download_files(work_file_list, check_exists=check_exists, mark_failure=mark_failure, back_error=back_error)
+
+    def _get_existing_job_files(self, job_list):
+        # the files of the jobs (see Job.get_backward_job_files) are optional:
+        # they are missing when no task of the job was run
+        return [fname for job in job_list for fname in job.get_backward_job_files()
+            if os.path.exists(os.path.join(self.remote_root, fname))]
+
+    def _download_files(self,
+                        work_file_list,
+                        check_exists = False,
+                        mark_failure = True,
+                        back_error=False) :
+        # work_file_list: list of (work path relative to local_root, the files under it)
         cwd = os.getcwd()
-         
-        for ii in submission.belonging_tasks:
-        # for ii in job_dirs :
-            local_job = os.path.join(self.local_root, ii.task_work_path)
-            remote_job = os.path.join(self.remote_root, ii.task_work_path)
-            # flist = remote_down_files
-            flist = ii.backward_files
+        for task_work_path, backward_files in work_file_list:
+            flist = list(backward_files)
+            local_job = os.path.join(self.local_root, task_work_path)
+            remote_job = os.path.join(self.remote_root, task_work_path)
             if back_error :
                 os.chdir(remote_job)
                 flist += glob('error*')                        
@@ -173,7 +277,7 @@ class LocalContext(object) :
                     if (not os.path.exists(rfile)) and (not os.path.exists(lfile)):
                         if check_exists :
                             if mark_failure:
-                                with open(os.path.join(self.local_root, ii, 'tag_failure_download_%s' % jj), 'w') as fp: pass
+                                with open(os.path.join(local_job, 'tag_failure_download_%s' % jj), 'w') as fp: pass
                             else :
                                 pass
                         else :
@@ -199,54 +303,6 @@ class LocalContext(object) :
                     # no nothing in the case of linked files
                     pass
         os.chdir(cwd)
-        # for ii in submission.belonging_tasks:
-        # for ii in job_dirs :
-            # local_job = os.path.join(self.local_root, ii.task_work_path)
-            # remote_job = os.path.join(self.remote_root, ii.task_work_path)
-            # flist = remote_down_files
-            # flist = ii.backward_files
-        local_job = self.local_root
-        remote_job = self.remote_root
-        flist = submission.backward_common_files
-        if back_error :
-            os.chdir(remote_job)
-            flist += glob('error*')                        
-            os.chdir(cwd)
-        for jj in flist :
-            rfile = os.path.join(remote_job, jj)
-            lfile = os.path.join(local_job, jj)
-            if not os.path.realpath(rfile) == os.path.realpath(lfile) :
-                if (not os.path.exists(rfile)) and (not os.path.exists(lfile)):
-                    if check_exists :
-                        if mark_failure:
-                            with open(os.path.join(self.local_root, 'tag_failure_download_%s' % jj), 'w') as fp: pass
-                        else :
-                            pass
-                    else :
-                        raise RuntimeError('do not find download file ' + rfile)
-                elif (not os.path.exists(rfile)) and (os.path.exists(lfile)) :
-                    # already downloaded
-                    pass
-                elif (os.path.exists(rfile)) and (not os.path.exists(lfile)) :
-                    # trivial case, download happily
-                    shutil.move(rfile, lfile)
-                elif (os.path.exists(rfile)) and (os.path.exists(lfile)) :
-                    # both exists, replace!
-                    dlog.info('find existing %s, replacing by %s' % (lfile, rfile))
-                    if os.path.isdir(lfile):
-                        shutil.rmtree(lfile, ignore_errors=True)
-                    elif os.path.isfile(lfile) or os.path.islink(lfile):
-                        os.remove(lfile)
-                    shutil.copyfile(rfile, lfile)
-                    # shutil.move(rfile, lfile)
-                else :
-                    raise RuntimeError('should not reach here!')
-            else :
-                # no nothing in the case of linked files
-                pass
-        os.chdir(cwd)
-
-     
 
     def download_(self, 
                  job_dirs,
@@ -333,6 +389,11 @@ class LocalContext(object) :
         with open(os.path.join(self.remote_root, fname), 'w') as fp :
             fp.write(write_str)
 
+    def append_file(self, fname, write_str):
+        os.makedirs(self.remote_root, exist_ok = True)
+        with open(os.path.join(self.remote_root, fname), 'a') as fp :
+            fp.write(write_str)
+
     def read_file(self, fname):
         with open(os.path.join(self.remote_root, fname), 'r') as fp:
             ret = fp.read()
@@ -343,7 +404,27 @@ class LocalContext(object) :
         # print('%%%', os.path.join(self.remote_root, fname))
         # print('$$$', os.path.isfile(os.path.join(self.remote_root, fname)))
         return os.path.isfile(os.path.join(self.remote_root, fname))
+
+    def check_files_exist(self, fname_list):
+        """check whether many files exist. 
+        Each directory involved is listed with one os.scandir pass, instead of one stat per file.
+
+        Parameters
+        ----------
+        fname_list : list of str
+            the file names relative to remote_root
+
+        Returns
+        -------
+        if_exist_dict : dict
+            whether each file exists, indexed by the file name
+        """
+        return check_files_exist_under(self.remote_root, fname_list)
         
+    def create_finish_watcher(self):
+        """a watcher waking up as soon as a job_tag_finished file appears in remote_root."""
+        return FinishTagWatcher(self.remote_root)
+
     def call(self, cmd) :
         cwd = os.getcwd()
         os.chdir(self.remote_root)
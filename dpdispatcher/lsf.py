@@ -0,0 +1,218 @@
+import os,sys,time,random,uuid,shlex
+
+from dpdispatcher.JobStatus import JobStatus
+from dpdispatcher import dlog
+from dpdispatcher.batch import Batch
+
+lsf_script_template="""\
+{lsf_script_header}
+{lsf_script_env}
+{lsf_script_command}
+{lsf_script_end}
+"""
+
+lsf_script_header_template="""\
+#!/bin/bash -l
+#BSUB -e {lsf_log_name}.err
+#BSUB -o {lsf_log_name}.out
+{lsf_nodes_line}
+{lsf_ptile_line}
+{lsf_number_gpu_line}
+{lsf_queue_name_line}
+"""
+
+lsf_script_env_template="""
+export REMOTE_ROOT={remote_root}
+test $? -ne 0 && exit 1
+"""
+
+lsf_script_command_template="""
+cd $REMOTE_ROOT
+cd {task_work_path}
+test $? -ne 0 && exit 1
+if [ ! -f {task_tag_finished} ] ;then
+  {command_env} {command}  1>> {outlog} 2>> {errlog}
+  if test $? -ne 0; then touch {task_tag_finished}; fi
+  touch {task_tag_finished}
+fi &
+"""
+
+lsf_script_end_template="""
+
+cd $REMOTE_ROOT
+test $? -ne 0 && exit 1
+
+wait
+
+touch {job_tag_finished}
+"""
+
+lsf_script_wait="""
+wait
+"""
+
+lsf_finished_status_words=["DONE","EXIT"]
+
+class LSF(Batch):
+    def gen_script(self, job):
+        lsf_script_command, lsf_script_end = self._gen_script_command_end(job)
+        lsf_script = lsf_script_template.format(
+                          lsf_script_header=self.gen_script_header(job),
+                          lsf_script_env=self.gen_script_env(job),
+                          lsf_script_command=lsf_script_command,
+                          lsf_script_end=lsf_script_end)
+        return lsf_script
+
+    def gen_script_header(self, job, log_name='%J'):
+        resources = job.resources
+
+        script_header_dict = {}
+        script_header_dict['lsf_log_name'] = log_name
+        script_header_dict['lsf_nodes_line']="#BSUB -n {number_cores}".format(
+            number_cores=resources.number_node*resources.cpu_per_node)
+        script_header_dict['lsf_ptile_line']="#BSUB -R 'span[ptile={cpu_per_node}]'".format(cpu_per_node=resources.cpu_per_node)
+        if resources.gpu_per_node > 0:
+            script_header_dict['lsf_number_gpu_line']="#BSUB -gpu 'num={gpu_per_node}'".format(gpu_per_node=resources.gpu_per_node)
+        else:
+            script_header_dict['lsf_number_gpu_line']=""
+        script_header_dict['lsf_queue_name_line']="#BSUB -q {queue_name}".format(queue_name=resources.queue_name)
+        return lsf_script_header_template.format(**script_header_dict)
+
+    def gen_array_script_header(self, job):
+        # %J is the id of the whole array, so each element writes its own logs with its index %I
+        return self.gen_script_header(job, log_name='%J_%I')
+
+    def gen_script_env(self, job):
+        script_env_dict = {}
+        script_env_dict['remote_root'] = self.context.remote_root
+        return lsf_script_env_template.format(**script_env_dict)
+
+    def _gen_script_command_end(self, job):
+        lsf_script_command = self.gen_script_command(job, job.resources, lsf_script_command_template, lsf_script_wait)
+
+        job_tag_finished = job.job_hash + '_job_tag_finished'
+        lsf_script_end = lsf_script_end_template.format(job_tag_finished=job_tag_finished)
+        return lsf_script_command, lsf_script_end
+
+    def gen_script_body(self, job):
+        """the commands running the tasks of the job and touching its job_tag_finished."""
+        return '\n'.join(self._gen_script_command_end(job))
+
+    def do_submit(self, job):
+        script_file_name = job.script_file_name
+        script_str = self.gen_script(job)
+        job_id_name = job.job_hash + '_job_id'
+        self.context.write_file(fname=script_file_name, write_str=script_str)
+        stdin, stdout, stderr = self.context.block_checkcall('cd %s && %s < %s' % (self.context.remote_root, 'bsub', script_file_name))
+        subret = (stdout.readlines())
+        # Job <12345> is submitted to queue <normal>.
+        job_id = subret[0].split()[1][1:-1]
+        self.context.write_file(job_id_name, job_id)
+        return job_id
+
+    def do_submit_array(self, jobs):
+        """submit the jobs as one LSF job array with bsub -J "dpdisp_<hash>[1-N]%throttle".
+        The array element of each job runs the body of the job script, and its job id is <array_id>[<index>];
+        the LSF array indices start from 1.
+        There are at most self.max_array_size jobs, see Batch.do_submit_many.
+        """
+        array_hash = self.get_array_hash(jobs)
+        script_file_name = array_hash + '_array.sub'
+        self.context.write_file(fname=script_file_name, write_str=self.gen_array_script(jobs, 'LSB_JOBINDEX', first_index=1))
+        array_name = 'dpdisp_%s[1-%d]' % (array_hash[:8], len(jobs))
+        if self.array_throttle is not None:
+            array_name += '%%%d' % self.array_throttle
+        stdin, stdout, stderr = self.context.block_checkcall('cd %s && %s -J %s < %s' % (self.context.remote_root, 'bsub', 
+            shlex.quote(array_name), script_file_name))
+        subret = (stdout.readlines())
+        # Job <12345> is submitted to queue <normal>.
+        array_id = subret[0].split()[1][1:-1]
+        self.context.write_file(array_hash + '_array_job_id', array_id)
+        return {job.job_hash: '%s[%d]' % (array_id, ii + 1) for ii, job in enumerate(jobs)}
+
+    def default_resources(self, resources) :
+        pass
+
+    def check_status(self, job):
+        job_id = job.job_id
+        if job_id == "" :
+            return JobStatus.unsubmitted
+        ret, stdin, stdout, stderr\
+            = self.context.block_call ("bjobs " + shlex.quote(job_id))
+        err_str = stderr.read().decode('utf-8')
+        if ("Job <%s> is not found" % job_id) in err_str :
+            if self.check_finish_tag(job) :
+                return JobStatus.finished
+            else :
+                return JobStatus.terminated
+        elif ret != 0 :
+            raise RuntimeError ("status command bjobs fails to execute. erro info: %s return code %d"
+                                    % (err_str, ret))
+        status_out = stdout.read().decode('utf-8').split('\n')
+        if len(status_out) < 2:
+            return JobStatus.unknown
+        status_word = status_out[1].split()[2]
+        return self._get_job_state_from_status_word(job, status_word)
+
+    def check_status_many(self, jobs):
+        job_state_dict = {}
+        submitted_jobs = []
+        for job in jobs:
+            if job.job_id == "":
+                job_state_dict[job.job_hash] = JobStatus.unsubmitted
+            else:
+                submitted_jobs.append(job)
+
+        status_word_dict = {}
+        for job_chunk in self._split_job_id_chunks(submitted_jobs):
+            # the elements of a job array (<array_id>[<index>]) are queried by the array id once;
+            # bjobs lists each element on its own line, with its index (0 for a job not in an array).
+            # (bjobs -A only counts the elements in each state, so it can not tell which elements failed.)
+            query_id_list = []
+            for job in job_chunk:
+                query_id = str(job.job_id).split('[')[0]
+                if query_id not in query_id_list:
+                    query_id_list.append(query_id)
+            job_id_str = ' '.join(query_id_list)
+            ret, stdin, stdout, stderr\
+                = self.context.block_call ('bjobs -o "jobid jobindex stat" -noheader ' + job_id_str)
+            err_str = stderr.read().decode('utf-8')
+            # bjobs still reports the known jobs when some of the job ids are not found
+            if (ret != 0) and ("is not found" not in err_str) :
+                raise RuntimeError ("status command bjobs fails to execute. erro info: %s return code %d"
+                                    % (err_str, ret))
+            for status_line in stdout.read().decode('utf-8').split('\n'):
+                words = status_line.split()
+                if len(words) == 3 and words[0].isdigit() and words[1].isdigit():
+                    if words[1] != '0':
+                        status_word_dict['%s[%s]' % (words[0], words[1])] = words[2]
+                    else:
+                        status_word_dict[words[0]] = words[2]
+
+        left_jobs = []
+        for job in submitted_jobs:
+            status_word = status_word_dict.get(str(job.job_id), None)
+            if (status_word is None) or (status_word in lsf_finished_status_words):
+                left_jobs.append(job)
+            else:
+                job_state_dict[job.job_hash] = self._get_job_state_from_status_word(job, status_word)
+        job_state_dict.update(self._get_left_job_state_many(left_jobs))
+        return job_state_dict
+
+    def _get_job_state_from_status_word(self, job, status_word):
+        # ref: https://www.ibm.com/support/knowledgecenter/en/SSETD4_9.1.2/lsf_command_ref/bjobs.1.html
+        if      status_word in ["PEND", "WAIT", "PSUSP"] :
+            return JobStatus.waiting
+        elif    status_word in ["RUN", "USUSP"] :
+            return JobStatus.running
+        elif    status_word in lsf_finished_status_words :
+            if self.check_finish_tag(job) :
+                return JobStatus.finished
+            else :
+                return JobStatus.terminated
+        else :
+            return JobStatus.unknown
+
+    def check_finish_tag(self, job):
+        job_tag_finished = job.job_hash + '_job_tag_finished'
+        return self.context.check_file_exists(job_tag_finished)
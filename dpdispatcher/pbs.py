@@ -1,4 +1,4 @@
-import os,sys,time,random,uuid
+import os,sys,time,random,uuid,re,shlex
 
 from dpdispatcher.JobStatus import JobStatus
 from dpdispatcher import dlog
@@ -21,6 +21,7 @@ pbs_script_header_template="""
 """
 
 pbs_script_env_template="""
+export REMOTE_ROOT={remote_root}
 cd $PBS_O_WORKDIR
 test $? -ne 0 && exit 1
 """
@@ -50,8 +51,20 @@ pbs_script_wait="""
 wait
 """
 
+# X: a finished element of a job array
+pbs_finished_status_words=["C", "E", "K", "F", "X"]
+
 class PBS(Batch):
     def gen_script(self, job):
+        pbs_script_command, pbs_script_end = self._gen_script_command_end(job)
+        pbs_script = pbs_script_template.format(
+                          pbs_script_header=self.gen_script_header(job),
+                          pbs_script_env=self.gen_script_env(job),
+                          pbs_script_command=pbs_script_command,
+                          pbs_script_end=pbs_script_end)
+        return pbs_script
+
+    def gen_script_header(self, job):
         resources = job.resources
         
         script_header_dict= {}
@@ -60,40 +73,23 @@ class PBS(Batch):
         script_header_dict['walltime_line']="#PBS -l walltime=120:0:0"
         script_header_dict['queue_name_line']="#PBS -q {queue_name}".format(queue_name=resources.queue_name)
 
-        pbs_script_header = pbs_script_header_template.format(**script_header_dict) 
-
-        pbs_script_env = pbs_script_env_template.format()
-
-
-        pbs_script_command = ""
-        
-        for task in job.job_task_list:
-            command_env = ""     
-            task_need_resources = task.task_need_resources
-            if resources.in_use+task_need_resources > 1:
-                pbs_script_command += pbs_script_wait
-                resources.in_use = 0
-
-            command_env += self.get_command_env_cuda_devices(resources=resources, task=task)
+        return pbs_script_header_template.format(**script_header_dict) 
 
-            command_env += "export DP_TASK_NEED_RESOURCES={task_need_resources} ;".format(task_need_resources=task.task_need_resources)
-           
-            task_tag_finished = task.task_hash + '_task_tag_finished'
+    def gen_script_env(self, job):
+        script_env_dict = {}
+        script_env_dict['remote_root'] = self.context.remote_root
+        return pbs_script_env_template.format(**script_env_dict)
 
-            temp_pbs_script_command = pbs_script_command_template.format(command_env=command_env, 
-                task_work_path=task.task_work_path, command=task.command, task_tag_finished=task_tag_finished,
-                outlog=task.outlog, errlog=task.errlog)
-            pbs_script_command+=temp_pbs_script_command
+    def _gen_script_command_end(self, job):
+        pbs_script_command = self.gen_script_command(job, job.resources, pbs_script_command_template, pbs_script_wait)
 
         job_tag_finished = job.job_hash + '_job_tag_finished'
         pbs_script_end = pbs_script_end_template.format(job_tag_finished=job_tag_finished)
+        return pbs_script_command, pbs_script_end
 
-        pbs_script = pbs_script_template.format(
-                          pbs_script_header=pbs_script_header,
-                          pbs_script_env=pbs_script_env,
-                          pbs_script_command=pbs_script_command,
-                          pbs_script_end=pbs_script_end)
-        return pbs_script
+    def gen_script_body(self, job):
+        """the commands running the tasks of the job and touching its job_tag_finished."""
+        return '\n'.join(self._gen_script_command_end(job))
     
     def do_submit(self, job):
         script_file_name = job.script_file_name
@@ -108,6 +104,23 @@ class PBS(Batch):
         self.context.write_file(job_id_name, job_id)        
         return job_id
 
+    def do_submit_array(self, jobs):
+        """submit the jobs as one PBS Pro job array with qsub -J 0-N%throttle.
+        The array element of each job runs the body of the job script, and its job id is <sequence>[<index>].<server>.
+        There are at most self.max_array_size jobs, see Batch.do_submit_many.
+        """
+        array_hash = self.get_array_hash(jobs)
+        script_file_name = array_hash + '_array.sub'
+        self.context.write_file(fname=script_file_name, write_str=self.gen_array_script(jobs, 'PBS_ARRAY_INDEX'))
+        array_option = '-J 0-%d' % (len(jobs) - 1)
+        if self.array_throttle is not None:
+            array_option += '%%%d' % self.array_throttle
+        stdin, stdout, stderr = self.context.block_checkcall('cd %s && %s %s %s' % (self.context.remote_root, 'qsub', array_option, script_file_name))
+        subret = (stdout.readlines())
+        # 1234[].server
+        array_id = subret[0].split()[0]
+        self.context.write_file(array_hash + '_array_job_id', array_id)
+        return {job.job_hash: array_id.replace('[]', '[%d]' % ii, 1) for ii, job in enumerate(jobs)}
 
     def default_resources(self, resources) :
         pass
@@ -117,11 +130,11 @@ class PBS(Batch):
         if job_id == "" :
             return JobStatus.unsubmitted
         ret, stdin, stdout, stderr\
-            = self.context.block_call ("qstat -x " + job_id)
+            = self.context.block_call ("qstat -x " + self._get_array_option([job_id]) + shlex.quote(job_id))
         err_str = stderr.read().decode('utf-8')
         if (ret != 0) :
             if str("qstat: Unknown Job Id") in err_str :
-                if self.check_finish_tag() :
+                if self.check_finish_tag(job) :
                     return JobStatus.finished
                 else :
                     return JobStatus.terminated
@@ -131,11 +144,61 @@ class PBS(Batch):
         status_line = stdout.read().decode('utf-8').split ('\n')[-2]
         status_word = status_line.split ()[-2]        
         # dlog.info (status_word)
+        return self._get_job_state_from_status_word(job, status_word)
+
+    def check_status_many(self, jobs):
+        job_state_dict = {}
+        submitted_jobs = []
+        for job in jobs:
+            if job.job_id == "":
+                job_state_dict[job.job_hash] = JobStatus.unsubmitted
+            else:
+                submitted_jobs.append(job)
+
+        # qstat may truncate the server part of the job id, so the jobs are matched by the sequence number
+        status_word_dict = {}
+        for job_chunk in self._split_job_id_chunks(submitted_jobs):
+            # the elements of a job array (<sequence>[<index>].<server>) are queried by the array id (<sequence>[].<server>) once
+            query_id_list = []
+            for job in job_chunk:
+                query_id = re.sub(r'\[\d+\]', '[]', str(job.job_id))
+                if query_id not in query_id_list:
+                    query_id_list.append(query_id)
+            job_id_str = ' '.join([shlex.quote(query_id) for query_id in query_id_list])
+            ret, stdin, stdout, stderr\
+                = self.context.block_call ("qstat -x " + self._get_array_option([job.job_id for job in job_chunk]) + job_id_str)
+            err_str = stderr.read().decode('utf-8')
+            # qstat still reports the known jobs when some of the job ids are unknown
+            if (ret != 0) and (str("qstat: Unknown Job Id") not in err_str) :
+                raise RuntimeError ("status command qstat fails to execute. erro info: %s return code %d"
+                                    % (err_str, ret))
+            for status_line in stdout.read().decode('utf-8').split('\n'):
+                words = status_line.split()
+                if len(words) == 6 and words[0][0].isdigit():
+                    status_word_dict[words[0].split('.')[0]] = words[-2]
+
+        left_jobs = []
+        for job in submitted_jobs:
+            status_word = status_word_dict.get(str(job.job_id).split('.')[0], None)
+            if (status_word is None) or (status_word in pbs_finished_status_words):
+                left_jobs.append(job)
+            else:
+                job_state_dict[job.job_hash] = self._get_job_state_from_status_word(job, status_word)
+        job_state_dict.update(self._get_left_job_state_many(left_jobs))
+        return job_state_dict
+
+    def _get_array_option(self, job_id_list):
+        # with -t, qstat lists each element of a job array on its own line
+        if any(['[' in str(job_id) for job_id in job_id_list]):
+            return '-t '
+        return ''
+
+    def _get_job_state_from_status_word(self, job, status_word):
         if status_word in ["Q","H"] :
             return JobStatus.waiting
         elif    status_word in ["R"] :
             return JobStatus.running
-        elif    status_word in ["C", "E", "K", "F"] :
+        elif    status_word in pbs_finished_status_words :
             if self.check_finish_tag(job) :
                 return JobStatus.finished
             else :
@@ -0,0 +1,138 @@
+import time
+from collections import deque
+from dpdispatcher.JobStatus import JobStatus
+from dpdispatcher import dlog
+
+class FixedPollPolicy(object):
+    """poll the job states at a fixed interval.
+
+    The policy is asked for the next interval after each poll with next_interval(),
+    and records each decision in metrics.
+
+    Parameters
+    ----------
+    interval : float
+        the interval (seconds) between two polls.
+    max_metrics_records : int
+        the number of the latest decisions kept in metrics['records'].
+    """
+    def __init__(self, interval=10, max_metrics_records=1000):
+        self.interval = interval
+        self.metrics = {'poll_count': 0, 'total_query_duration': 0., 'total_interval': 0.,
+            'records': deque(maxlen=max_metrics_records)}
+
+    def next_interval(self, job_state_dict, query_duration=0.):
+        """decide how long to wait before the next poll.
+
+        Parameters
+        ----------
+        job_state_dict : dict
+            the state of each job just polled, indexed by the job hash.
+        query_duration : float
+            how long (seconds) the poll took, i.e. the response time of the scheduler.
+
+        Returns
+        -------
+        interval : float
+            the interval (seconds) before the next poll.
+        """
+        return self._record(self.interval, 'fixed', query_duration, 0)
+
+    def _record(self, interval, reason, query_duration, changed_count):
+        self.metrics['poll_count'] += 1
+        self.metrics['total_query_duration'] += query_duration
+        self.metrics['total_interval'] += interval
+        self.metrics['records'].append({'time': time.time(), 'interval': interval, 'reason': reason,
+            'query_duration': query_duration, 'changed_count': changed_count})
+        dlog.debug('poll policy: next poll in %.1f s (%s), query took %.3f s, %d jobs changed' %
+            (interval, reason, query_duration, changed_count))
+        return interval
+
+    def get_metrics(self):
+        metrics = dict(self.metrics)
+        metrics['records'] = list(self.metrics['records'])
+        return metrics
+
+
+class AdaptivePollPolicy(FixedPollPolicy):
+    """poll the job states at an interval adapted to the jobs and to the scheduler.
+
+    - while no job changes state, the interval grows by backoff_factor up to max_interval;
+      when some job changes state, it drops back to min_interval.
+    - if the expected runtime of the jobs is known, the interval is shortened so that
+      the next poll happens around the expected end time of the first running job.
+    - the interval is at least query_duration / max_query_load, so that a slow scheduler
+      (for example, an squeue taking several seconds) is queried less often.
+
+    Parameters
+    ----------
+    min_interval : float
+        the shortest interval (seconds).
+    max_interval : float
+        the longest interval (seconds).
+    backoff_factor : float
+        the factor by which the interval grows while nothing changes.
+    max_query_load : float
+        the largest fraction of the time spent in querying the scheduler.
+    expected_runtime : float, callable or None
+        the expected runtime (seconds) of the jobs, or a function returning the expected runtime
+        (or None if unknown) of a job given its hash.
+    """
+    def __init__(self,
+                 min_interval=2,
+                 max_interval=600,
+                 backoff_factor=2.,
+                 max_query_load=0.05,
+                 expected_runtime=None,
+                 max_metrics_records=1000):
+        super().__init__(interval=min_interval, max_metrics_records=max_metrics_records)
+        if min_interval <= 0 or max_interval < min_interval:
+            raise RuntimeError("poll interval must satisfy 0 < min_interval <= max_interval")
+        if backoff_factor < 1:
+            raise RuntimeError("backoff_factor must not be smaller than 1")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.max_query_load = max_query_load
+        self.expected_runtime = expected_runtime
+        self.last_job_state_dict = None
+        # when each job was first seen running
+        self.running_start_time_dict = {}
+
+    def _get_expected_runtime(self, job_hash):
+        if callable(self.expected_runtime):
+            return self.expected_runtime(job_hash)
+        return self.expected_runtime
+
+    def next_interval(self, job_state_dict, query_duration=0.):
+        now = time.time()
+        if self.last_job_state_dict is None:
+            changed_count = 0
+        else:
+            changed_count = len([job_hash for job_hash, job_state in job_state_dict.items()
+                if self.last_job_state_dict.get(job_hash, None) != job_state])
+        self.last_job_state_dict = dict(job_state_dict)
+
+        if changed_count > 0:
+            interval, reason = self.min_interval, 'changed'
+        else:
+            interval, reason = min(self.interval * self.backoff_factor, self.max_interval), 'backoff'
+
+        for job_hash, job_state in job_state_dict.items():
+            if job_state == JobStatus.running:
+                self.running_start_time_dict.setdefault(job_hash, now)
+            else:
+                self.running_start_time_dict.pop(job_hash, None)
+        remaining_time_list = []
+        for job_hash, start_time in self.running_start_time_dict.items():
+            expected_runtime = self._get_expected_runtime(job_hash)
+            if expected_runtime is not None and start_time + expected_runtime > now:
+                remaining_time_list.append(start_time + expected_runtime - now)
+        if remaining_time_list and min(remaining_time_list) < interval:
+            interval, reason = max(min(remaining_time_list), self.min_interval), 'expected_end'
+
+        if self.max_query_load > 0 and query_duration / self.max_query_load > interval:
+            interval, reason = min(query_duration / self.max_query_load, self.max_interval), 'slow_scheduler'
+
+        self.interval = interval
+        return self._record(interval, reason, query_duration, changed_count)
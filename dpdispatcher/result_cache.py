@@ -0,0 +1,151 @@
+import os, json, hashlib, uuid
+
+from dpdispatcher.content_cache import LocalContentCache, cache_dir_name, default_cache_max_bytes
+from dpdispatcher.utils import get_sha256_many, expand_file_list
+
+def get_file_digests(root, file_list, sha256_dict):
+    """the sorted (file name, sha256) of the files under root, with the directories expanded;
+    None if a file is missing. The sha256 of each path is looked up in sha256_dict, see get_sha256_many.
+    """
+    digest_list = []
+    for fname in expand_file_list(root, file_list):
+        path = os.path.join(root, fname)
+        if path not in sha256_dict:
+            return None
+        digest_list.append((fname, sha256_dict[path]))
+    return sorted(digest_list)
+
+class TaskResultCache(object):
+    """a local cache of the backward_files of the tasks, keyed by the content of their inputs,
+    so that a task run before with the same command and the same input files is not run again.
+
+    The key of a task is the sha256 of its command, its backward_files, and the names and contents of its forward_files
+    and of the forward_common_files of the submission (see get_task_keys). The result of a task is a manifest
+    <cache_root>/<key>.json of the names and the sha256 of its backward files, and the contents are kept
+    in a content-addressed store (<cache_root>/.cas/<sha256>, see LocalContentCache) shared by all the results.
+    The files restored are read-only hardlinks (or copies) of the store, whose contents are checked against their sha256
+    before they are used (see LocalContentCache.check_entry).
+
+    Parameters
+    ----------
+    cache_root : path-like
+        the directory of the cache.
+    max_bytes : int
+        the size cap of the contents; the least recently restored or inserted ones beyond it are removed by evict(),
+        with the results using them.
+    """
+    def __init__(self, cache_root, max_bytes=default_cache_max_bytes):
+        self.cache_root = cache_root
+        self.max_bytes = max_bytes
+        self.content_cache = LocalContentCache(os.path.join(cache_root, cache_dir_name), max_bytes=max_bytes)
+
+    def get_task_keys(self, task_list, local_root, common_files=[]):
+        """the key of each task of task_list, whose files are under local_root;
+        None if one of its input files is missing.
+        """
+        path_list = []
+        for fname in expand_file_list(local_root, common_files):
+            path_list.append(os.path.join(local_root, fname))
+        for task in task_list:
+            task_root = os.path.join(local_root, task.task_work_path)
+            for fname in expand_file_list(task_root, task.forward_files):
+                path_list.append(os.path.join(task_root, fname))
+        sha256_dict = get_sha256_many(sorted(set([path for path in path_list if os.path.isfile(path)])))
+        common_digest_list = get_file_digests(local_root, common_files, sha256_dict)
+        key_list = []
+        for task in task_list:
+            digest_list = get_file_digests(os.path.join(local_root, task.task_work_path), task.forward_files, sha256_dict)
+            if common_digest_list is None or digest_list is None:
+                key_list.append(None)
+                continue
+            key_content = {'command': task.command, 'backward_files': sorted(task.backward_files),
+                'forward_files': digest_list, 'forward_common_files': common_digest_list}
+            key_list.append(hashlib.sha256(json.dumps(key_content, sort_keys=True).encode('utf-8')).hexdigest())
+        return key_list
+
+    def get_manifest_path(self, key):
+        return os.path.join(self.cache_root, key + '.json')
+
+    def lookup(self, key):
+        """the manifest of the result (the sha256 of each backward file), or None if the result or one of its contents is missing."""
+        manifest_path = self.get_manifest_path(key)
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path, 'r') as fp:
+            manifest = json.load(fp)
+        if not all([self.content_cache.check_entry(sha256) for sha256 in manifest.values()]):
+            return None
+        return manifest
+
+    def restore(self, key, task_root):
+        """link the backward files of the result into task_root, and mark their contents as recently used.
+
+        Returns
+        -------
+        if_restored : bool
+            False if the result is not in the cache.
+        """
+        manifest = self.lookup(key)
+        if manifest is None:
+            return False
+        try:
+            for fname, sha256 in manifest.items():
+                self.content_cache.link_entry(sha256, os.path.join(task_root, fname))
+        except FileNotFoundError:
+            # a content evicted by another process in the meantime
+            return False
+        return True
+
+    def insert(self, key, task_root, backward_files):
+        """add the backward files under task_root to the cache as the result of key.
+
+        Returns
+        -------
+        if_inserted : bool
+            False if one of the backward files is missing.
+        """
+        fname_list = expand_file_list(task_root, backward_files)
+        if not all([os.path.isfile(os.path.join(task_root, fname)) for fname in fname_list]):
+            return False
+        sha256_dict = get_sha256_many([os.path.join(task_root, fname) for fname in fname_list])
+        manifest = {}
+        for fname in fname_list:
+            sha256 = sha256_dict[os.path.join(task_root, fname)]
+            if self.content_cache.check_entry(sha256):
+                self.content_cache.touch_entry(sha256)
+            else:
+                self.content_cache.add_entry(os.path.join(task_root, fname), sha256)
+            manifest[fname] = sha256
+        manifest_path = self.get_manifest_path(key)
+        # write to a temporary name first, so that no reader ever sees a partial manifest
+        temp_path = manifest_path + '.' + uuid.uuid4().hex
+        with open(temp_path, 'w') as fp:
+            json.dump(manifest, fp, sort_keys=True)
+        os.replace(temp_path, manifest_path)
+        return True
+
+    def evict(self, keep_entries=()):
+        """remove the least recently used contents beyond max_bytes, and the results using them.
+
+        Returns
+        -------
+        evicted_key_list : list of str
+            the keys of the results removed.
+        """
+        evicted_entry_set = set(self.content_cache.evict(keep_entries=keep_entries))
+        evicted_key_list = []
+        if len(evicted_entry_set) == 0:
+            return evicted_key_list
+        with os.scandir(self.cache_root) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.json'):
+                    with open(entry.path, 'r') as fp:
+                        manifest = json.load(fp)
+                    if any([sha256 in evicted_entry_set for sha256 in manifest.values()]):
+                        os.remove(entry.path)
+                        evicted_key_list.append(entry.name[:-len('.json')])
+        return evicted_key_list
+
+    def save_index(self):
+        """write the index of the contents checked (see LocalContentCache.save_index); evict writes it too."""
+        self.content_cache.save_index()
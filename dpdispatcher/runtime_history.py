@@ -0,0 +1,173 @@
+import os, re, json, hashlib, sqlite3
+from contextlib import closing
+from dpdispatcher import dlog
+from dpdispatcher.utils import get_sha256_many, expand_file_list
+
+# the default database, shared by all the dispatcher processes of the user
+default_history_path = os.path.join(os.path.expanduser('~'), '.dpdispatcher', 'runtime_history.db')
+
+runtime_history_schema = """
+CREATE TABLE IF NOT EXISTS task_runtime (
+    id INTEGER PRIMARY KEY,
+    command_key TEXT NOT NULL,
+    task_hash TEXT NOT NULL,
+    input_fingerprint TEXT,
+    task_need_resources REAL,
+    wall_time REAL NOT NULL,
+    max_rss INTEGER,
+    queue_wait REAL,
+    exit_status INTEGER NOT NULL,
+    end_time REAL NOT NULL,
+    UNIQUE (task_hash, end_time)
+);
+DROP INDEX IF EXISTS task_runtime_command_key;
+DROP INDEX IF EXISTS task_runtime_task_hash;
+DROP INDEX IF EXISTS task_runtime_input_fingerprint;
+CREATE INDEX IF NOT EXISTS task_runtime_command_key_end_time ON task_runtime (command_key, exit_status, end_time);
+CREATE INDEX IF NOT EXISTS task_runtime_task_hash_end_time ON task_runtime (task_hash, exit_status, end_time);
+CREATE INDEX IF NOT EXISTS task_runtime_input_fingerprint_end_time ON task_runtime (input_fingerprint, exit_status, end_time);
+"""
+
+def normalize_command(command):
+    """the key of the command shared by the tasks of the same kind:
+    the whitespace is collapsed and the numbers are replaced by '#',
+    so that 'lmp -v temp 300 -i in.lmp' and 'lmp  -v temp 600 -i in.lmp' share the history.
+    """
+    return re.sub(r'\d+(\.\d+)?', '#', ' '.join(command.split()))
+
+def get_input_fingerprint(task, local_root):
+    """the fingerprint of the content of the forward_files of the task under local_root,
+    None if the task has no forward_files or some of them are missing.
+    """
+    task_root = os.path.join(local_root, task.task_work_path)
+    fname_list = expand_file_list(task_root, task.forward_files)
+    if len(fname_list) == 0 or not all([os.path.isfile(os.path.join(task_root, fname)) for fname in fname_list]):
+        return None
+    sha256_dict = get_sha256_many([os.path.join(task_root, fname) for fname in fname_list])
+    content_list = sorted([(fname, sha256_dict[os.path.join(task_root, fname)]) for fname in fname_list])
+    return hashlib.sha256(json.dumps(content_list).encode('utf-8')).hexdigest()
+
+def get_percentile(sorted_value_list, percentile):
+    """the percentile (0 to 100) of the sorted values, linearly interpolated between the closest ranks."""
+    position = (len(sorted_value_list) - 1) * percentile / 100.
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_value_list) - 1)
+    return sorted_value_list[lower] + (sorted_value_list[upper] - sorted_value_list[lower]) * (position - lower)
+
+
+class RuntimeHistory(object):
+    """a SQLite database of the runtimes of the completed tasks.
+
+    Each record holds the wall time, max RSS and queue wait of one run of a task,
+    keyed by the normalized command (see normalize_command), the task hash,
+    and the fingerprint of the content of the forward_files (see get_input_fingerprint).
+    The database is in WAL mode, and every call opens its own connection,
+    so that several dispatcher processes can read and write it at the same time.
+
+    Parameters
+    ----------
+    db_path : path-like
+        the database file; its directory is created if missing.
+    max_samples : int
+        the number of the latest runs used for a prediction.
+    timeout : float
+        how long (seconds) to wait for the lock held by another process before failing.
+    """
+    def __init__(self, db_path=default_history_path, max_samples=1000, timeout=30.):
+        self.db_path = db_path
+        self.max_samples = max_samples
+        self.timeout = timeout
+        dirname = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(dirname, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.executescript(runtime_history_schema)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def record_many(self, record_list):
+        """add the runs of the tasks.
+
+        Parameters
+        ----------
+        record_list : list of dict
+            each has the keys command_key, task_hash, input_fingerprint, task_need_resources,
+            wall_time, max_rss, queue_wait, exit_status and end_time.
+            A run already recorded (the same task_hash and end_time) is skipped.
+
+        Returns
+        -------
+        record_count : int
+            the number of the runs added.
+        """
+        key_list = ['command_key', 'task_hash', 'input_fingerprint', 'task_need_resources',
+            'wall_time', 'max_rss', 'queue_wait', 'exit_status', 'end_time']
+        with closing(self._connect()) as conn:
+            with conn:
+                cursor = conn.executemany("INSERT OR IGNORE INTO task_runtime ({keys}) VALUES ({values})".format(
+                    keys=', '.join(key_list), values=', '.join(['?'] * len(key_list))),
+                    [[record.get(key, None) for key in key_list] for record in record_list])
+                record_count = cursor.rowcount
+        dlog.debug('runtime history: %d of %d runs recorded in %s' % (record_count, len(record_list), self.db_path))
+        return record_count
+
+    def _get_wall_times(self, conn, column, key_list, chunk_size=500):
+        # the wall times of the latest (by end_time) max_samples successful runs of each key;
+        # the runs of each key are read backwards from the index on (column, exit_status, end_time), and no more than max_samples
+        wall_time_dict = {}
+        key_list = list(set(key_list))
+        for ii in range(0, len(key_list), chunk_size):
+            chunk = key_list[ii:ii+chunk_size]
+            rows = conn.execute("WITH keys(key) AS (VALUES {marks}) "
+                "SELECT keys.key, task_runtime.wall_time FROM keys, task_runtime WHERE task_runtime.id IN "
+                "(SELECT id FROM task_runtime WHERE {column} = keys.key AND exit_status = 0 ORDER BY end_time DESC, id DESC LIMIT ?)".format(
+                column=column, marks=', '.join(['(?)'] * len(chunk))), chunk + [self.max_samples])
+            for key, wall_time in rows:
+                wall_time_dict.setdefault(key, []).append(wall_time)
+        return wall_time_dict
+
+    def predict_many(self, key_dict_list, percentiles=(50, 90)):
+        """predict the runtimes of many tasks from the successful runs in the history.
+
+        The runs of the same input fingerprint are used first, then the runs of the same task hash,
+        and then the runs of the same normalized command.
+
+        Parameters
+        ----------
+        key_dict_list : list of dict
+            the keys of each task: command_key, task_hash and input_fingerprint (may be None).
+        percentiles : list of float
+            the percentiles (0 to 100) of the wall time to estimate.
+
+        Returns
+        -------
+        prediction_list : list of dict or None
+            for each task, the estimate of each percentile indexed by the percentile,
+            as well as 'mean', 'sample_count' and 'source' (the key used);
+            None if the history has no successful run of the task.
+        """
+        with closing(self._connect()) as conn:
+            wall_time_dicts = {}
+            for column in ['input_fingerprint', 'task_hash', 'command_key']:
+                wall_time_dicts[column] = self._get_wall_times(conn, column,
+                    [key_dict[column] for key_dict in key_dict_list if key_dict.get(column, None) is not None])
+        prediction_list = []
+        prediction_cache = {}
+        for key_dict in key_dict_list:
+            prediction = None
+            for column in ['input_fingerprint', 'task_hash', 'command_key']:
+                key = key_dict.get(column, None)
+                if key in wall_time_dicts[column]:
+                    if (column, key) not in prediction_cache:
+                        sorted_wall_time_list = sorted(wall_time_dicts[column][key])
+                        prediction_cache[(column, key)] = dict({percentile: get_percentile(sorted_wall_time_list, percentile)
+                            for percentile in percentiles}, mean=sum(sorted_wall_time_list) / len(sorted_wall_time_list),
+                            sample_count=len(sorted_wall_time_list), source=column)
+                    prediction = dict(prediction_cache[(column, key)])
+                    break
+            prediction_list.append(prediction)
+        return prediction_list
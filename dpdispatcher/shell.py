@@ -62,30 +62,8 @@ class Shell(Batch):
 
         shell_script_env = shell_script_env_template.format()
       
-        shell_script_command = ""
-        
-        resources_in_use=0
-        for task in job.job_task_list:
-            command_env = ""     
-            task_need_resources_mod = task.task_need_resources
-            if resources_in_use+task_need_resources_mod > 1:
-               shell_script_command += shell_script_wait
-               resources_in_use = 0
-
-            command_env += self.get_command_env_cuda_devices(resources=resources, task=task)
-
-            command_env = "export {str_CUDA_VISIBLE_DEVICES} ;".format(str_CUDA_VISIBLE_DEVICES=str_CUDA_VISIBLE_DEVICES)
-               
-            command_env += "export DP_TASK_NEED_RESOURCES={task_need_resources} ;".format(task_need_resources=task.task_need_resources)
-
-            task_tag_finished = task.task_hash + '_task_tag_finished'
-
-            temp_shell_script_command = shell_script_command_template.format(command_env=command_env, 
-                 task_work_path=task.task_work_path, command=task.command, task_tag_finished=task_tag_finished,
-                 outlog=task.outlog, errlog=task.errlog)
-
-            shell_script_command+=temp_shell_script_command
-        
+        shell_script_command = self.gen_script_command(job, resources, shell_script_command_template, shell_script_wait)
+
         job_tag_finished = job.job_hash + '_job_tag_finished'
         shell_script_end = shell_script_end_template.format(job_tag_finished=job_tag_finished)
 
@@ -139,6 +117,24 @@ class Shell(Batch):
         else:
             return JobStatus.terminated
         return job_state
+
+    def check_status_many(self, jobs):
+        job_state_dict = {}
+        submitted_jobs = []
+        for job in jobs:
+            if job.job_id == "":
+                job_state_dict[job.job_hash] = JobStatus.unsubmitted
+            else:
+                submitted_jobs.append(job)
+        if_finished_dict = self.check_finish_tag_many(submitted_jobs)
+        for job in submitted_jobs:
+            if if_finished_dict[job.job_hash]:
+                job_state_dict[job.job_hash] = JobStatus.finished
+            elif psutil.pid_exists(pid=job.job_id):
+                job_state_dict[job.job_hash] = JobStatus.running
+            else:
+                job_state_dict[job.job_hash] = JobStatus.terminated
+        return job_state_dict
     
     # def check_status(self, job):
     #     job_id = job.job_id
@@ -83,17 +83,29 @@ class SlurmResources(object):
 #         slurm_resources = cls(resources=resources, slurm_sbatch_dict=slurm_sbatch_dict)
 #         return slurm_resources
 
+slurm_finished_status_words=["C","E","K","BF","CA","CD","F","NF","PR","SE","ST","TO"]
+
 class Slurm(Batch):
     def gen_script(self, job):
+        slurm_script_command, slurm_script_end = self._gen_script_command_end(job)
+        slurm_script = slurm_script_template.format(
+                          slurm_script_header=self.gen_script_header(job),
+                          slurm_script_env=self.gen_script_env(job),
+                          slurm_script_command=slurm_script_command,
+                          slurm_script_end=slurm_script_end)
+        return slurm_script
+
+    def _get_resources(self, job):
         if type(job.resources) is SlurmResources:
-            resources = job.resources.resources
-            slurm_sbatch_dict = job.resources.slurm_sbatch_dict
-        elif type(job.resources) is Resources:
-            resources = job.resources
-            slurm_sbatch_dict = {}
+            return job.resources.resources, job.resources.slurm_sbatch_dict
         else:
-            raise RuntimeError('type job.resource error')
+            return job.resources, {}
+
+    def get_base_resources(self, job):
+        return self._get_resources(job)[0]
 
+    def gen_script_header(self, job):
+        resources, slurm_sbatch_dict = self._get_resources(job)
         script_header_dict = {}
         script_header_dict['slurm_nodes_line']="#SBATCH --nodes {number_node}".format(number_node=resources.number_node)
         script_header_dict['slurm_ntasks_per_node_line']="#SBATCH --ntasks-per-node {cpu_per_node}".format(cpu_per_node=resources.cpu_per_node)
@@ -104,43 +116,24 @@ class Slurm(Batch):
         for k,v in slurm_sbatch_dict.items():
             line = "#SBATCH --{key} {value}\n".format(key=k.replace('_', '-'), value=str(v))
             slurm_script_header += line
+        return slurm_script_header
 
+    def gen_script_env(self, job):
         script_env_dict = {}
         script_env_dict['remote_root'] = self.context.remote_root
+        return slurm_script_env_template.format(**script_env_dict)
 
-        slurm_script_env = slurm_script_env_template.format(**script_env_dict)
-
-        slurm_script_command = ""
-        
-        for task in job.job_task_list:
-            command_env = ""     
-            task_need_resources = task.task_need_resources
-            if resources.in_use+task_need_resources > 1:
-                slurm_script_command += slurm_script_wait
-                resources.in_use = 0
-
-            command_env += self.get_command_env_cuda_devices(resources=resources, task=task)
-
-            command_env += "export DP_TASK_NEED_RESOURCES={task_need_resources} ;".format(task_need_resources=task.task_need_resources)
-
-            task_tag_finished = task.task_hash + '_task_tag_finished'
-
-            temp_slurm_script_command = slurm_script_command_template.format(command_env=command_env, 
-                task_work_path=task.task_work_path, command=task.command, task_tag_finished=task_tag_finished,
-                outlog=task.outlog, errlog=task.errlog)
-
-            slurm_script_command+=temp_slurm_script_command
-            
+    def _gen_script_command_end(self, job):
+        resources, slurm_sbatch_dict = self._get_resources(job)
+        slurm_script_command = self.gen_script_command(job, resources, slurm_script_command_template, slurm_script_wait)
 
         job_tag_finished = job.job_hash + '_job_tag_finished'
         slurm_script_end = slurm_script_end_template.format(job_tag_finished=job_tag_finished)
+        return slurm_script_command, slurm_script_end
 
-        slurm_script = slurm_script_template.format(
-                          slurm_script_header=slurm_script_header,
-                          slurm_script_env=slurm_script_env,
-                          slurm_script_command=slurm_script_command,
-                          slurm_script_end=slurm_script_end)
-        return slurm_script
+    def gen_script_body(self, job):
+        """the commands running the tasks of the job and touching its job_tag_finished."""
+        return '\n'.join(self._gen_script_command_end(job))
     
     def do_submit(self, job):
         script_file_name = job.script_file_name
@@ -155,6 +148,23 @@ class Slurm(Batch):
         self.context.write_file(job_id_name, job_id)        
         return job_id
 
+    def do_submit_array(self, jobs):
+        """submit the jobs as one slurm job array with sbatch --array=0-N%throttle.
+        The array element of each job runs the body of the job script, and its job id is <array_id>_<index>.
+        There are at most self.max_array_size jobs, see Batch.do_submit_many.
+        """
+        array_hash = self.get_array_hash(jobs)
+        script_file_name = array_hash + '_array.sub'
+        self.context.write_file(fname=script_file_name, write_str=self.gen_array_script(jobs, 'SLURM_ARRAY_TASK_ID'))
+        array_option = '--array=0-%d' % (len(jobs) - 1)
+        if self.array_throttle is not None:
+            array_option += '%%%d' % self.array_throttle
+        stdin, stdout, stderr = self.context.block_checkcall('cd %s && %s %s %s' % (self.context.remote_root, 'sbatch', array_option, script_file_name))
+        subret = (stdout.readlines())
+        array_id = subret[0].split()[-1]
+        self.context.write_file(array_hash + '_array_job_id', array_id)
+        return {job.job_hash: '%s_%d' % (array_id, ii) for ii, job in enumerate(jobs)}
+
     def default_resources(self, resources) :
         pass
     
@@ -163,7 +173,7 @@ class Slurm(Batch):
         if job_id == '' :
             return JobStatus.unsubmitted
         ret, stdin, stdout, stderr \
-            = self.context.block_call ('squeue -o "%.18i %.2t" -j ' + job_id)
+            = self.context.block_call ('squeue -o "%.18i %.2t" ' + self._get_array_option([job_id]) + '-j ' + job_id)
         if (ret != 0) :
             err_str = stderr.read().decode('utf-8')
             if str("Invalid job id specified") in err_str :
@@ -180,13 +190,66 @@ class Slurm(Batch):
             raise RuntimeError("Error in getting job status, " +
                               f"status_line = {status_line}, " + 
                               f"parsed status_word = {status_word}")
+        return self._get_job_state_from_status_word(job, status_word)
+
+    def check_status_many(self, jobs):
+        job_state_dict = {}
+        submitted_jobs = []
+        for job in jobs:
+            if job.job_id == '':
+                job_state_dict[job.job_hash] = JobStatus.unsubmitted
+            else:
+                submitted_jobs.append(job)
+
+        status_word_dict = {}
+        for job_chunk in self._split_job_id_chunks(submitted_jobs):
+            # the elements of a job array (<array_id>_<index>) are queried by the array id once
+            query_id_list = []
+            for job in job_chunk:
+                query_id = str(job.job_id).split('_')[0]
+                if query_id not in query_id_list:
+                    query_id_list.append(query_id)
+            job_id_str = ','.join(query_id_list)
+            ret, stdin, stdout, stderr \
+                = self.context.block_call('squeue -h -o "%.18i %.2t" ' +
+                    self._get_array_option([job.job_id for job in job_chunk]) + '-j ' + job_id_str)
+            if (ret != 0) :
+                err_str = stderr.read().decode('utf-8')
+                # none of the jobs in this chunk is known by slurm any more
+                if str("Invalid job id specified") in err_str :
+                    continue
+                else :
+                    raise RuntimeError\
+                        ("status command squeue fails to execute\nerror message:%s\nreturn code %d\n" % (err_str, ret))
+            for status_line in stdout.read().decode('utf-8').split('\n'):
+                if len(status_line.split()) == 2:
+                    queue_job_id, status_word = status_line.split()
+                    status_word_dict[queue_job_id] = status_word
+
+        left_jobs = []
+        for job in submitted_jobs:
+            status_word = status_word_dict.get(str(job.job_id), None)
+            if (status_word is None) or (status_word in slurm_finished_status_words):
+                left_jobs.append(job)
+            else:
+                job_state_dict[job.job_hash] = self._get_job_state_from_status_word(job, status_word)
+        job_state_dict.update(self._get_left_job_state_many(left_jobs))
+        return job_state_dict
+
+    def _get_array_option(self, job_id_list):
+        # with -r, squeue lists each element of a job array on its own line, instead of the pending ones as <array_id>_[0-N]
+        if any(['_' in str(job_id) for job_id in job_id_list]):
+            return '-r '
+        return ''
+
+    def _get_job_state_from_status_word(self, job, status_word):
         if status_word in ["PD","CF","S"] :
             return JobStatus.waiting
         elif status_word in ["R"] :
             return JobStatus.running
         elif status_word in ["CG"] :
             return JobStatus.completing
-        elif status_word in ["C","E","K","BF","CA","CD","F","NF","PR","SE","ST","TO"] :
+        elif status_word in slurm_finished_status_words :
             if self.check_finish_tag(job) :
                 return JobStatus.finished
             else :
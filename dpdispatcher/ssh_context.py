@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import os, sys, paramiko, json, uuid, tarfile, time, stat, shutil
+import os, sys, paramiko, json, uuid, tarfile, time, stat, shutil, shlex, threading
+from contextlib import contextmanager
 from glob import glob
 from dpdispatcher import dlog
+from dpdispatcher.compression import CompressionCodec
+from dpdispatcher.content_cache import get_evicted_entries, cache_dir_name, cache_index_name, default_cache_max_bytes
+from dpdispatcher.utils import get_sha256_many, expand_file_list
 # from dpdispatcher.submission import Machine
 
 class SSHSession (object) :
@@ -41,7 +45,8 @@ class SSHSession (object) :
                 port=22,
                 key_filename=None,
                 passphrase=None,
-                timeout=10):
+                timeout=10,
+                max_sftp_pool_size=4):
 
         self.hostname = hostname
         self.remote_root = remote_root
@@ -52,6 +57,15 @@ class SSHSession (object) :
         self.passphrase = passphrase
         self.timeout = timeout
         self.ssh = None
+        # idle sftp clients shared by all the contexts of this session
+        self.max_sftp_pool_size = max_sftp_pool_size
+        self._sftp_pool = []
+        self._sftp_pool_lock = threading.Lock()
+        # the contexts may use the session from several threads (see Submission.upload_and_submit_jobs):
+        # a reconnection is made by one thread at a time, and the channel stats are counted under their own lock
+        self._reconnect_lock = threading.RLock()
+        self._channel_stats_lock = threading.Lock()
+        self.channel_stats = {'sftp_open': 0, 'sftp_reuse': 0, 'exec_open': 0, 'reconnect': 0}
         self._setup_ssh()
     # def bk_ensure_alive(self,
     #                  max_check = 10,
@@ -76,14 +90,16 @@ class SSHSession (object) :
                     max_check = 10,
                     sleep_time = 10):
         count = 1
-        while not self._check_alive():
-            if count == max_check:
-                raise RuntimeError('cannot connect ssh after %d failures at interval %d s' %
-                                    (max_check, sleep_time))
-            dlog.info('connection check failed, try to reconnect to ' + self.remote_root)
-            self._setup_ssh()
-            count += 1
-            time.sleep(sleep_time)
+        # the threads finding the connection broken wait for the one reconnecting, and then find it alive
+        with self._reconnect_lock:
+            while not self._check_alive():
+                if count == max_check:
+                    raise RuntimeError('cannot connect ssh after %d failures at interval %d s' %
+                                        (max_check, sleep_time))
+                dlog.info('connection check failed, try to reconnect to ' + self.remote_root)
+                self._setup_ssh()
+                count += 1
+                time.sleep(sleep_time)
 
     def _check_alive(self):
         if self.ssh == None:
@@ -115,14 +131,21 @@ class SSHSession (object) :
     
     def _setup_ssh(self):
         # machine = self.machine
-        self.ssh = paramiko.SSHClient()
-        self.ssh.set_missing_host_key_policy(paramiko.WarningPolicy)
-        self.ssh.connect(hostname=self.hostname, port=self.port,
-                        username=self.username, password=self.password,
-                        key_filename=self.key_filename, timeout=self.timeout,passphrase=self.passphrase)
-        assert(self.ssh.get_transport().is_active())
-        transport = self.ssh.get_transport()
-        transport.set_keepalive(60)
+        with self._reconnect_lock:
+            # the channels of the old connection can not be reused
+            if self.ssh is not None:
+                self._add_channel_stat('reconnect')
+            self._close_sftp_pool()
+            # the other threads see the old client until the new one is connected
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.WarningPolicy)
+            ssh.connect(hostname=self.hostname, port=self.port,
+                            username=self.username, password=self.password,
+                            key_filename=self.key_filename, timeout=self.timeout,passphrase=self.passphrase)
+            assert(ssh.get_transport().is_active())
+            transport = ssh.get_transport()
+            transport.set_keepalive(60)
+            self.ssh = ssh
                         
 
     def get_ssh_client(self) :
@@ -131,18 +154,138 @@ class SSHSession (object) :
     def get_session_root(self) :
         return self.remote_root
 
+    @contextmanager
+    def sftp_client(self):
+        """borrow a sftp client from the pool of this session, and give it back after use.
+        A new sftp channel is opened only when no healthy idle client is left in the pool.
+
+        Examples
+        --------
+        >>> with ssh_session.sftp_client() as sftp:
+        ...     sftp.stat(remote_path)
+        """
+        sftp = self._acquire_sftp()
+        try:
+            yield sftp
+        finally:
+            # a broken channel is dropped by the health check instead of being pooled
+            self._release_sftp(sftp)
+
+    def exec_command(self, cmd):
+        """execute cmd on a new exec channel. 
+        Unlike sftp channels, an exec channel runs only one command, so it can not be pooled;
+        it is counted in channel_stats['exec_open'].
+        """
+        self._add_channel_stat('exec_open')
+        return self.ssh.exec_command(cmd)
+
+    def get_channel_stats(self):
+        """the numbers of the channels opened, the sftp clients reused from the pool and the reconnections of this session.
+        """
+        with self._channel_stats_lock:
+            return dict(self.channel_stats)
+
+    def _add_channel_stat(self, key):
+        with self._channel_stats_lock:
+            self.channel_stats[key] += 1
+
+    def _check_sftp_alive(self, sftp):
+        channel = sftp.get_channel()
+        return (not channel.closed) and (channel.get_transport() is self.ssh.get_transport())
+
+    def _acquire_sftp(self):
+        with self._sftp_pool_lock:
+            while self._sftp_pool:
+                sftp = self._sftp_pool.pop()
+                if self._check_sftp_alive(sftp):
+                    self._add_channel_stat('sftp_reuse')
+                    return sftp
+                sftp.close()
+            self._add_channel_stat('sftp_open')
+        return self.ssh.open_sftp()
+
+    def _release_sftp(self, sftp):
+        with self._sftp_pool_lock:
+            if len(self._sftp_pool) < self.max_sftp_pool_size and self._check_sftp_alive(sftp):
+                self._sftp_pool.append(sftp)
+                return
+        sftp.close()
+
+    def _close_sftp_pool(self):
+        with self._sftp_pool_lock:
+            for sftp in self._sftp_pool:
+                try:
+                    sftp.close()
+                except Exception:
+                    pass
+            self._sftp_pool = []
+
     def close(self) :
+        self._close_sftp_pool()
         self.ssh.close()
 
 
 class SSHContext (object):
+    """the context to transfer files and execute commands on a remote machine through ssh.
+
+    Parameters
+    ----------
+    local_root : str
+        the local directory where the submission work_base lies.
+    ssh_session : SSHSession
+        the ssh session to the remote machine.
+    job_uuid : str
+        deprecated, the job_uuid is set to the submission hash by bind_submission.
+    stream_transfer : bool
+        if True, the files are uploaded (downloaded) by streaming a tar archive into (out of) 
+        a remote tar process through the ssh channel. Compression, transfer and extraction then overlap, 
+        and no temporary tarball is written on either side.
+        If False, a temporary tarball is created, transferred by sftp and extracted.
+    compression : str
+        the compression codec of the transferred tar archives: 'none', 'gzip', 'bz2', 'xz', 'zstd', 'lz4' or 'auto'. 
+        See CompressionCodec for details.
+    compress_level : int
+        the compression level of the codec. If None, the default level of the codec is used.
+    incremental_upload : bool
+        if True, a manifest of the uploaded files (path -> size, mtime, sha256, and size, mtime of the remote copy)
+        is kept under remote_root, and upload only transfers the files which are new or whose content changed,
+        or whose remote copy was changed or removed.
+        Re-running an interrupted submission then uploads (nearly) nothing.
+    remote_cache : bool
+        if True, the forward_common_files are kept in a content-addressed store (<session_root>/.cas/<sha256>)
+        shared by all the submissions, and hardlinked from there into remote_root. 
+        Only the files whose content is not stored yet are uploaded.
+        The stored files are read-only, and so are the forward_common_files in remote_root, which are the same inodes:
+        a job rewriting or appending to a common file fails, so do not use remote_cache for such files.
+        Before an entry is linked, its size and sha256 are checked on the remote side (sha256sum),
+        and an entry changed by a writer ignoring its mode (a job running as root, or after chmod u+w) is uploaded again.
+        The sha256 is only checked once after the entry is added or changed: the index of the store records its size and mtime.
+    remote_cache_max_bytes : int
+        the size cap of the store; the least recently used entries beyond it are removed after each upload.
+    """
+    # the manifest is updated after each batch of this many bytes is uploaded
+    incremental_upload_batch_bytes = 256 * 1024 * 1024
+
     def __init__ (self,
                   local_root,
                   ssh_session,
-                  job_uuid=None):
+                  job_uuid=None,
+                  *,
+                  stream_transfer=False,
+                  compression='gzip',
+                  compress_level=None,
+                  incremental_upload=False,
+                  remote_cache=False,
+                  remote_cache_max_bytes=default_cache_max_bytes):
         assert(type(local_root) == str)
         self.temp_local_root = os.path.abspath(local_root)
         self.job_uuid = job_uuid
+        self.stream_transfer = stream_transfer
+        self.compression = CompressionCodec(name=compression, level=compress_level)
+        self.incremental_upload = incremental_upload
+        self.remote_cache = remote_cache
+        self.remote_cache_max_bytes = remote_cache_max_bytes
+        self._upload_manifest_lock = threading.Lock()
         # if job_uuid:
         #    self.job_uuid=job_uuid
         # else:
@@ -150,12 +293,11 @@ class SSHContext (object):
         self.temp_remote_root = os.path.join(ssh_session.get_session_root())
         self.ssh_session = ssh_session
         self.ssh_session.ensure_alive()
-        sftp = self.ssh_session.ssh.open_sftp() 
-        try:
-            sftp.mkdir(self.temp_remote_root)
-        except OSError: 
-            pass
-        sftp.close()
+        with self.ssh_session.sftp_client() as sftp:
+            try:
+                sftp.mkdir(self.temp_remote_root)
+            except OSError: 
+                pass
     
     @property
     def ssh(self):
@@ -186,38 +328,109 @@ class SSHContext (object):
                # job_dirs,
                submission,
                # local_up_files,
-               dereference = True) :
+               dereference = True,
+               *,
+               job_list=None) :
+        """upload the forward_files of the tasks and the forward_common_files of the submission.
+        If job_list is given, only the tasks of these jobs are uploaded.
+        """
         self.ssh_session.ensure_alive()
         cwd = os.getcwd()
         os.chdir(self.local_root) 
         file_list = []
+        if job_list is None:
+            task_list = submission.belonging_tasks
+        else:
+            task_list = [task for job in job_list for task in job.job_task_list]
         
       #   for ii in job_dirs :
-        for task in submission.belonging_tasks :
+        for task in task_list :
             for jj in task.forward_files :
                 # file_list.append(os.path.join(ii, jj))        
                 file_list.append(os.path.join(task.task_work_path, jj))        
         # for ii in submission.forward_common_files:
         #     file_list.append(ii)
-        file_list.extend(submission.forward_common_files)
+        if self.remote_cache:
+            self._put_files_cached(submission.forward_common_files, dereference = dereference)
+        else:
+            file_list.extend(submission.forward_common_files)
 
-        self._put_files(file_list, dereference = dereference)
+        if self.incremental_upload:
+            self._put_files_incremental(file_list, dereference = dereference)
+        elif len(file_list) > 0:
+            self._put_files(file_list, dereference = dereference)
+        else:
+            self._make_remote_root()
         os.chdir(cwd)
 
+    def upload_job(self,
+                   job,
+                   dereference = True) :
+        """upload the forward_files of the tasks of one job. 
+        It does not change the working directory and uses a tarball named after the job, 
+        so it may run in parallel threads.
+        """
+        self.ssh_session.ensure_alive()
+        file_list = []
+        for task in job.job_task_list :
+            for jj in task.forward_files :
+                file_list.append(os.path.join(task.task_work_path, jj))
+        if len(file_list) == 0:
+            return
+        if self.incremental_upload:
+            self._put_files_incremental(file_list, dereference = dereference, archive_name = job.job_hash)
+        else:
+            self._put_files(file_list, dereference = dereference, archive_name = job.job_hash)
+
     def download(self, 
                  submission,
                  # job_dirs,
                  # remote_down_files,
                  check_exists = False,
                  mark_failure = True,
-                 back_error=False) :
+                 back_error=False,
+                 *,
+                 job_list=None) :
+        """download the backward_files of the tasks and the backward_common_files of the submission.
+        If job_list is given, only the tasks of these jobs are downloaded.
+        """
+        if job_list is None:
+            task_list = submission.belonging_tasks
+            job_list = submission.belonging_jobs
+        else:
+            task_list = [task for job in job_list for task in job.job_task_list]
+        self._download_task_files(task_list, check_exists=check_exists, mark_failure=mark_failure, 
+            back_error=back_error, common_files=submission.backward_common_files + self._get_existing_job_files(job_list))
+
+    def download_job(self,
+                     job,
+                     check_exists = False,
+                     mark_failure = True,
+                     back_error=False) :
+        """download the backward_files of the tasks of one job."""
+        self._download_task_files(job.job_task_list, check_exists=check_exists, mark_failure=mark_failure, back_error=back_error,
+            common_files=self._get_existing_job_files([job]))
+
+    def _get_existing_job_files(self, job_list):
+        # the files of the jobs (see Job.get_backward_job_files) are optional:
+        # they are missing when no task of the job was run
+        fname_list = [fname for job in job_list for fname in job.get_backward_job_files()]
+        if_exist_dict = self.check_files_exist(fname_list)
+        return [fname for fname in fname_list if if_exist_dict[fname]]
+
+    def _download_task_files(self,
+                             task_list,
+                             check_exists = False,
+                             mark_failure = True,
+                             back_error=False,
+                             common_files=[]) :
         self.ssh_session.ensure_alive()
         cwd = os.getcwd()
         os.chdir(self.local_root) 
         file_list = []
         # for ii in job_dirs :
-        for task in submission.belonging_tasks :
-            for jj in task.forward_files  :
+        for task in task_list :
+            for jj in task.backward_files  :
                 file_name = os.path.join(task.task_work_path, jj)                
                 if check_exists:
                     if self.check_file_exists(file_name):
@@ -231,7 +444,7 @@ class SSHContext (object):
             if back_error:
                 errors=glob(os.path.join(task.task_work_path, 'error*'))
                 file_list.extend(errors)
-        file_list.extend(submission.backward_common_files)
+        file_list.extend(common_files)
         if len(file_list) > 0:
             self._get_files(file_list)
         os.chdir(cwd)
@@ -239,7 +452,7 @@ class SSHContext (object):
     def block_checkcall(self, 
                         cmd) :
         self.ssh_session.ensure_alive()
-        stdin, stdout, stderr = self.ssh.exec_command(('cd %s ;' % self.remote_root) + cmd)
+        stdin, stdout, stderr = self.ssh_session.exec_command(('cd %s ;' % self.remote_root) + cmd)
         exit_status = stdout.channel.recv_exit_status() 
         if exit_status != 0:
             raise RuntimeError("Get error code %d in calling %s through ssh with job: %s . message: %s" %
@@ -249,44 +462,73 @@ class SSHContext (object):
     def block_call(self, 
                    cmd) :
         self.ssh_session.ensure_alive()
-        stdin, stdout, stderr = self.ssh.exec_command(('cd %s ;' % self.remote_root) + cmd)
+        stdin, stdout, stderr = self.ssh_session.exec_command(('cd %s ;' % self.remote_root) + cmd)
         exit_status = stdout.channel.recv_exit_status() 
         return exit_status, stdin, stdout, stderr
 
     def clean(self) :        
         self.ssh_session.ensure_alive()
-        sftp = self.ssh.open_sftp()        
-        self._rmtree(sftp, self.remote_root)
-        sftp.close()
+        with self.ssh_session.sftp_client() as sftp:
+            self._rmtree(sftp, self.remote_root)
 
     def write_file(self, fname, write_str):
         self.ssh_session.ensure_alive()
-        sftp = self.ssh.open_sftp()
-        with sftp.open(os.path.join(self.remote_root, fname), 'w') as fp :
-            fp.write(write_str)
-        sftp.close()
+        with self.ssh_session.sftp_client() as sftp:
+            with sftp.open(os.path.join(self.remote_root, fname), 'w') as fp :
+                fp.write(write_str)
+
+    def append_file(self, fname, write_str):
+        self.ssh_session.ensure_alive()
+        with self.ssh_session.sftp_client() as sftp:
+            with sftp.open(os.path.join(self.remote_root, fname), 'a') as fp :
+                fp.write(write_str)
 
     def read_file(self, fname):
         self.ssh_session.ensure_alive()
-        sftp = self.ssh.open_sftp()
-        with sftp.open(os.path.join(self.remote_root, fname), 'r') as fp:
-            ret = fp.read().decode('utf-8')
-        sftp.close()
+        with self.ssh_session.sftp_client() as sftp:
+            with sftp.open(os.path.join(self.remote_root, fname), 'r') as fp:
+                ret = fp.read().decode('utf-8')
         return ret
 
     def check_file_exists(self, fname):
         self.ssh_session.ensure_alive()
-        sftp = self.ssh.open_sftp()
-        try:
-            sftp.stat(os.path.join(self.remote_root, fname)) 
-            ret = True
-        except IOError:
-            ret = False
-        sftp.close()
+        with self.ssh_session.sftp_client() as sftp:
+            try:
+                sftp.stat(os.path.join(self.remote_root, fname)) 
+                ret = True
+            except IOError:
+                ret = False
         return ret        
+
+    def check_files_exist(self, fname_list, chunk_size=500):
+        """check whether many files exist with one remote ls call (for each chunk of chunk_size files),
+        instead of one sftp stat per file.
+
+        Parameters
+        ----------
+        fname_list : list of str
+            the file names relative to remote_root
+
+        Returns
+        -------
+        if_exist_dict : dict
+            whether each file exists, indexed by the file name
+        """
+        if_exist_dict = {fname: False for fname in fname_list}
+        if len(fname_list) == 0:
+            return if_exist_dict
+        self.ssh_session.ensure_alive()
+        for ii in range(0, len(fname_list), chunk_size):
+            fname_str = ' '.join([shlex.quote(fname) for fname in fname_list[ii:ii+chunk_size]])
+            # ls only prints the existing files; its return code is non-zero when some of them are missing
+            ret, stdin, stdout, stderr = self.block_call('ls -1 -d -- %s 2>/dev/null' % fname_str)
+            for line in stdout.read().decode('utf-8').split('\n'):
+                if line in if_exist_dict:
+                    if_exist_dict[line] = True
+        return if_exist_dict
         
     def call(self, cmd):
-        stdin, stdout, stderr = self.ssh.exec_command(cmd)
+        stdin, stdout, stderr = self.ssh_session.exec_command(cmd)
         # stdin, stdout, stderr = self.ssh.exec_command('echo $$; exec ' + cmd)
         # pid = stdout.readline().strip()
         # print(pid)
@@ -308,6 +550,13 @@ class SSHContext (object):
         self.block_checkcall('kill -15 %s' % cmd_pipes['pid'])
 
 
+    def _make_remote_root(self):
+        with self.ssh_session.sftp_client() as sftp:
+            try:
+                sftp.mkdir(self.remote_root)
+            except OSError: 
+                pass
+
     def _rmtree(self, sftp, remotepath, level=0, verbose = False):
         for f in sftp.listdir_attr(remotepath):
             rpath = os.path.join(remotepath, f.filename)
@@ -322,61 +571,378 @@ class SSHContext (object):
 
     def _put_files(self,
                    files,
-                   dereference = True) :
-        of = self.job_uuid + '.tgz'
+                   dereference = True,
+                   archive_name = None) :
+        if self.stream_transfer:
+            return self._put_files_stream(files, dereference=dereference)
+        codec = self.compression.resolve([os.path.join(self.local_root, ii) for ii in files])
+        if archive_name is None:
+            archive_name = self.job_uuid
+        of = archive_name + codec.suffix
         # local tar
-        cwd = os.getcwd()
-        os.chdir(self.local_root)
-        if os.path.isfile(of) :
-            os.remove(of)
-        with tarfile.open(of, "w:gz", dereference = dereference) as tar:
-            for ii in files :
-                tar.add(ii)
-        os.chdir(cwd)
+        local_of = os.path.join(self.local_root, of)
+        if os.path.isfile(local_of) :
+            os.remove(local_of)
+        with open(local_of, 'wb') as fp:
+            with codec.open_writer(fp) as writer:
+                with tarfile.open(fileobj=writer, mode="w|", dereference = dereference) as tar:
+                    for ii in files :
+                        tar.add(os.path.join(self.local_root, ii), arcname=ii)
 
-        sftp = self.ssh_session.ssh.open_sftp() 
-        try:
-            sftp.mkdir(self.remote_root)
-        except OSError: 
-            pass
-        sftp.close()
-        # trans
-        from_f = os.path.join(self.local_root, of)
-        to_f = os.path.join(self.remote_root, of)
-        sftp = self.ssh.open_sftp()
-        try:
-           sftp.put(from_f, to_f)
-        except FileNotFoundError:
-           raise FileNotFoundError("from %s to %s @ %s : %s Error!"%(from_f, self.username, self.hostname, to_f))
-        # remote extract
-        self.block_checkcall('tar xf %s' % of)
-        # clean up
-        os.remove(from_f)
-        sftp.remove(to_f)
-        sftp.close()
+        with self.ssh_session.sftp_client() as sftp:
+            try:
+                sftp.mkdir(self.remote_root)
+            except OSError: 
+                pass
+            # trans
+            from_f = os.path.join(self.local_root, of)
+            to_f = os.path.join(self.remote_root, of)
+            try:
+               sftp.put(from_f, to_f)
+            except FileNotFoundError:
+               raise FileNotFoundError("from %s to %s @ %s : %s Error!"%(from_f, self.ssh_session.username, self.ssh_session.hostname, to_f))
+            # remote extract
+            self.block_checkcall(codec.get_remote_extract_cmd('.', of))
+            # clean up
+            os.remove(from_f)
+            sftp.remove(to_f)
 
     def _get_files(self, 
                    files) :
-        of = self.job_uuid + '.tgz'
+        if self.stream_transfer:
+            return self._get_files_stream(files)
+        codec = self.compression.resolve()
+        of = self.job_uuid + codec.suffix
         flist = ""
         for ii in files :
             flist += " " + ii
         # remote tar
-        self.block_checkcall('tar czf %s %s' % (of, flist))
+        self.block_checkcall(codec.get_remote_archive_cmd(flist, of))
         # trans
         from_f = os.path.join(self.remote_root, of)
         to_f = os.path.join(self.local_root, of)
         if os.path.isfile(to_f) :
             os.remove(to_f)
-        sftp = self.ssh.open_sftp()
-        sftp.get(from_f, to_f)
-        # extract
-        cwd = os.getcwd()
-        os.chdir(self.local_root)
-        with tarfile.open(of, "r:gz") as tar:
-            tar.extractall()
-        os.chdir(cwd)        
-        # cleanup
-        os.remove(to_f)
-        sftp.remove(from_f)
-        sftp.close()
+        with self.ssh_session.sftp_client() as sftp:
+            sftp.get(from_f, to_f)
+            # extract
+            cwd = os.getcwd()
+            os.chdir(self.local_root)
+            with open(of, 'rb') as fp:
+                with tarfile.open(fileobj=codec.open_reader(fp), mode="r|") as tar:
+                    tar.extractall()
+            os.chdir(cwd)        
+            # cleanup
+            os.remove(to_f)
+            sftp.remove(from_f)
+
+    def _put_files_stream(self,
+                          files,
+                          dereference = True) :
+        """upload the files by writing a tar archive directly into the stdin of a remote tar process.
+        """
+        self.ssh_session.ensure_alive()
+        codec = self.compression.resolve([os.path.join(self.local_root, ii) for ii in files])
+        remote_root = shlex.quote(self.remote_root)
+        stdin, stdout, stderr = self.ssh_session.exec_command('mkdir -p %s; %s' % (remote_root, codec.get_remote_extract_cmd(remote_root)))
+        try:
+            with codec.open_writer(stdin) as writer:
+                with tarfile.open(fileobj=writer, mode="w|", dereference = dereference) as tar:
+                    for ii in files :
+                        tar.add(os.path.join(self.local_root, ii), arcname=ii)
+        finally:
+            # send EOF, so that the remote tar process can exit
+            stdin.channel.shutdown_write()
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status != 0:
+            raise RuntimeError("Get error code %d in streaming files to %s through ssh with job: %s . message: %s" %
+                               (exit_status, self.remote_root, self.job_uuid, stderr.read().decode('utf-8')))
+
+    def _get_files_stream(self,
+                          files) :
+        """download the files by reading a tar archive directly from the stdout of a remote tar process.
+        """
+        self.ssh_session.ensure_alive()
+        codec = self.compression.resolve()
+        flist = ""
+        for ii in files :
+            flist += " " + ii
+        stdin, stdout, stderr = self.ssh_session.exec_command('cd %s; %s' % (shlex.quote(self.remote_root), codec.get_remote_archive_cmd(flist)))
+        read_error = None
+        try:
+            with tarfile.open(fileobj=codec.open_reader(stdout), mode="r|") as tar:
+                tar.extractall(path=self.local_root)
+        except tarfile.ReadError as e:
+            # an empty or broken stream, usually because the remote tar failed; reported below
+            read_error = e
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status != 0:
+            raise RuntimeError("Get error code %d in streaming files from %s through ssh with job: %s . message: %s" %
+                               (exit_status, self.remote_root, self.job_uuid, stderr.read().decode('utf-8')))
+        if read_error is not None:
+            raise read_error
+
+    def _get_upload_manifest_name(self):
+        return self.job_uuid + '_upload_manifest.json'
+
+    def _read_upload_manifest(self):
+        manifest_name = self._get_upload_manifest_name()
+        if not self.check_file_exists(manifest_name):
+            return {}
+        return json.loads(self.read_file(manifest_name))
+
+    def _write_upload_manifest(self, manifest):
+        self.write_file(self._get_upload_manifest_name(), json.dumps(manifest))
+
+    def _merge_upload_manifest(self, record_dict):
+        """add the records to the remote manifest. The manifest is shared by the jobs uploaded in parallel threads
+        (see upload_job), so it is read again and written under a lock, and the updates of the jobs do not interleave.
+        """
+        with self._upload_manifest_lock:
+            manifest = self._read_upload_manifest()
+            manifest.update(record_dict)
+            self._write_upload_manifest(manifest)
+
+    def _stat_remote_files(self, fname_list, chunk_size=200):
+        """the [size, mtime] of the remote files under remote_root, with one stat call for each chunk of files.
+        The files missing are not in the returned dict.
+        """
+        remote_stat_dict = {}
+        for ii in range(0, len(fname_list), chunk_size):
+            chunk_fname_list = fname_list[ii:ii+chunk_size]
+            ret, stdin, stdout, stderr = self.block_call('stat -c "%%s %%Y %%n" -- %s' % ' '.join([shlex.quote(fname) for fname in chunk_fname_list]))
+            for line in stdout.readlines():
+                line_split = line.rstrip('\n').split(' ', 2)
+                if len(line_split) == 3 and line_split[0].isdigit():
+                    remote_stat_dict[line_split[2]] = [int(line_split[0]), int(line_split[1])]
+        return remote_stat_dict
+
+    def _check_remote_sha256(self, sha256_dict, chunk_size=200):
+        """the remote files under remote_root whose content is not the sha256 given in sha256_dict."""
+        fname_list = list(sha256_dict.keys())
+        checked_fname_set = set()
+        for ii in range(0, len(fname_list), chunk_size):
+            chunk_fname_list = fname_list[ii:ii+chunk_size]
+            ret, stdin, stdout, stderr = self.block_call('sha256sum -- %s' % ' '.join([shlex.quote(fname) for fname in chunk_fname_list]))
+            for line in stdout.readlines():
+                line_split = line.rstrip('\n').split('  ', 1)
+                if len(line_split) == 2 and sha256_dict.get(line_split[1], None) == line_split[0]:
+                    checked_fname_set.add(line_split[1])
+        return set(fname_list) - checked_fname_set
+
+    def _put_files_incremental(self,
+                               files,
+                               dereference = True,
+                               archive_name = None) :
+        """upload only the files absent from the remote manifest, or whose content differs from the manifest record.
+        The files whose size and mtime match the record are not hashed at all; 
+        the others are hashed in parallel before being compared.
+        A file is uploaded again, whatever its record, when its remote copy is missing or is not the one uploaded:
+        the size and the mtime of the remote copies are checked against the ones recorded after the upload
+        with a stat call for many files (see _stat_remote_files), and their sha256 too with remote_cache.
+        The lock of the manifest is only held to read and merge it, not during the transfers, see _merge_upload_manifest.
+        """
+        with self._upload_manifest_lock:
+            manifest = self._read_upload_manifest()
+        local_file_list = expand_file_list(self.local_root, files, followlinks=dereference)
+        stat_func = os.stat if dereference else os.lstat
+        local_record_dict = {}
+        for fname in local_file_list:
+            file_stat = stat_func(os.path.join(self.local_root, fname))
+            local_record_dict[fname] = [file_stat.st_size, file_stat.st_mtime, None, None, None]
+
+        # the record is [size, mtime, sha256] of the local file, and [size, mtime] of its remote copy;
+        # the records written before the remote copies were checked have no remote [size, mtime], and only the size is checked
+        recorded_file_list = [fname for fname in local_file_list if fname in manifest]
+        remote_stat_dict = self._stat_remote_files(recorded_file_list)
+        dirty_file_set = set()
+        for fname in recorded_file_list:
+            remote_stat = remote_stat_dict.get(fname, None)
+            if remote_stat is None or manifest[fname][3:5] not in ([], remote_stat) or remote_stat[0] != manifest[fname][0]:
+                dirty_file_set.add(fname)
+        if self.remote_cache:
+            dirty_file_set.update(self._check_remote_sha256({fname: manifest[fname][2] for fname in recorded_file_list
+                if fname not in dirty_file_set}))
+        if len(dirty_file_set) > 0:
+            dlog.warning('incremental upload: %d remote files were changed or removed, upload them again' % len(dirty_file_set))
+
+        changed_file_list = [fname for fname, record in local_record_dict.items()
+            if fname not in manifest or manifest[fname][:2] != record[:2] or fname in dirty_file_set]
+        sha256_dict = get_sha256_many([os.path.join(self.local_root, fname) for fname in changed_file_list])
+
+        upload_file_list = []
+        # the records of the files whose mtime only changed, or whose remote [size, mtime] was not recorded
+        touched_record_dict = {}
+        for fname in changed_file_list:
+            record = local_record_dict[fname]
+            record[2] = sha256_dict[os.path.join(self.local_root, fname)]
+            if fname in manifest and manifest[fname][2] == record[2] and fname not in dirty_file_set:
+                record[3:5] = remote_stat_dict[fname]
+                touched_record_dict[fname] = record
+            else:
+                upload_file_list.append(fname)
+        changed_file_set = set(changed_file_list)
+        for fname in recorded_file_list:
+            if fname not in changed_file_set and len(manifest[fname]) < 5:
+                touched_record_dict[fname] = manifest[fname][:3] + remote_stat_dict[fname]
+        dlog.info('incremental upload: %d of %d files changed, %d to upload' % 
+            (len(changed_file_list), len(local_file_list), len(upload_file_list)))
+
+        batch_file_list = []
+        batch_bytes = 0
+        for ii, fname in enumerate(upload_file_list):
+            batch_file_list.append(fname)
+            batch_bytes += local_record_dict[fname][0]
+            if batch_bytes >= self.incremental_upload_batch_bytes or ii == len(upload_file_list) - 1:
+                self._put_files(batch_file_list, dereference = dereference, archive_name = archive_name)
+                uploaded_stat_dict = self._stat_remote_files(batch_file_list)
+                record_dict = {}
+                for uploaded_fname in batch_file_list:
+                    # a file whose remote copy is not found is left without its remote [size, mtime], and checked by its size
+                    record_dict[uploaded_fname] = local_record_dict[uploaded_fname][:3] + uploaded_stat_dict.get(uploaded_fname, [])
+                record_dict.update(touched_record_dict)
+                touched_record_dict = {}
+                # record the progress, so that an interrupted upload resumes from here
+                self._merge_upload_manifest(record_dict)
+                batch_file_list = []
+                batch_bytes = 0
+        if len(touched_record_dict) > 0:
+            self._merge_upload_manifest(touched_record_dict)
+
+    def _list_remote_cache_entries(self, cache_root):
+        entry_list = []
+        with self.ssh_session.sftp_client() as sftp:
+            try:
+                attr_list = sftp.listdir_attr(cache_root)
+            except IOError:
+                return entry_list
+        for attr in attr_list:
+            # skip the temporary files of unfinished copies
+            if stat.S_ISREG(attr.st_mode) and len(attr.filename) == 64:
+                entry_list.append((attr.filename, attr.st_size, attr.st_mtime))
+        return entry_list
+
+    def _check_remote_cache_entries(self, cache_root, entry_list, file_size_dict, chunk_size=200):
+        """the sha256 of the entries whose size or content is not the one they are named after.
+
+        Parameters
+        ----------
+        entry_list : list of tuple
+            (sha256, size, mtime) of the entries to check, see _list_remote_cache_entries.
+        file_size_dict : dict
+            the size of the content of each sha256.
+        """
+        changed_sha256_set = set([entry[0] for entry in entry_list if entry[1] != file_size_dict[entry[0]]])
+        sha256_list = [entry[0] for entry in entry_list if entry[0] not in changed_sha256_set]
+        for ii in range(0, len(sha256_list), chunk_size):
+            chunk_sha256_list = sha256_list[ii:ii+chunk_size]
+            # an entry evicted in the meantime is not listed, and it is reported as changed
+            ret, stdin, stdout, stderr = self.block_call('cd %s && sha256sum -- %s' % (shlex.quote(cache_root), ' '.join(chunk_sha256_list)))
+            checked_sha256_set = set()
+            for line in stdout.readlines():
+                line_split = line.split()
+                if len(line_split) == 2 and line_split[0] == line_split[1]:
+                    checked_sha256_set.add(line_split[0])
+            changed_sha256_set.update([sha256 for sha256 in chunk_sha256_list if sha256 not in checked_sha256_set])
+        return changed_sha256_set
+
+    def _read_remote_cache_index(self, cache_root):
+        with self.ssh_session.sftp_client() as sftp:
+            try:
+                with sftp.open(os.path.join(cache_root, cache_index_name), 'r') as fp:
+                    return json.loads(fp.read())
+            except (IOError, ValueError):
+                return {}
+
+    def _save_remote_cache_index(self, cache_root, record_dict):
+        """merge the records into the index of the store (None removes the record), see LocalContentCache.save_index."""
+        if len(record_dict) == 0:
+            return
+        index = self._read_remote_cache_index(cache_root)
+        for sha256, record in record_dict.items():
+            if record is None:
+                index.pop(sha256, None)
+            else:
+                index[sha256] = record
+        index_path = os.path.join(cache_root, cache_index_name)
+        temp_path = index_path + '.' + self.job_uuid
+        with self.ssh_session.sftp_client() as sftp:
+            with sftp.open(temp_path, 'w') as fp:
+                fp.write(json.dumps(index))
+        self.block_checkcall('mv -f %s %s' % (shlex.quote(temp_path), shlex.quote(index_path)))
+
+    def _put_files_cached(self,
+                          files,
+                          dereference = True) :
+        """hardlink the files into remote_root from the content-addressed store under the session root.
+        The files whose content is not stored yet are uploaded and added to the store first.
+        The entries are hashed remotely (see _check_remote_cache_entries) only when their size or mtime
+        is not the one recorded in the index of the store, when they were added or last checked and used.
+        """
+        self.ssh_session.ensure_alive()
+        cache_root = os.path.join(self.temp_remote_root, cache_dir_name)
+        local_file_list = expand_file_list(self.local_root, files, followlinks=dereference)
+        sha256_dict = get_sha256_many([os.path.join(self.local_root, fname) for fname in local_file_list])
+        file_sha256_dict = {fname: sha256_dict[os.path.join(self.local_root, fname)] for fname in local_file_list}
+        self._make_remote_root()
+        index = self._read_remote_cache_index(cache_root)
+        entry_list = self._list_remote_cache_entries(cache_root)
+        file_size_dict = {file_sha256_dict[fname]: os.path.getsize(os.path.join(self.local_root, fname)) for fname in local_file_list}
+        # the entries not changed since they were checked are not hashed again
+        changed_sha256_set = self._check_remote_cache_entries(cache_root, 
+            [entry for entry in entry_list if entry[0] in file_size_dict and index.get(entry[0], None) != [entry[1], int(entry[2])]],
+            file_size_dict)
+        if len(changed_sha256_set) > 0:
+            dlog.warning('remote cache: %d entries of %s were changed, upload them again' % (len(changed_sha256_set), cache_root))
+            entry_list = [entry for entry in entry_list if entry[0] not in changed_sha256_set]
+        cached_sha256_set = set([entry[0] for entry in entry_list])
+
+        # upload one file for each content missing from the store
+        upload_file_dict = {}
+        for fname in local_file_list:
+            sha256 = file_sha256_dict[fname]
+            if sha256 not in cached_sha256_set and sha256 not in upload_file_dict:
+                upload_file_dict[sha256] = fname
+        dlog.info('remote cache: %d of %d files found in %s' % 
+            (len(local_file_list) - len(upload_file_dict), len(local_file_list), cache_root))
+        if len(upload_file_dict) > 0:
+            self._put_files(list(upload_file_dict.values()), dereference = dereference)
+
+        # the entries used are touched with the time recorded in the index
+        now = int(time.time())
+        cmd_list = []
+        for sha256, fname in upload_file_dict.items():
+            entry_path = shlex.quote(os.path.join(cache_root, sha256))
+            temp_path = shlex.quote(os.path.join(cache_root, sha256 + '.' + self.job_uuid))
+            # the copy goes through a temporary name, so that no other submission sees a partial entry
+            cmd_list.append('{{ ln -f {fname} {entry} 2>/dev/null || {{ cp -f {fname} {temp} && mv -f {temp} {entry}; }}; }} && chmod a-w {entry} && touch -c -d @{now} {entry}'.format(
+                fname=shlex.quote(fname), entry=entry_path, temp=temp_path, now=now))
+        uploaded_file_set = set(upload_file_dict.values())
+        for fname in local_file_list:
+            if fname in uploaded_file_set:
+                continue
+            entry_path = shlex.quote(os.path.join(cache_root, file_sha256_dict[fname]))
+            # touch marks the entry as recently used
+            cmd_list.append('mkdir -p {dirname} && touch -c -d @{now} {entry} && rm -f {fname} && {{ ln -f {entry} {fname} 2>/dev/null || cp -f {entry} {fname}; }}'.format(
+                dirname=shlex.quote(os.path.dirname(fname) or '.'), entry=entry_path, fname=shlex.quote(fname), now=now))
+        for ii in range(0, len(cmd_list), 200):
+            self.block_checkcall('mkdir -p %s && ' % shlex.quote(cache_root) + ' && '.join(cmd_list[ii:ii+200]))
+
+        for sha256, fname in upload_file_dict.items():
+            entry_list.append((sha256, os.path.getsize(os.path.join(self.local_root, fname)), now))
+        evicted_entry_list = get_evicted_entries(entry_list, self.remote_cache_max_bytes, keep_entries=set(file_sha256_dict.values()))
+        if len(evicted_entry_list) > 0:
+            dlog.info('remote cache: evict %d entries from %s' % (len(evicted_entry_list), cache_root))
+            with self.ssh_session.sftp_client() as sftp:
+                for sha256 in evicted_entry_list:
+                    try:
+                        sftp.remove(os.path.join(cache_root, sha256))
+                    except IOError:
+                        # already evicted by another submission
+                        pass
+
+        # the entries used were checked (or just added) and touched; the ones evicted, here or by another submission, leave the index
+        record_dict = {sha256: [file_size_dict[sha256], now] for sha256 in file_size_dict}
+        left_entry_set = set([entry[0] for entry in entry_list]) - set(evicted_entry_list)
+        record_dict.update({sha256: None for sha256 in index if sha256 not in left_entry_set})
+        self._save_remote_cache_index(cache_root, record_dict)
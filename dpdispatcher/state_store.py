@@ -0,0 +1,307 @@
+import os, json, time, sqlite3
+from contextlib import closing
+from dpdispatcher import dlog
+from dpdispatcher.JobStatus import JobStatus
+
+# the runtime information of a job kept by the state stores, as in the submission json (see Job.serialize)
+job_state_key_list = ['job_state', 'job_id', 'fail_count', 'if_downloaded', 'submit_time']
+
+def get_job_record(job):
+    """the runtime information of the job, to be saved by a state store."""
+    return {'job_state': job.job_state, 'job_id': job.job_id, 'fail_count': job.fail_count,
+        'if_downloaded': job.if_downloaded, 'submit_time': job.submit_time}
+
+class JournalStateStore(object):
+    """the state of a submission kept as a snapshot and an append-only journal in the remote root,
+    instead of rewriting the whole submission json at each save.
+
+    The snapshot is the submission json, <submission_hash>.json (the same as written without a state store,
+    with the journal_generation added). Each save appends one compact record per job whose runtime information
+    (job_state, job_id, fail_count, if_downloaded, submit_time) changed since the last save to <submission_hash>.journal,
+    so that a save costs O(changed jobs) instead of O(submission size).
+    Once the journal has more records than the submission has jobs (and at least min_compact_records),
+    it is compacted: the snapshot is written again, with a new generation, and the journal is emptied.
+    load replays the records of the generation of the snapshot over it; the records of an older generation
+    (left by a compaction interrupted between the two writes) and a partial last record are ignored,
+    and the journal with a partial last record is compacted at the next save, so that no record is appended to it.
+
+    A store is used by one submission, see Submission.state_store. The context needs an append_file method.
+
+    Parameters
+    ----------
+    min_compact_records : int
+        the least number of records in the journal before it is compacted.
+    """
+    def __init__(self, min_compact_records=100):
+        self.min_compact_records = min_compact_records
+        # the generation of the snapshot, None before one is written or read
+        self.generation = None
+        self.record_num = 0
+        # the runtime information of the jobs as in snapshot + journal, keyed by the job hash
+        self.job_record_dict = {}
+        # whether the journal must be compacted at the next save
+        self.if_compact = False
+
+    @staticmethod
+    def get_snapshot_name(submission):
+        return "{submission_hash}.json".format(submission_hash=submission.submission_hash)
+
+    @staticmethod
+    def get_journal_name(submission):
+        return "{submission_hash}.journal".format(submission_hash=submission.submission_hash)
+
+    def save(self, submission):
+        """append the changed runtime information of the jobs to the journal, or compact it into a snapshot."""
+        context = submission.batch.context
+        if not hasattr(context, 'append_file'):
+            raise RuntimeError("context {context} does not support JournalStateStore".format(context=type(context).__name__))
+        if self.generation is None or self.if_compact or self.record_num >= max(self.min_compact_records, len(submission.belonging_jobs)):
+            self.write_snapshot(submission)
+            return
+        record_str_list = []
+        for job in submission.belonging_jobs:
+            job_record = get_job_record(job)
+            if self.job_record_dict.get(job.job_hash) != job_record:
+                record_str_list.append(json.dumps(dict(generation=self.generation, job_hash=job.job_hash, **job_record),
+                    separators=(',', ':'), default=str))
+                self.job_record_dict[job.job_hash] = job_record
+        if len(record_str_list) > 0:
+            context.append_file(self.get_journal_name(submission), write_str=''.join([record_str + '\n' for record_str in record_str_list]))
+            self.record_num += len(record_str_list)
+
+    def write_snapshot(self, submission):
+        """write the whole submission as the snapshot of a new generation, and empty the journal."""
+        generation = 0 if self.generation is None else self.generation + 1
+        submission_dict = submission.serialize()
+        submission_dict['journal_generation'] = generation
+        submission.batch.context.write_file(self.get_snapshot_name(submission), write_str=json.dumps(submission_dict, indent=2, default=str))
+        submission.batch.context.write_file(self.get_journal_name(submission), write_str='')
+        self.generation = generation
+        self.record_num = 0
+        self.job_record_dict = {job.job_hash: get_job_record(job) for job in submission.belonging_jobs}
+        self.if_compact = False
+
+    def load(self, submission):
+        """the submission_dict of the snapshot with the journal replayed over it, None if there is no snapshot."""
+        context = submission.batch.context
+        if not context.check_file_exists(self.get_snapshot_name(submission)):
+            return None
+        submission_dict = json.loads(context.read_file(fname=self.get_snapshot_name(submission)))
+        generation = submission_dict.pop('journal_generation', None)
+        job_record_dict = {}
+        for job_dict in submission_dict['belonging_jobs']:
+            for job_hash, job_content_dict in job_dict.items():
+                job_record_dict[job_hash] = {key: job_content_dict[key] for key in job_state_key_list if key in job_content_dict}
+        record_num = 0
+        if_compact = False
+        # a json written without the store has no generation, and no journal of its own
+        if generation is not None and context.check_file_exists(self.get_journal_name(submission)):
+            journal_str = context.read_file(fname=self.get_journal_name(submission))
+            if_compact = len(journal_str) > 0 and not journal_str.endswith('\n')
+            for line in journal_str.splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last record may be cut short by a crash
+                    continue
+                if record['generation'] != generation or record['job_hash'] not in job_record_dict:
+                    continue
+                job_record_dict[record['job_hash']] = {key: record[key] for key in job_state_key_list}
+                record_num += 1
+        for job_dict in submission_dict['belonging_jobs']:
+            for job_hash, job_content_dict in job_dict.items():
+                job_content_dict.update(job_record_dict[job_hash])
+        self.generation = generation
+        self.record_num = record_num
+        self.job_record_dict = job_record_dict
+        self.if_compact = if_compact
+        return submission_dict
+
+
+state_store_schema = """
+CREATE TABLE IF NOT EXISTS submission (
+    submission_hash TEXT PRIMARY KEY,
+    submission_head TEXT NOT NULL,
+    create_time REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job (
+    submission_hash TEXT NOT NULL,
+    job_index INTEGER NOT NULL,
+    job_hash TEXT NOT NULL,
+    resources TEXT NOT NULL,
+    job_state INTEGER,
+    job_id TEXT,
+    fail_count INTEGER NOT NULL,
+    if_downloaded INTEGER NOT NULL,
+    submit_time REAL,
+    update_time REAL NOT NULL,
+    PRIMARY KEY (submission_hash, job_index)
+);
+CREATE INDEX IF NOT EXISTS job_state ON job (submission_hash, job_state);
+CREATE INDEX IF NOT EXISTS job_hash ON job (job_hash);
+CREATE TABLE IF NOT EXISTS task (
+    submission_hash TEXT NOT NULL,
+    job_index INTEGER NOT NULL,
+    task_index INTEGER NOT NULL,
+    task_hash TEXT NOT NULL,
+    task_work_path TEXT NOT NULL,
+    task TEXT NOT NULL,
+    PRIMARY KEY (submission_hash, job_index, task_index)
+);
+CREATE INDEX IF NOT EXISTS task_hash ON task (task_hash);
+"""
+
+class SQLiteStateStore(object):
+    """the state of the submissions kept in a SQLite database on the local machine,
+    so that another process can query it (see get_jobs and get_state_counts) without reading the submission json.
+
+    The jobs and the tasks of a submission are inserted at its first save, with their order;
+    each later save updates the runtime information (job_state, job_id, fail_count, if_downloaded, submit_time)
+    of the jobs changed since the last save of this store, in one transaction. The jobs are indexed by their state.
+    As RuntimeHistory, the database is in WAL mode, and every call opens its own connection,
+    so that several dispatcher processes (for example, working on different submissions in one work directory)
+    and the monitoring processes can use it at the same time. A store can be shared by many submissions.
+
+    Parameters
+    ----------
+    db_path : path-like
+        the database file; its directory is created if missing.
+    timeout : float
+        how long (seconds) to wait for the lock held by another process before failing.
+    """
+    def __init__(self, db_path, timeout=30.):
+        self.db_path = db_path
+        self.timeout = timeout
+        # the runtime information of the jobs as saved, keyed by the submission hash and then the job index
+        self.job_record_dict = {}
+        dirname = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(dirname, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.executescript(state_store_schema)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def save(self, submission):
+        """insert the submission if it is new, and update the runtime information of the jobs changed."""
+        submission_hash = submission.submission_hash
+        update_time = time.time()
+        with closing(self._connect()) as conn:
+            with conn:
+                if submission_hash not in self.job_record_dict:
+                    if self._insert_submission(conn, submission, update_time):
+                        self.job_record_dict[submission_hash] = {job_index: get_job_record(job)
+                            for job_index, job in enumerate(submission.belonging_jobs)}
+                        return
+                    # inserted before, by another store
+                    self.job_record_dict[submission_hash] = {}
+                job_record_dict = self.job_record_dict[submission_hash]
+                update_list = []
+                for job_index, job in enumerate(submission.belonging_jobs):
+                    job_record = get_job_record(job)
+                    if job_record_dict.get(job_index) != job_record:
+                        update_list.append([job_record[key] for key in job_state_key_list] + [update_time, submission_hash, job_index])
+                        job_record_dict[job_index] = job_record
+                conn.executemany("UPDATE job SET {columns}, update_time = ? WHERE submission_hash = ? AND job_index = ?".format(
+                    columns=', '.join(['{key} = ?'.format(key=key) for key in job_state_key_list])), update_list)
+        dlog.debug('state store: %d jobs of submission %s updated in %s' % (len(update_list), submission_hash, self.db_path))
+
+    def _insert_submission(self, conn, submission, update_time):
+        # False if the submission is already in the database
+        submission_hash = submission.submission_hash
+        submission_head = submission.serialize(if_static=True)
+        submission_head.pop('belonging_jobs')
+        cursor = conn.execute("INSERT OR IGNORE INTO submission (submission_hash, submission_head, create_time) VALUES (?, ?, ?)",
+            (submission_hash, json.dumps(submission_head), update_time))
+        if cursor.rowcount == 0:
+            return False
+        job_row_list = []
+        task_row_list = []
+        for job_index, job in enumerate(submission.belonging_jobs):
+            job_record = get_job_record(job)
+            job_row_list.append([submission_hash, job_index, job.job_hash, json.dumps(job.resources.serialize())]
+                + [job_record[key] for key in job_state_key_list] + [update_time])
+            for task_index, task in enumerate(job.job_task_list):
+                task_row_list.append((submission_hash, job_index, task_index, task.task_hash, task.task_work_path, json.dumps(task.serialize())))
+        conn.executemany("INSERT INTO job (submission_hash, job_index, job_hash, resources, {columns}, update_time) "
+            "VALUES ({values})".format(columns=', '.join(job_state_key_list), values=', '.join(['?'] * (len(job_state_key_list) + 5))),
+            job_row_list)
+        conn.executemany("INSERT INTO task (submission_hash, job_index, task_index, task_hash, task_work_path, task) "
+            "VALUES (?, ?, ?, ?, ?, ?)", task_row_list)
+        return True
+
+    def load(self, submission):
+        """the submission_dict of the submission (as Submission.serialize), None if it is not in the database."""
+        submission_hash = submission.submission_hash
+        with closing(self._connect()) as conn:
+            # one read transaction, so that the jobs and the tasks are of the same moment
+            conn.execute('BEGIN')
+            row = conn.execute("SELECT submission_head FROM submission WHERE submission_hash = ?", (submission_hash,)).fetchone()
+            if row is None:
+                return None
+            submission_dict = json.loads(row[0])
+            task_list_dict = {}
+            for job_index, task_str in conn.execute("SELECT job_index, task FROM task WHERE submission_hash = ? "
+                    "ORDER BY job_index, task_index", (submission_hash,)):
+                task_list_dict.setdefault(job_index, []).append(json.loads(task_str))
+            job_dict_list = []
+            job_record_dict = {}
+            for row in conn.execute("SELECT job_index, job_hash, resources, {columns} FROM job WHERE submission_hash = ? "
+                    "ORDER BY job_index".format(columns=', '.join(job_state_key_list)), (submission_hash,)):
+                job_record = dict(zip(job_state_key_list, row[3:]))
+                job_record['if_downloaded'] = bool(job_record['if_downloaded'])
+                job_record_dict[row[0]] = job_record
+                job_dict_list.append({row[1]: dict({'job_task_list': task_list_dict.get(row[0], []), 'resources': json.loads(row[2])},
+                    **job_record)})
+            conn.rollback()
+        submission_dict['belonging_jobs'] = job_dict_list
+        self.job_record_dict[submission_hash] = job_record_dict
+        return submission_dict
+
+    def get_jobs(self, submission_hash, job_state_list=None):
+        """the runtime information of the jobs of the submission, with job_hash, for example to find the jobs still running.
+
+        Parameters
+        ----------
+        submission_hash : str
+            the hash of the submission.
+        job_state_list : list of JobStatus or None
+            the states of the jobs returned; if None, all the jobs are.
+
+        Returns
+        -------
+        job_list : list of dict
+            each has the keys job_hash, job_state, job_id, fail_count, if_downloaded, submit_time and update_time.
+        """
+        sql = "SELECT job_hash, {columns}, update_time FROM job WHERE submission_hash = ?".format(columns=', '.join(job_state_key_list))
+        parameter_list = [submission_hash]
+        if job_state_list is not None:
+            sql += " AND job_state IN ({marks})".format(marks=', '.join(['?'] * len(job_state_list)))
+            parameter_list.extend([int(job_state) for job_state in job_state_list])
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql + " ORDER BY job_index", parameter_list).fetchall()
+        job_list = []
+        for row in rows:
+            job_dict = dict(zip(['job_hash'] + job_state_key_list + ['update_time'], row))
+            if job_dict['job_state'] is not None:
+                job_dict['job_state'] = JobStatus(job_dict['job_state'])
+            job_dict['if_downloaded'] = bool(job_dict['if_downloaded'])
+            job_list.append(job_dict)
+        return job_list
+
+    def get_state_counts(self, submission_hash):
+        """the number of the jobs of the submission in each state, indexed by the state (None for the jobs never queried)."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT job_state, COUNT(*) FROM job WHERE submission_hash = ? GROUP BY job_state",
+                (submission_hash,)).fetchall()
+        return {(JobStatus(job_state) if job_state is not None else None): count for job_state, count in rows}
+
+    def get_submission_hashes(self):
+        """the hashes of the submissions in the database, the latest created first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT submission_hash FROM submission ORDER BY create_time DESC").fetchall()
+        return [row[0] for row in rows]
@@ -1,8 +1,20 @@
-import os,sys,time,random,uuid,json,copy
+import os,sys,time,random,uuid,json,glob,zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dpdispatcher.JobStatus import JobStatus
 from dpdispatcher import dlog
 from hashlib import sha1
 from dpdispatcher.slurm import SlurmResources
+from dpdispatcher.poll_policy import FixedPollPolicy
+from dpdispatcher.task_telemetry import get_task_telemetry_file, parse_task_telemetry, summarize_job_telemetry
+from dpdispatcher.runtime_history import normalize_command, get_input_fingerprint
+from dpdispatcher.job_packing import packing_strategy_list, pack_lpt, pack_ffd
+from dpdispatcher.utils import expand_file_list
+
+def intern_value(value, intern_cache):
+    """the value equal to value already in intern_cache (added if there is none),
+    so that the tasks share one object for the equal file names and commands.
+    """
+    return intern_cache.setdefault(value, value)
 
 class Submission(object):
     """submission represents the whole workplace, all the tasks to be calculated
@@ -19,13 +31,30 @@ class Submission(object):
     batch : Batch
         Batch class object (for example, PBS, Slurm, Shell) to execute the jobs. 
         The batch can still be bound after the instantiation with the bind_submission method.
+    poll_policy : FixedPollPolicy
+        decides the interval between two checks of the job states in run_submission, for example AdaptivePollPolicy.
+        If None, the job states are checked every 10 seconds.
+    runtime_history : RuntimeHistory
+        the database of the task runtimes. If given, the telemetry of the tasks (see Resources.if_telemetry)
+        is added to it at the end of run_submission, and predict_task_runtimes uses it by default.
+    result_cache : TaskResultCache
+        the cache of the task results. If given, the tasks found in it are restored and dropped by generate_jobs
+        (see apply_result_cache), and the tasks run are added to it at the end of run_submission (see insert_result_cache).
+    state_store : JournalStateStore or SQLiteStateStore
+        where the state of the submission is saved and recovered from (see submission_to_json and try_recover_from_json):
+        a journal in the remote root, or a SQLite database on the local machine that other processes can query.
+        If None, the whole submission json is written at each save.
     """
     def __init__(self,
                 work_base,
                 resources,
                 forward_common_files=[],
                 backward_common_files=[],
-                batch=None):
+                batch=None,
+                poll_policy=None,
+                runtime_history=None,
+                result_cache=None,
+                state_store=None):
         # self.submission_list = submission_list
         self.work_base = work_base
         self.resources = resources
@@ -35,6 +64,23 @@ class Submission(object):
         self.submission_hash = None
         self.belonging_tasks = []
         self.belonging_jobs = []
+
+        if poll_policy is None:
+            poll_policy = FixedPollPolicy(interval=10)
+        self.poll_policy = poll_policy
+        self.last_query_duration = 0.
+        self.runtime_history = runtime_history
+        self.result_cache = result_cache
+        self.state_store = state_store
+        # the tasks restored from the result cache, which are not in belonging_tasks
+        self.cached_tasks = []
+        # the result cache keys of the tasks computed before the run, indexed by task.task_hash, see apply_result_cache
+        self.result_cache_key_dict = {}
+        # the file names and commands shared by the tasks, see intern_task
+        self._intern_cache = {}
+        # the hash and the parts it is computed from, see get_hash
+        self._hash_key = None
+        self._hash = None
     
         self.bind_batch(batch)
 
@@ -47,7 +93,7 @@ class Submission(object):
         """
         # print('submission.__eq__()  self', self.serialize(if_static=True))
         # print('submission.__eq__() other', other.serialize(if_static=True))
-        return self.serialize(if_static=True) == other.serialize(if_static=True)    
+        return self.get_hash() == other.get_hash()
     
     @classmethod
     def deserialize(cls, submission_dict, batch=None):
@@ -68,6 +114,13 @@ class Submission(object):
             forward_common_files=submission_dict['forward_common_files'],
             backward_common_files=submission_dict['backward_common_files'])
         submission.belonging_jobs = [Job.deserialize(job_dict=job_dict) for job_dict in submission_dict['belonging_jobs']]
+        # the jobs share the resources of the submission (or the other jobs) equal to theirs, see Resources,
+        # and the tasks share the equal file names and commands
+        resources_cache = {json.dumps(submission.resources.serialize(), sort_keys=True): submission.resources}
+        for job in submission.belonging_jobs:
+            job.resources = resources_cache.setdefault(json.dumps(job.resources.serialize(), sort_keys=True), job.resources)
+            for task in job.job_task_list:
+                submission.intern_task(task)
         submission.submission_hash = submission.get_hash()
         submission.bind_batch(batch=batch)
         return submission
@@ -98,15 +151,44 @@ class Submission(object):
         if self.belonging_jobs:
             raise RuntimeError("Not allowed to register tasks after generating jobs."
                     "submission hash error {self}".format(self))
-        self.belonging_tasks.append(task)
+        self.belonging_tasks.append(self.intern_task(task))
 
     def register_task_list(self, task_list):
         if self.belonging_jobs:
             raise RuntimeError("Not allowed to register tasks after generating jobs."
                     "submission hash error {self}".format(self))
-        self.belonging_tasks.extend(task_list)
+        self.belonging_tasks.extend([self.intern_task(task) for task in task_list])
+
+    def intern_task(self, task):
+        """make the task share its file name tuples and its command with the equal ones of the other tasks of the submission."""
+        task.forward_files = intern_value(task.forward_files, self._intern_cache)
+        task.backward_files = intern_value(task.backward_files, self._intern_cache)
+        task.command = intern_value(task.command, self._intern_cache)
+        return task
+
     def get_hash(self):
-        return sha1(str(self.serialize(if_static=True)).encode('utf-8')).hexdigest() 
+        """the sha1 of str(self.serialize(if_static=True)).
+
+        The hash is kept as long as the job hashes and the other serialized attributes are the same;
+        it is computed again from the serialization kept by each job with its hash (see Job.get_hash),
+        so that only the jobs changed, and the jobs of the tasks changed, are serialized again.
+        """
+        head_str = "{{'work_base': {work_base!r}, 'resources': {resources}, 'forward_common_files': {forward_common_files}, "\
+            "'backward_common_files': {backward_common_files}, 'belonging_jobs': [".format(
+            work_base=self.work_base, resources=self.resources.serialize(),
+            forward_common_files=self.forward_common_files, backward_common_files=self.backward_common_files)
+        hash_key = (head_str, tuple([job.get_hash() for job in self.belonging_jobs]))
+        if hash_key != self._hash_key:
+            hash_obj = sha1(head_str.encode('utf-8'))
+            # the serialization of each job is the one kept with its hash, and it is not built again in full
+            for ii, job in enumerate(self.belonging_jobs):
+                hash_obj.update("{sep}{{'{job_hash}': ".format(sep=', ' if ii else '', job_hash=job.get_hash()).encode('utf-8'))
+                hash_obj.update(zlib.decompress(job._static_bytes))
+                hash_obj.update(b'}')
+            hash_obj.update(b']}')
+            self._hash = hash_obj.hexdigest()
+            self._hash_key = hash_key
+        return self._hash
     
     def bind_batch(self, batch):
         """bind this submission to a batch. update the batch's context remote_root and local_root.
@@ -125,24 +207,58 @@ class Submission(object):
         return self
 
             
-    def run_submission(self):
+    def run_submission(self, *, incremental_download=False, pipeline_upload=False, max_upload_workers=4, watch_finish=False):
         """main method to execute the submission.
         First, check whether old Submission exists on the remote machine, and try to recover from it.
         Second, upload the local files to the remote machine where the tasks to be executed.
         Third, run the submission defined previously.
         Forth, wait until the tasks in the submission finished and download the result file to local directory.
+
+        Parameters
+        ----------
+        incremental_download : bool
+            if True, the backward_files of each job are downloaded as soon as the job finishes, 
+            instead of after all the jobs finish. The jobs downloaded are recorded in the submission json,
+            so that they are not downloaded again after recovering.
+        pipeline_upload : bool
+            if True, the files are uploaded job by job, and each job is submitted as soon as its files are uploaded.
+            See upload_and_submit_jobs.
+        max_upload_workers : int
+            the number of jobs uploaded in parallel when pipeline_upload is True.
+        watch_finish : bool
+            if True, wait for the jobs with a watcher of the job_tag_finished files (see FinishTagWatcher)
+            instead of sleeping a fixed interval, so that the submission state is checked as soon as a job finishes.
+            Only the contexts on the local file system (LocalContext and LazyLocalContext) support it.
         """
+        if pipeline_upload and self.if_pilot():
+            raise RuntimeError("pipeline_upload is not supported by the 'pilot' task_runner: a pilot runs the tasks of any job")
+        if len(self.belonging_jobs) == 0 and len(self.cached_tasks) > 0:
+            # all the tasks were restored from the result cache
+            return True
         self.try_recover_from_json()
         if self.check_all_finished():
             pass
+        elif pipeline_upload:
+            self.upload_and_submit_jobs(max_workers=max_upload_workers)
         else:
             self.upload_jobs()
             self.handle_unexpected_submission_state()
             self.submission_to_json
+
+        finish_watcher = None
+        if watch_finish:
+            if not hasattr(self.batch.context, 'create_finish_watcher'):
+                raise RuntimeError("context {context} does not support watch_finish".format(context=type(self.batch.context).__name__))
+            finish_watcher = self.batch.context.create_finish_watcher()
         
         while not self.check_all_finished():
             try: 
-                time.sleep(10)
+                poll_interval = self.poll_policy.next_interval(
+                    {job.job_hash: job.job_state for job in self.belonging_jobs}, self.last_query_duration)
+                if finish_watcher is not None:
+                    finish_watcher.wait(poll_interval)
+                else:
+                    time.sleep(poll_interval)
             except KeyboardInterrupt as e:
                 self.submission_to_json()
                 print('<<<<<<dpdispatcher<<<<<<KeyboardInterrupt<<<<<<exit<<<<<<')
@@ -166,22 +282,43 @@ class Submission(object):
                 exit(3)
             else:
                 self.handle_unexpected_submission_state()
+                if incremental_download:
+                    self.download_finished_jobs()
             finally:
                 pass
+        if finish_watcher is not None:
+            finish_watcher.close()
         self.handle_unexpected_submission_state()
-        self.submission_to_json()
-        self.download_jobs()
+        # the states were just queried by check_all_finished
+        self.submission_to_json(if_query_state=False)
+        if incremental_download:
+            self.batch.context.download(self, job_list=[job for job in self.belonging_jobs if not job.if_downloaded])
+            for job in self.belonging_jobs:
+                job.if_downloaded = True
+            self._write_submission_json()
+        else:
+            self.download_jobs()
+        self.load_task_telemetry()
+        if self.runtime_history is not None:
+            self.record_runtime_history()
+        if self.result_cache is not None:
+            self.insert_result_cache()
         return True
     
     def get_submission_state(self):
-        """check whether all the jobs in the submission.
+        """check the states of all the jobs in the submission.
+        The states are queried in bulk with batch.check_status_many, 
+        so that a poll cycle costs one scheduler query instead of one query per job.
 
         Notes 
         -----
         this method will not handle unexpected (like resubmit terminated) job state in the submission.
         """
+        query_start_time = time.monotonic()
+        job_state_dict = self.batch.check_status_many(self.belonging_jobs)
+        self.last_query_duration = time.monotonic() - query_start_time
         for job in self.belonging_jobs:
-            job.get_job_state()
+            job.job_state = job_state_dict[job.job_hash]
             print('debug: job: ', job.job_hash, job.job_id, job.job_state)
         # self.submission_to_json()
 
@@ -190,10 +327,52 @@ class Submission(object):
         If the job state is unsubmitted, submit the job.
         If the job state is terminated (killed unexpectly), resubmit the job.
         If the job state is unknown, raise an error.
+        If the batch submits job arrays (batch.if_job_array), the jobs to (re)submit are submitted together, see submit_jobs.
+        With the 'pilot' task_runner, the pilot queue is written before the jobs are (re)submitted, see write_pilot_queue.
         """
+        if self.if_pilot() and any([job.job_state in [JobStatus.unsubmitted, JobStatus.terminated] for job in self.belonging_jobs]):
+            self.write_pilot_queue()
+        if getattr(self.batch, 'if_job_array', False):
+            submit_jobs = [job for job in self.belonging_jobs if job.job_state in [JobStatus.unsubmitted, JobStatus.terminated]]
+            if len(submit_jobs) > 1:
+                self.submit_jobs(submit_jobs)
         for job in self.belonging_jobs:
             job.handle_unexpected_job_state()
 
+    def submit_jobs(self, jobs):
+        """(re)submit many jobs with one batch.do_submit_many call, for example as one job array,
+        and query their states at once.
+        """
+        for job in jobs:
+            if job.job_state == JobStatus.terminated:
+                print("job: {job_hash} terminated; restarting job".format(job_hash=job.job_hash))
+            if job.fail_count > 5:
+                raise RuntimeError("job:job {job} failed 5 times".format(job=job))
+            job.fail_count += 1
+        job_id_dict = self.batch.do_submit_many(jobs)
+        for job in jobs:
+            job.register_job_id(job_id_dict[job.job_hash])
+            print("job: {job_hash} submit; job_id is {job_id}".format(job_hash=job.job_hash, job_id=job.job_id))
+        job_state_dict = self.batch.check_status_many(jobs)
+        for job in jobs:
+            job.job_state = job_state_dict[job.job_hash]
+
+    def if_pilot(self):
+        """whether the jobs are pilot jobs, with the 'pilot' task_runner (see Resources.task_runner)."""
+        if type(self.resources) is SlurmResources:
+            return self.resources.resources.task_runner == 'pilot'
+        return self.resources.task_runner == 'pilot'
+
+    def write_pilot_queue(self):
+        """write the script seeding the queue of the tasks shared by the pilot jobs (see Batch.gen_pilot_queue_script),
+        and give its name to the jobs. The queue is named after the submission hash, and the script is written once.
+        """
+        pilot_queue_name = self.submission_hash + '_pilot_queue'
+        for job in self.belonging_jobs:
+            job.pilot_queue_name = pilot_queue_name
+        if not self.batch.context.check_file_exists(pilot_queue_name + '.sh'):
+            self.batch.context.write_file(pilot_queue_name + '.sh', write_str=self.batch.gen_pilot_queue_script(self.belonging_jobs))
+
     def submit_submission(self):
         """submit the job belonging to the submission.
         """
@@ -212,18 +391,45 @@ class Submission(object):
         # print('debug:***', [job.job_state for job in self.belonging_jobs])
         # print('debug:***', [job for job in self.belonging_jobs])
         if any( (job.job_state in  [JobStatus.terminated, JobStatus.unknown] ) for job in self.belonging_jobs):
-            self.submission_to_json()
+            # the states were just queried
+            self.submission_to_json(if_query_state=False)
         if any( (job.job_state in  [JobStatus.running, JobStatus.waiting, JobStatus.unsubmitted, JobStatus.completing, JobStatus.terminated, JobStatus.unknown] ) for job in self.belonging_jobs):
             return False
         else:
             return True
 
-    def generate_jobs(self):
+    def generate_jobs(self, *, packing='random', task_cost=None, pilot_num=None):
         """After tasks register to the self.belonging_tasks, 
         This method generate the jobs and add these jobs to self.belonging_jobs.
-        The jobs are generated by the tasks randomly, and there are self.resources.group_size tasks in a task.
+
+        With packing='random' (the default), the jobs are generated by the tasks randomly, and there are self.resources.group_size tasks in a task.
         Why we randomly shuffle the tasks is under the consideration of load balance.
         The random seed is a constant (to be concrete, 42). And this insures that the jobs are equal when we re-run the program.
+
+        With packing='lpt' or 'ffd', the tasks are packed by their estimated work, cost * task_need_resources,
+        so that the jobs have about the same total work (see job_packing.pack_lpt and job_packing.pack_ffd);
+        a job still has at most group_size tasks.
+        The packing is deterministic for the same costs, so the submission_hash is stable for recovering
+        as long as the costs do not change.
+
+        Parameters
+        ----------
+        packing : str
+            'random', 'lpt' (longest processing time first) or 'ffd' (first fit decreasing).
+        task_cost : callable, str or None
+            the cost estimate of the tasks for packing 'lpt' and 'ffd':
+            a function of the task returning its cost (None if unknown);
+            'forward_files_size', the total size of the forward_files of the task under work_base;
+            'runtime_history', the median runtime predicted from self.runtime_history (see predict_task_runtimes).
+            Note that the predictions change as the history grows, so pass the same costs in a function to recover a submission.
+            The tasks with unknown costs take the mean of the known costs. If None, all the tasks cost 1.
+        pilot_num : int or None
+            the number of pilot jobs, with the 'pilot' task_runner (see Resources.task_runner), instead of the number
+            of jobs of group_size tasks. The tasks are dealt to the pilots at random, and the pilot of a job waits for
+            its tasks before it exits, while the tasks are run by whichever pilot claims them first, so packing is not used.
+
+        If self.result_cache is given, the tasks found in it are restored and dropped first, see apply_result_cache;
+        no job is generated if all of them are.
         """
 
         group_size = self.resources.group_size
@@ -232,30 +438,272 @@ class Submission(object):
         task_num = len(self.belonging_tasks)
         if task_num == 0:
             raise RuntimeError("submission must have at least 1 task")
-        random.seed(42)
-        random_task_index = list(range(task_num))
-        random.shuffle(random_task_index)
-        random_task_index_ll = [random_task_index[ii:ii+group_size] for ii in range(0,task_num,group_size)]
+        if self.result_cache is not None:
+            self.apply_result_cache()
+            task_num = len(self.belonging_tasks)
+            if task_num == 0:
+                self.submission_hash = self.get_hash()
+                return
+        if packing not in packing_strategy_list:
+            raise RuntimeError("packing must be one of {packing_strategy_list}, got {packing}".format(
+                packing_strategy_list=packing_strategy_list, packing=packing))
+        if pilot_num is not None:
+            if not self.if_pilot():
+                raise RuntimeError("pilot_num needs the 'pilot' task_runner")
+            if pilot_num < 1 or type(pilot_num) is not int:
+                raise RuntimeError('pilot_num must be a positive number')
+            if packing != 'random':
+                raise RuntimeError("packing is not used with pilot_num, got {packing}".format(packing=packing))
+            random.seed(42)
+            random_task_index = list(range(task_num))
+            random.shuffle(random_task_index)
+            task_index_ll = [random_task_index[ii::pilot_num] for ii in range(min(pilot_num, task_num))]
+        elif packing == 'random':
+            random.seed(42)
+            random_task_index = list(range(task_num))
+            random.shuffle(random_task_index)
+            task_index_ll = [random_task_index[ii:ii+group_size] for ii in range(0,task_num,group_size)]
+        else:
+            work_list = [cost * task.task_need_resources for cost, task in zip(self.get_task_costs(task_cost), self.belonging_tasks)]
+            if packing == 'lpt':
+                task_index_ll = pack_lpt(work_list, group_size)
+            else:
+                task_index_ll = pack_ffd(work_list, group_size)
         
-        for ii in random_task_index_ll:
+        for ii in task_index_ll:
             job_task_list = [ self.belonging_tasks[jj] for jj in ii ]
-            job = Job(job_task_list=job_task_list, batch=self.batch, resources=copy.deepcopy(self.resources))
+            # the jobs share the resources of the submission, see Resources
+            job = Job(job_task_list=job_task_list, batch=self.batch, resources=self.resources)
             self.belonging_jobs.append(job)
         self.submission_hash = self.get_hash()
+
+    def get_task_costs(self, task_cost=None):
+        """the cost estimate of each task of self.belonging_tasks, see generate_jobs."""
+        if task_cost is None:
+            return [1.] * len(self.belonging_tasks)
+        elif callable(task_cost):
+            cost_list = [task_cost(task) for task in self.belonging_tasks]
+        elif task_cost == 'forward_files_size':
+            cost_list = []
+            for task in self.belonging_tasks:
+                task_root = os.path.join(self.work_base, task.task_work_path)
+                fname_list = [os.path.join(task_root, fname) for fname in expand_file_list(task_root, task.forward_files)]
+                cost_list.append(sum([os.path.getsize(fname) for fname in fname_list if os.path.isfile(fname)]))
+        elif task_cost == 'runtime_history':
+            prediction_dict = self.predict_task_runtimes(percentiles=(50,))
+            cost_list = [prediction_dict[task.task_hash][50] if prediction_dict[task.task_hash] is not None else None
+                for task in self.belonging_tasks]
+        else:
+            raise RuntimeError("unknown task_cost {task_cost}".format(task_cost=task_cost))
+        known_cost_list = [cost for cost in cost_list if cost is not None]
+        default_cost = sum(known_cost_list) / len(known_cost_list) if known_cost_list else 1.
+        return [float(cost) if cost is not None else default_cost for cost in cost_list]
         
 
     def upload_jobs(self):
         self.batch.context.upload(self)
+
+    def upload_and_submit_jobs(self, max_workers=4):
+        """upload the files and submit the jobs in a pipeline.
+        The forward_common_files are uploaded first. Then the forward_files of the jobs to (re)submit 
+        are uploaded job by job in a pool of max_workers threads, and each job is submitted 
+        as soon as its own files are uploaded, while the uploads of the other jobs go on.
+        The jobs are submitted from the calling thread, one at a time.
+        The submission json is written when the uploads end, also if one of them failed.
+        """
+        self.batch.context.upload(self, job_list=[])
+        submit_jobs = [job for job in self.belonging_jobs if job.job_state in [JobStatus.unsubmitted, JobStatus.terminated]]
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                future_job_dict = {executor.submit(self.batch.context.upload_job, job): job for job in submit_jobs}
+                for future in as_completed(future_job_dict):
+                    future.result()
+                    future_job_dict[future].handle_unexpected_job_state()
+        finally:
+            # record the jobs submitted so far, also when an upload failed, so that a rerun does not submit them again
+            self._write_submission_json()
+        self.handle_unexpected_submission_state()
     
     def download_jobs(self):
         self.batch.context.download(self)
+
+    def download_finished_jobs(self):
+        """download the backward_files of the jobs finished (according to the last state query) but not downloaded yet,
+        and record them in the submission json.
+        """
+        if_new_download = False
+        for job in self.belonging_jobs:
+            if job.job_state == JobStatus.finished and not job.if_downloaded:
+                self.batch.context.download_job(job)
+                job.if_downloaded = True
+                if_new_download = True
+        if if_new_download:
+            self._write_submission_json()
         # for job in self.belonging_jobs:
         #     job.tag_finished()
         # self.batch.context.write_file(self.batch.finish_tag_name, write_str="")
     
-    def submission_to_json(self):
+    def load_task_telemetry(self):
+        """read the downloaded telemetry records of the jobs (see Resources.if_telemetry),
+        and set Task.telemetry of each task recorded and Job.telemetry of each job.
+        """
+        task_telemetry_dict = {}
+        for job in self.belonging_jobs:
+            for fname in job.get_backward_job_files():
+                record_path = os.path.join(self.batch.context.local_root, fname)
+                if os.path.isfile(record_path):
+                    with open(record_path, 'r') as fp:
+                        task_telemetry_dict.update(parse_task_telemetry(fp.read()))
+        if len(task_telemetry_dict) == 0:
+            return
+        # the tasks of the recovered jobs are copies of the registered tasks, so both are set
+        for task in self.belonging_tasks:
+            task.telemetry = task_telemetry_dict.get(task.task_hash, None)
+        for job in self.belonging_jobs:
+            for task in job.job_task_list:
+                task.telemetry = task_telemetry_dict.get(task.task_hash, None)
+            job.telemetry = summarize_job_telemetry([task.telemetry for task in job.job_task_list])
+
+    def _get_local_root(self):
+        """the local directory of the tasks: the local_root of the context, or work_base if no batch is bound yet."""
+        local_root = getattr(getattr(self.batch, 'context', None), 'local_root', None)
+        if local_root is None:
+            local_root = self.work_base
+        return local_root
+
+    def apply_result_cache(self):
+        """restore the backward_files of the tasks found in self.result_cache (see TaskResultCache),
+        and move these tasks from belonging_tasks to cached_tasks. Called by generate_jobs.
+        The files are under the local_root of the context, or under work_base if no batch is bound yet.
+        The keys of the other tasks are kept in result_cache_key_dict for insert_result_cache,
+        as the backward_files downloaded may overwrite the forward_files.
+        """
+        local_root = self._get_local_root()
+        key_list = self.result_cache.get_task_keys(self.belonging_tasks, local_root, self.forward_common_files)
+        task_list = []
+        for task, key in zip(self.belonging_tasks, key_list):
+            self.result_cache_key_dict[task.task_hash] = key
+            if key is not None and self.result_cache.restore(key, os.path.join(local_root, task.task_work_path)):
+                self.cached_tasks.append(task)
+            else:
+                task_list.append(task)
+        self.result_cache.save_index()
+        dlog.info("{cached} of {total} tasks restored from the result cache".format(
+            cached=len(self.belonging_tasks) - len(task_list), total=len(self.belonging_tasks)))
+        self.belonging_tasks = task_list
+
+    def insert_result_cache(self, result_cache=None):
+        """add the downloaded backward_files of the tasks to the result cache, and evict the least recently used results.
+
+        Only the tasks known to have succeeded are added: their telemetry (see Resources.if_telemetry) has exit_status 0,
+        and none of their backward_files failed to download (no tag_failure_download_* file).
+        The task_tag_finished file is written even when the command fails, so nothing is added without the telemetry.
+        The key of a task is the one computed before the run by apply_result_cache; the tasks without it are not added.
+
+        Returns
+        -------
+        insert_count : int
+            the number of the tasks added.
+        """
+        if result_cache is None:
+            result_cache = self.result_cache
+        local_root = self._get_local_root()
+        task_list = [task for job in self.belonging_jobs for task in job.job_task_list]
+        if len(task_list) > 0 and all([task.telemetry is None for task in task_list]):
+            dlog.warning("the results of the tasks are not added to the result cache without their exit status; "
+                "set if_telemetry of the resources to add them")
+        insert_count = 0
+        for task in task_list:
+            key = self.result_cache_key_dict.get(task.task_hash, None)
+            task_root = os.path.join(local_root, task.task_work_path)
+            if key is None or task.telemetry is None or task.telemetry['exit_status'] != 0:
+                continue
+            if len(glob.glob(os.path.join(glob.escape(task_root), 'tag_failure_download_*'))) > 0:
+                continue
+            if result_cache.insert(key, task_root, task.backward_files):
+                insert_count += 1
+        result_cache.evict()
+        return insert_count
+
+    def _get_runtime_keys(self, task_list, if_input_fingerprint):
+        local_root = getattr(getattr(self.batch, 'context', None), 'local_root', None)
+        key_dict_list = []
+        for task in task_list:
+            key_dict = {'command_key': normalize_command(task.command), 'task_hash': task.task_hash, 'input_fingerprint': None}
+            if if_input_fingerprint and local_root is not None:
+                key_dict['input_fingerprint'] = get_input_fingerprint(task, local_root)
+            key_dict_list.append(key_dict)
+        return key_dict_list
+
+    def record_runtime_history(self, runtime_history=None):
+        """add the runs of the tasks with telemetry (see load_task_telemetry) to the runtime history.
+        The queue wait of a task is the time from the (last) submission of its job to the start of the first task of the job.
+        """
+        if runtime_history is None:
+            runtime_history = self.runtime_history
+        task_list = []
+        queue_wait_list = []
+        for job in self.belonging_jobs:
+            queue_wait = None
+            if job.telemetry is not None and job.submit_time is not None:
+                queue_wait = max(job.telemetry['start_time'] - job.submit_time, 0.)
+            for task in job.job_task_list:
+                if task.telemetry is not None:
+                    task_list.append(task)
+                    queue_wait_list.append(queue_wait)
+        if len(task_list) == 0:
+            return 0
+        record_list = []
+        for task, key_dict, queue_wait in zip(task_list, self._get_runtime_keys(task_list, if_input_fingerprint=True), queue_wait_list):
+            record = dict(key_dict, task_need_resources=task.task_need_resources, queue_wait=queue_wait)
+            for key in ['wall_time', 'max_rss', 'exit_status', 'end_time']:
+                record[key] = task.telemetry[key]
+            record_list.append(record)
+        return runtime_history.record_many(record_list)
+
+    def predict_task_runtimes(self, percentiles=(50, 90), *, runtime_history=None, if_input_fingerprint=True):
+        """predict the runtime of each task from the runtime history (see RuntimeHistory.predict_many).
+
+        Parameters
+        ----------
+        percentiles : list of float
+            the percentiles (0 to 100) of the wall time to estimate.
+        runtime_history : RuntimeHistory
+            the history to use instead of self.runtime_history.
+        if_input_fingerprint : bool
+            whether to hash the forward_files of the tasks, so that the runs of the same input are preferred.
+
+        Returns
+        -------
+        prediction_dict : dict
+            the prediction of each task (None if unknown), indexed by task.task_hash.
+        """
+        if runtime_history is None:
+            runtime_history = self.runtime_history
+        if runtime_history is None:
+            raise RuntimeError("submission {submission_hash} has no runtime_history".format(submission_hash=self.submission_hash))
+        key_dict_list = self._get_runtime_keys(self.belonging_tasks, if_input_fingerprint=if_input_fingerprint)
+        prediction_list = runtime_history.predict_many(key_dict_list, percentiles=percentiles)
+        return {task.task_hash: prediction for task, prediction in zip(self.belonging_tasks, prediction_list)}
+
+    def submission_to_json(self, if_query_state=True):
+        """save the state of the submission, see _write_submission_json.
+
+        Parameters
+        ----------
+        if_query_state : bool
+            whether to query the job states first (see get_submission_state).
+        """
         # print('~~~~,~~~', self.serialize())
-        self.get_submission_state()
+        if if_query_state:
+            self.get_submission_state()
+        self._write_submission_json()
+
+    def _write_submission_json(self):
+        """write the submission json, or save the changes with self.state_store."""
+        if self.state_store is not None:
+            self.state_store.save(self)
+            return
         write_str = json.dumps(self.serialize(), indent=2, default=str)
         submission_file_name = "{submission_hash}.json".format(submission_hash=self.submission_hash)
         self.batch.context.write_file(submission_file_name, write_str=write_str)
@@ -270,12 +718,17 @@ class Submission(object):
 
     def try_recover_from_json(self):
         submission_file_name = "{submission_hash}.json".format(submission_hash=self.submission_hash)
-        if_recover = self.batch.context.check_file_exists(submission_file_name)
         submission = None
         submission_dict = {}
+        if self.state_store is not None:
+            submission_dict = self.state_store.load(self)
+            if_recover = submission_dict is not None
+        else:
+            if_recover = self.batch.context.check_file_exists(submission_file_name)
+            if if_recover:
+                submission_dict_str = self.batch.context.read_file(fname=submission_file_name)
+                submission_dict = json.loads(submission_dict_str)
         if if_recover :
-            submission_dict_str = self.batch.context.read_file(fname=submission_file_name)
-            submission_dict = json.loads(submission_dict_str)
             submission = Submission.deserialize(submission_dict=submission_dict)
             if self == submission:
                 self.belonging_jobs = submission.belonging_jobs
@@ -296,9 +749,10 @@ class Task(object):
     task_work_path : path-like
         the directory of each file where the files are dependent on.
     forward_files : list of path-like 
-        the files to be transmitted to other location before the calculation begins
+        the files to be transmitted to other location before the calculation begins.
+        It is kept as a tuple, shared by the tasks of a submission with the same files (see Submission.intern_task).
     backward_files : list of path-like 
-        the files to be transmitted from other location after the calculation finished
+        the files to be transmitted from other location after the calculation finished, kept as forward_files
     log : str
         the files to be transmitted from other location after the calculation finished
     err : str
@@ -308,6 +762,12 @@ class Task(object):
         Sometimes, this option will be used with Task.task_need_resources variable simultaneously. 
         Especially when the machine contains multiple Nvidia GPUs.
     """
+    # a submission may hold millions of tasks
+    __slots__ = ('command', 'task_work_path', 'forward_files', 'backward_files', 'outlog', 'errlog',
+        'task_need_resources', '_task_hash', '_job', 'telemetry')
+    # the attributes serialized, whose change invalidates the cached task_hash and the hash of the job of the task
+    hash_attr_list = ('command', 'task_work_path', 'forward_files', 'backward_files', 'outlog', 'errlog', 'task_need_resources')
+
     def __init__(self,
                 command,
                 task_work_path,
@@ -318,16 +778,19 @@ class Task(object):
                 *,
                 task_need_resources=1):
 
+        # the job the task belongs to, see Job.job_task_list
+        self._job = None
         self.command = command
         self.task_work_path = task_work_path
-        self.forward_files = forward_files
-        self.backward_files = backward_files
+        self.forward_files = tuple(forward_files)
+        self.backward_files = tuple(backward_files)
         self.outlog = outlog
         self.errlog = errlog
 
         self.task_need_resources = task_need_resources
 
-        self.task_hash = self.get_hash()
+        # the telemetry of the last run of the task, see Resources.if_telemetry; not part of the task hash
+        self.telemetry = None
         # self.task_need_resources="<to be completed in the future>"
         # self.uuid = 
 
@@ -336,10 +799,32 @@ class Task(object):
     
     def __eq__(self, other):
         return self.serialize() == other.serialize()
-    
+
+    def __setattr__(self, name, value):
+        if name in Task.hash_attr_list:
+            object.__setattr__(self, '_task_hash', None)
+            job = getattr(self, '_job', None)
+            if job is not None:
+                job._reset_hash()
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        # the job is not copied with the task; it is set again when the task is given to a job
+        return (None, {name: getattr(self, name) for name in Task.__slots__ if name != '_job' and hasattr(self, name)})
+
+    @property
+    def task_hash(self):
+        return self.get_hash()
     
     def get_hash(self):
-        return sha1(str(self.serialize()).encode('utf-8')).hexdigest() 
+        """the sha1 of the serialized task, computed once and kept until the task is changed."""
+        return self.get_hash_digest().hex()
+
+    def get_hash_digest(self):
+        """the sha1 of the serialized task as bytes, which is how it is kept (a third of the memory of the hex str)."""
+        if self._task_hash is None:
+            self._task_hash = sha1(str(self.serialize()).encode('utf-8')).digest()
+        return self._task_hash
 
     @classmethod
     def deserialize(cls, task_dict):
@@ -361,8 +846,9 @@ class Task(object):
         task_dict={}
         task_dict['command'] = self.command
         task_dict['task_work_path'] = self.task_work_path
-        task_dict['forward_files'] = self.forward_files
-        task_dict['backward_files'] = self.backward_files
+        # lists, as before the tuples, so that the hashes do not change
+        task_dict['forward_files'] = list(self.forward_files)
+        task_dict['backward_files'] = list(self.backward_files)
         task_dict['outlog'] = self.outlog
         task_dict['errlog'] = self.errlog
         task_dict['task_need_resources'] = self.task_need_resources
@@ -377,10 +863,13 @@ class Job(object):
     job_task_liste : list of Task
         the tasks belong to the job
     resources : Resources
-        the machine resources. Passed from Submission when instantiating.
+        the machine resources. Passed from Submission when instantiating, and shared with the other jobs.
     batch : Batch
         Batch object to execute the job. Passed from Submission when instantiating.
     """
+    __slots__ = ('job_task_list', 'resources', 'batch', 'job_state', 'job_id', 'fail_count', 'if_downloaded',
+        'telemetry', 'submit_time', 'pilot_queue_name', '_job_hash', '_static_bytes', '_resources_str')
+
     def __init__(self,
                 job_task_list,
                 *,
@@ -395,10 +884,25 @@ class Job(object):
         self.job_state = None # JobStatus.unsubmitted
         self.job_id = ""
         self.fail_count = 0
+        # whether the backward_files are downloaded, see Submission.download_finished_jobs
+        self.if_downloaded = False
+        # the telemetry summarized from the tasks, see Resources.if_telemetry
+        self.telemetry = None
+        # when the job was last submitted (seconds since epoch)
+        self.submit_time = None
+        # the queue of the tasks shared by the pilot jobs, see Submission.write_pilot_queue
+        self.pilot_queue_name = None
+
+        # the serialization of the resources other than Resources (SlurmResources) the hash was computed with, see get_hash
+        self._resources_str = None
+
+    @property
+    def job_hash(self):
+        return self.get_hash()
 
-        # self.job_hash = self.get_hash()
-        self.job_hash = self.get_hash()
-        self.script_file_name = self.job_hash+ '.sub'
+    @property
+    def script_file_name(self):
+        return self.job_hash + '.sub'
 
 
     def __repr__(self):
@@ -408,7 +912,7 @@ class Job(object):
         """When check whether the two jobs are equal, 
         we disregard the runtime infomation(job_state, job_id, fail_count) of the jobs.
         """
-        return self.serialize(if_static=True) == other.serialize(if_static=True)
+        return self.get_hash() == other.get_hash()
 
     @classmethod
     def deserialize(cls, job_dict, batch=None):
@@ -437,6 +941,8 @@ class Job(object):
         job.job_state = job_dict[job_hash]['job_state']
         job.job_id = job_dict[job_hash]['job_id']
         job.fail_count = job_dict[job_hash]['fail_count']
+        job.if_downloaded = job_dict[job_hash].get('if_downloaded', False)
+        job.submit_time = job_dict[job_hash].get('submit_time', None)
         return job
 
     def get_job_state(self):
@@ -471,8 +977,57 @@ class Job(object):
             print("job: {job_hash} submit; job_id is {job_id}".format(job_hash=self.job_hash, job_id=self.job_id))
             self.get_job_state()
     
+    def __setattr__(self, name, value):
+        if name == 'job_task_list':
+            # a task belongs to one job, whose hash is computed again when the task is changed
+            for task in value:
+                object.__setattr__(task, '_job', self)
+        if name == 'resources' and type(value) is Resources:
+            # the resources of a job may be shared by other jobs, see Resources
+            object.__setattr__(value, '_if_shared', True)
+        if name in ('job_task_list', 'resources'):
+            self._reset_hash()
+        object.__setattr__(self, name, value)
+
+    def _reset_hash(self):
+        """drop the cached hash, when a task of the job (see Task.__setattr__), or the tasks or the resources are changed."""
+        object.__setattr__(self, '_job_hash', None)
+        object.__setattr__(self, '_static_bytes', None)
+
     def get_hash(self):
-        return str(list(self.serialize(if_static=True).keys())[0])
+        """the sha1 of the static serialization of the job (see serialize).
+
+        The hash and the serialization it is computed from are kept until a task of the job is changed,
+        or the job is given other tasks or resources; the other jobs keep theirs. The Resources can not be
+        changed once held by a job; the other resources (SlurmResources) are serialized again and compared instead.
+        The job_task_list is not watched for changes in place; give the job a new list instead.
+        """
+        if self._job_hash is not None and self._resources_str is not None:
+            if str(self.resources.serialize()) != self._resources_str:
+                self._reset_hash()
+        if self._job_hash is None:
+            resources_str = str(self.resources.serialize())
+            # the same as str(self._get_content_dict())
+            static_bytes = "{{'job_task_list': [{task_str_list}], 'resources': {resources_str}}}".format(
+                task_str_list=', '.join([str(task.serialize()) for task in self.job_task_list]),
+                resources_str=resources_str).encode('utf-8')
+            object.__setattr__(self, '_job_hash', sha1(static_bytes).hexdigest())
+            # kept compressed, for Submission.get_hash
+            object.__setattr__(self, '_static_bytes', zlib.compress(static_bytes, 1))
+            object.__setattr__(self, '_resources_str', None if type(self.resources) is Resources else resources_str)
+        return self._job_hash
+
+    def get_static_str(self):
+        """str(self.serialize(if_static=True)), from the serialization kept with the hash (see get_hash)."""
+        return "{{'{job_hash}': {content_str}}}".format(job_hash=self.get_hash(), content_str=zlib.decompress(self._static_bytes).decode('utf-8'))
+
+    def _get_content_dict(self):
+        job_content_dict = {}
+        # for task in self.job_task_list:
+        job_content_dict['job_task_list'] = [ task.serialize() for task in self.job_task_list ] 
+        job_content_dict['resources'] = self.resources.serialize()
+        # job_content_dict['job_work_base'] = self.job_work_base
+        return job_content_dict
 
     def serialize(self, if_static=False):
         """convert the Task class instance to a dictionary.
@@ -487,20 +1042,29 @@ class Job(object):
         task_dict : dict
             the dictionary converted from the Task class instance
         """
-        job_content_dict = {}
-        # for task in self.job_task_list:
-        job_content_dict['job_task_list'] = [ task.serialize() for task in self.job_task_list ] 
-        job_content_dict['resources'] = self.resources.serialize()
-        # job_content_dict['job_work_base'] = self.job_work_base
-        job_hash = sha1(str(job_content_dict).encode('utf-8')).hexdigest() 
+        job_content_dict = self._get_content_dict()
+        job_hash = self.get_hash()
         if not if_static:
             job_content_dict['job_state'] = self.job_state
             job_content_dict['job_id'] = self.job_id
             job_content_dict['fail_count'] = self.fail_count
+            job_content_dict['if_downloaded'] = self.if_downloaded
+            job_content_dict['submit_time'] = self.submit_time
         return {job_hash: job_content_dict}
 
+    def get_backward_job_files(self):
+        """the files of the job itself (not of its tasks) to download with the backward_files, relative to the root."""
+        if type(self.resources) is SlurmResources:
+            resources = self.resources.resources
+        else:
+            resources = self.resources
+        if resources.if_telemetry is True:
+            return [get_task_telemetry_file(self.job_hash)]
+        return []
+
     def register_job_id(self, job_id):
         self.job_id = job_id
+        self.submit_time = time.time()
     
     def submit_job(self):
         job_id = self.batch.do_submit(self)
@@ -532,7 +1096,43 @@ class Resources(object):
         experimentally, if there are multiple nvidia GPUS on the target computer, we want to compute the jobs to different GPUS. 
         With this option, dpdispatcher will manually allocate environment variable CUDA_VISIBLE_DEVICES to different task.
         Usually, this option will be used with Task.task_need_resources variable simultaneously.
+        With the 'wave' task_runner, the GPUs of each task are decided when the script is generated, from its position in the wave.
+        With the 'dynamic' task_runner, each task is given the GPUs free when it starts, and returns them when it ends.
+    task_runner : str
+        how the tasks of a job are run in the job script. 
+        'wave': the tasks are started in waves, and each wave waits for all of its tasks to finish before the next wave starts.
+        'dynamic': a task starts as soon as the finished tasks free enough resources (Task.task_need_resources),
+        so that one slow task does not hold back the others. It needs bash 4.3 on the computing nodes.
+        'pilot': the jobs are long-lived pilots, which claim the tasks of the whole submission from a queue in the remote root
+        and run them as the 'dynamic' runner does, until the queue drains (see Batch.gen_script_command_pilot),
+        so that many short tasks do not each wait in the scheduler queue. The number of pilots is the pilot_num
+        of Submission.generate_jobs.
+    cpu_affinity : str or None
+        pin each task to its own cores, so that the tasks running together on the node do not interfere.
+        A task takes floor(task_need_resources * cpu_per_node) cores, which must be at least 1.
+        'taskset': the shell running the task is pinned with taskset -p, and the task inherits the affinity.
+        'numactl': the task command is prefixed with numactl --physcpubind --localalloc, which also keeps its memory local.
+        With the 'wave' task_runner, the cores of each task are decided when the script is generated, from its position in the wave.
+        With the 'dynamic' task_runner, each task is given the cores free when it starts, and returns them when it ends.
+        The cores are counted in the ones the job may use on the node (for example, those granted by the cgroup of the scheduler),
+        read when the job script starts; the script exits if there are less than cpu_per_node of them.
+        None (the default) does not pin the tasks.
+    if_telemetry : bool
+        if True, the job script appends the start time, end time, exit status and max RSS (measured with /usr/bin/time
+        when it is available on the computing node) of each task to a record of the job. The records are downloaded
+        with the backward_files, and the telemetry is set to Task.telemetry and Job.telemetry by Submission.run_submission.
+
+    Notes
+    -----
+    The jobs generated by a submission share its resources (and the jobs recovered from the json share
+    the equal ones). Once the resources are given to a job, they are shared and can not be changed in place any more,
+    so that a change never reaches the other jobs or the submission by surprise: setting an attribute raises RuntimeError.
+    To change the resources of one job, give it a changed copy (copy-on-write),
+    for example job.resources = job.resources.replace(queue_name='large').
     """
+    __slots__ = ('number_node', 'cpu_per_node', 'gpu_per_node', 'queue_name', 'group_size', 'if_cuda_multi_devices',
+        'task_runner', 'cpu_affinity', 'if_telemetry', '_if_shared')
+
     def __init__(self,
                 number_node,
                 cpu_per_node,
@@ -540,7 +1140,12 @@ class Resources(object):
                 queue_name,
                 group_size=1,
                 *,
-                if_cuda_multi_devices=False):
+                if_cuda_multi_devices=False,
+                task_runner='wave',
+                cpu_affinity=None,
+                if_telemetry=False):
+        # set by Job when the resources are given to a job, see the Notes
+        object.__setattr__(self, '_if_shared', False)
         self.number_node = number_node
         self.cpu_per_node = cpu_per_node
         self.gpu_per_node = gpu_per_node
@@ -548,15 +1153,41 @@ class Resources(object):
         self.group_size = group_size
         
         self.if_cuda_multi_devices = if_cuda_multi_devices
+        self.task_runner = task_runner
+        self.cpu_affinity = cpu_affinity
+        self.if_telemetry = if_telemetry
         # if self.gpu_per_node > 1:
-        
-        self.in_use = 0
             
         if self.if_cuda_multi_devices is True:
             if gpu_per_node < 1:
                 raise RuntimeError("gpu_per_node can not be smaller than 1 when if_cuda_multi_devices is True")
             if number_node != 1:
                 raise RuntimeError("number_node must be 1 when if_cuda_multi_devices is True")
+        if task_runner not in ['wave', 'dynamic', 'pilot']:
+            raise RuntimeError("task_runner must be 'wave', 'dynamic' or 'pilot', got {task_runner}".format(task_runner=task_runner))
+        if cpu_affinity is not None:
+            if cpu_affinity not in ['taskset', 'numactl']:
+                raise RuntimeError("cpu_affinity must be None, 'taskset' or 'numactl', got {cpu_affinity}".format(cpu_affinity=cpu_affinity))
+            if number_node != 1:
+                raise RuntimeError("number_node must be 1 when cpu_affinity is set")
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_if_shared', False):
+            raise RuntimeError("the resources are shared by the jobs and can not be changed in place; "
+                "use replace to get a changed copy instead of setting {name}".format(name=name))
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        return self.serialize()
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def replace(self, **kwargs):
+        """a copy of the resources, with the options given in kwargs changed."""
+        resources_dict = self.serialize()
+        resources_dict.update(kwargs)
+        return type(self)(**resources_dict)
 
     def __eq__(self, other):
         return self.serialize() == other.serialize()
@@ -569,6 +1200,13 @@ class Resources(object):
         resources_dict['queue_name'] = self.queue_name
         resources_dict['group_size'] = self.group_size
         resources_dict['if_cuda_multi_devices'] = self.if_cuda_multi_devices
+        # the options with default values are omitted, so that the hashes of the existing submissions do not change
+        if self.task_runner != 'wave':
+            resources_dict['task_runner'] = self.task_runner
+        if self.cpu_affinity is not None:
+            resources_dict['cpu_affinity'] = self.cpu_affinity
+        if self.if_telemetry is True:
+            resources_dict['if_telemetry'] = self.if_telemetry
         return resources_dict
      
     @classmethod
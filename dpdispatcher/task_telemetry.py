@@ -0,0 +1,82 @@
+import os
+from dpdispatcher import dlog
+
+# the record of the tasks of a job lies in the remote root, named after the job hash with this suffix.
+# each task appends one line when it ends: task_hash start_time end_time exit_status max_rss
+# (max_rss in KB, or '-' when /usr/bin/time is not available on the computing node).
+# a task run again (for example, after the job is resubmitted) appends a new line; the last one counts.
+task_telemetry_suffix = '_task_telemetry'
+
+# the bash function wrapping the task commands; the line is appended with one write of less than PIPE_BUF bytes,
+# so the tasks running together never interleave their lines.
+task_telemetry_header_template="""
+dp_run_task() {{
+  # $1: the telemetry record of the job, $2: the task hash, the rest: the task command
+  local record=$1 task_hash=$2 start_time=$(date +%s.%N) exit_status max_rss=- rss_file
+  shift 2
+  if [ -x /usr/bin/time ]; then
+    rss_file=$(mktemp)
+    /usr/bin/time -f %M -o $rss_file "$@"
+    exit_status=$?
+    max_rss=$(tail -n 1 $rss_file)
+    rm -f $rss_file
+  else
+    "$@"
+    exit_status=$?
+  fi
+  echo "$task_hash $start_time $(date +%s.%N) $exit_status $max_rss" >> $record
+  return $exit_status
+}}
+"""
+
+def get_task_telemetry_file(job_hash):
+    return job_hash + task_telemetry_suffix
+
+def parse_task_telemetry(record_str):
+    """parse the telemetry record of a job.
+
+    Returns
+    -------
+    task_telemetry_dict : dict
+        indexed by the task hash, the telemetry of the last run of each task:
+        start_time and end_time (seconds since epoch), wall_time (seconds), exit_status,
+        max_rss (KB, None if unknown) and run_count (how many times the task was run).
+    """
+    task_telemetry_dict = {}
+    for line in record_str.splitlines():
+        words = line.split()
+        if len(words) != 5:
+            continue
+        task_hash, start_time, end_time, exit_status, max_rss = words
+        try:
+            telemetry = {'start_time': float(start_time), 'end_time': float(end_time),
+                'exit_status': int(exit_status), 'max_rss': None if max_rss == '-' else int(max_rss)}
+        except ValueError:
+            dlog.debug('skip the broken task telemetry line: %s' % line)
+            continue
+        telemetry['wall_time'] = telemetry['end_time'] - telemetry['start_time']
+        telemetry['run_count'] = task_telemetry_dict.get(task_hash, {}).get('run_count', 0) + 1
+        task_telemetry_dict[task_hash] = telemetry
+    return task_telemetry_dict
+
+def summarize_job_telemetry(task_telemetry_list):
+    """the telemetry of a job from the telemetry of its tasks (None for the tasks without a record).
+
+    Returns
+    -------
+    job_telemetry : dict or None
+        start_time, end_time and wall_time of the tasks recorded, the largest max_rss (None if unknown),
+        the number of the tasks recorded (task_count) and of those exiting with a non-zero status (failed_task_count).
+        None if no task of the job is recorded.
+    """
+    task_telemetry_list = [telemetry for telemetry in task_telemetry_list if telemetry is not None]
+    if len(task_telemetry_list) == 0:
+        return None
+    max_rss_list = [telemetry['max_rss'] for telemetry in task_telemetry_list if telemetry['max_rss'] is not None]
+    job_telemetry = {'start_time': min([telemetry['start_time'] for telemetry in task_telemetry_list]),
+        'end_time': max([telemetry['end_time'] for telemetry in task_telemetry_list]),
+        'max_rss': max(max_rss_list) if max_rss_list else None,
+        'task_count': len(task_telemetry_list),
+        'failed_task_count': len([telemetry for telemetry in task_telemetry_list if telemetry['exit_status'] != 0])}
+    job_telemetry['wall_time'] = job_telemetry['end_time'] - job_telemetry['start_time']
+    return job_telemetry
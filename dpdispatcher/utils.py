@@ -0,0 +1,55 @@
+import os, hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+def get_sha256(fname, chunk_size=1024*1024):
+    """the sha256 hex digest of the content of the file, read chunk by chunk.
+    """
+    sha256 = hashlib.sha256()
+    with open(fname, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def get_sha256_many(fname_list, max_workers=None):
+    """the sha256 hex digests of many files, hashed in parallel threads
+    (hashlib releases the GIL while hashing large chunks).
+
+    Returns
+    -------
+    sha256_dict : dict
+        the sha256 hex digest of each file, indexed by the file name
+    """
+    if max_workers is None:
+        max_workers = min(8, (os.cpu_count() or 1) + 4)
+    if len(fname_list) <= 1:
+        return {fname: get_sha256(fname) for fname in fname_list}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        sha256_list = list(executor.map(get_sha256, fname_list))
+    return dict(zip(fname_list, sha256_list))
+
+def expand_file_list(root, file_list, followlinks=True):
+    """expand the directories in file_list into the files under them.
+
+    Parameters
+    ----------
+    root : path-like
+        the directory the names in file_list are relative to.
+    file_list : list of str
+        the file or directory names.
+
+    Returns
+    -------
+    expanded_file_list : list of str
+        the file names relative to root
+    """
+    expanded_file_list = []
+    for fname in file_list:
+        path = os.path.join(root, fname)
+        if os.path.isdir(path) and (followlinks or not os.path.islink(path)):
+            for dirpath, dirnames, filenames in os.walk(path, followlinks=followlinks):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    expanded_file_list.append(os.path.relpath(os.path.join(dirpath, filename), root))
+        else:
+            expanded_file_list.append(os.path.normpath(fname))
+    return expanded_file_list
@@ -39,6 +39,7 @@ setuptools.setup(
     install_requires=install_requires,    
     extras_require={
         'docs': ['sphinx', 'recommonmark', 'sphinx_rtd_theme'],
+        'compression': ['zstandard', 'lz4'],
     },
         entry_points={
           'console_scripts': [
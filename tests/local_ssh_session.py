@@ -0,0 +1,96 @@
+"""a stand-in of SSHSession which executes the 'remote' commands and sftp operations on the local machine."""
+import os, shutil
+import subprocess as sp
+from contextlib import contextmanager
+
+class _LocalChannel(object):
+    def __init__(self, proc):
+        self.proc = proc
+    def shutdown_write(self):
+        self.proc.stdin.close()
+    def recv_exit_status(self):
+        return self.proc.wait()
+
+class _LocalChannelFile(object):
+    def __init__(self, fileobj, channel):
+        self.fileobj = fileobj
+        self.channel = channel
+    def write(self, data):
+        return self.fileobj.write(data)
+    def read(self, *args):
+        return self.fileobj.read(*args)
+    def readlines(self):
+        return [line.decode('utf-8') for line in self.fileobj.readlines()]
+
+class _LocalSFTPFile(object):
+    def __init__(self, path, mode):
+        self.fp = open(path, mode.replace('b', '') + 'b')
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return self.fp.write(data)
+    def read(self, *args):
+        return self.fp.read(*args)
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.fp.close()
+
+class _LocalSFTPAttributes(object):
+    def __init__(self, filename, attr):
+        self.filename = filename
+        self.st_mode = attr.st_mode
+        self.st_size = attr.st_size
+        self.st_mtime = attr.st_mtime
+
+class LocalSFTP(object):
+    def __init__(self, session):
+        self.session = session
+    def open(self, path, mode='r'):
+        self.session.sftp_op_count += 1
+        return _LocalSFTPFile(path, mode)
+    def stat(self, path):
+        self.session.sftp_op_count += 1
+        return os.stat(path)
+    def mkdir(self, path):
+        os.mkdir(path)
+    def put(self, from_f, to_f):
+        shutil.copyfile(from_f, to_f)
+    def get(self, from_f, to_f):
+        shutil.copyfile(from_f, to_f)
+    def remove(self, path):
+        os.remove(path)
+    def listdir(self, path):
+        return os.listdir(path)
+    def listdir_attr(self, path):
+        attr_list = []
+        for filename in os.listdir(path):
+            attr = os.lstat(os.path.join(path, filename))
+            attr_list.append(_LocalSFTPAttributes(filename, attr))
+        return attr_list
+    def close(self):
+        pass
+
+class LocalSSHSession(object):
+    def __init__(self, remote_root):
+        self.remote_root = remote_root
+        self.exec_cmd_list = []
+        self.sftp_op_count = 0
+        self.username = 'dp'
+        self.hostname = 'localhost'
+
+    def get_session_root(self):
+        return self.remote_root
+
+    def ensure_alive(self):
+        pass
+
+    @contextmanager
+    def sftp_client(self):
+        yield LocalSFTP(self)
+
+    def exec_command(self, cmd):
+        self.exec_cmd_list.append(cmd)
+        proc = sp.Popen(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+        channel = _LocalChannel(proc)
+        return _LocalChannelFile(proc.stdin, channel), _LocalChannelFile(proc.stdout, channel), _LocalChannelFile(proc.stderr, channel)
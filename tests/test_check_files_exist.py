@@ -0,0 +1,36 @@
+import os,sys,json,glob,shutil,uuid,time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import LocalSession, LocalContext
+from dpdispatcher.lazy_local_context import LazyLocalContext
+from .context import setUpModule
+from .sample_class import SampleClass
+
+class TestCheckFilesExist(unittest.TestCase):
+    def setUp(self):
+        self.submission = SampleClass.get_sample_submission()
+        os.makedirs('tmp_check_files_exist/bct-1', exist_ok=True)
+        for fname in ['aaa_job_tag_finished', 'bct-1/bbb_task_tag_finished']:
+            with open(os.path.join('tmp_check_files_exist', fname), 'w') as fp:
+                fp.write('')
+        self.fname_list = ['aaa_job_tag_finished', 'ccc_job_tag_finished', 'bct-1/bbb_task_tag_finished', 'bct-2/ddd_task_tag_finished']
+        self.expected_dict = {'aaa_job_tag_finished': True, 'ccc_job_tag_finished': False, 
+            'bct-1/bbb_task_tag_finished': True, 'bct-2/ddd_task_tag_finished': False}
+
+    def tearDown(self):
+        shutil.rmtree('tmp_check_files_exist')
+
+    def test_local_context(self):
+        local_session = LocalSession({'work_path': 'test_work_path/'})
+        local_context = LocalContext(local_root='test_pbs_dir/', work_profile=local_session)
+        local_context.bind_submission(self.submission)
+        local_context.remote_root = os.path.abspath('tmp_check_files_exist')
+        self.assertEqual(local_context.check_files_exist(self.fname_list), self.expected_dict)
+        for fname in self.fname_list:
+            self.assertEqual(local_context.check_file_exists(fname), self.expected_dict[fname])
+
+    def test_lazy_local_context(self):
+        lazy_local_context = LazyLocalContext(local_root='tmp_check_files_exist')
+        self.assertEqual(lazy_local_context.check_files_exist(self.fname_list), self.expected_dict)
@@ -0,0 +1,85 @@
+import os,sys,json,glob,shutil,uuid,time
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import SPRetObj
+from dpdispatcher.slurm import Slurm
+from dpdispatcher.pbs import PBS
+from dpdispatcher.lsf import LSF
+from .context import JobStatus
+from .context import setUpModule
+from .sample_class import SampleClass
+
+def _get_mock_context(stdout_str, ret=0, stderr_str='', finished_file_list=[]):
+    context = MagicMock()
+    context.block_call = MagicMock(return_value=(ret, None, SPRetObj(stdout_str.encode('utf-8')), SPRetObj(stderr_str.encode('utf-8'))))
+    context.check_file_exists = MagicMock(side_effect=lambda fname: fname in finished_file_list)
+    context.check_files_exist = MagicMock(side_effect=lambda fname_list: {fname: fname in finished_file_list for fname in fname_list})
+    return context
+
+class TestCheckStatusMany(unittest.TestCase):
+    def setUp(self):
+        self.submission = SampleClass.get_sample_submission()
+        self.job1, self.job2 = self.submission.belonging_jobs
+        self.job1.job_id = '1001'
+        self.job2.job_id = '1002'
+        self.job1_tag_finished = self.job1.job_hash + '_job_tag_finished'
+
+    def test_slurm(self):
+        context = _get_mock_context("      1002  R\n", finished_file_list=[self.job1_tag_finished])
+        slurm = Slurm(context=context)
+        job_state_dict = slurm.check_status_many(self.submission.belonging_jobs)
+        self.assertEqual(context.block_call.call_count, 1)
+        self.assertIn('-j 1001,1002', context.block_call.call_args[0][0])
+        self.assertEqual(job_state_dict[self.job1.job_hash], JobStatus.finished)
+        self.assertEqual(job_state_dict[self.job2.job_hash], JobStatus.running)
+        self.assertEqual(context.check_files_exist.call_count, 1)
+        context.check_file_exists.assert_not_called()
+
+    def test_slurm_chunk(self):
+        context = _get_mock_context("      1001 PD\n      1002 PD\n")
+        slurm = Slurm(context=context)
+        slurm.status_query_chunk_size = 1
+        job_state_dict = slurm.check_status_many(self.submission.belonging_jobs)
+        self.assertEqual(context.block_call.call_count, 2)
+        self.assertEqual(job_state_dict[self.job1.job_hash], JobStatus.waiting)
+
+    def test_slurm_unsubmitted(self):
+        self.job2.job_id = ''
+        context = _get_mock_context("", ret=1, stderr_str="slurm_load_jobs error: Invalid job id specified")
+        slurm = Slurm(context=context)
+        job_state_dict = slurm.check_status_many(self.submission.belonging_jobs)
+        self.assertEqual(job_state_dict[self.job1.job_hash], JobStatus.terminated)
+        self.assertEqual(job_state_dict[self.job2.job_hash], JobStatus.unsubmitted)
+
+    def test_pbs(self):
+        stdout_str = ("Job id            Name             User              Time Use S Queue\n"
+            "----------------  ---------------- ----------------  -------- - -----\n"
+            "1001.server       dpdisp           dp                00:00:00 F workq\n"
+            "1002.server       dpdisp           dp                00:00:00 Q workq\n")
+        context = _get_mock_context(stdout_str)
+        self.job1.job_id = '1001.server'
+        pbs = PBS(context=context)
+        job_state_dict = pbs.check_status_many(self.submission.belonging_jobs)
+        self.assertEqual(context.block_call.call_count, 1)
+        self.assertEqual(job_state_dict[self.job1.job_hash], JobStatus.terminated)
+        self.assertEqual(job_state_dict[self.job2.job_hash], JobStatus.waiting)
+
+    def test_lsf(self):
+        stdout_str = "1002 0 RUN\n"
+        context = _get_mock_context(stdout_str, ret=255, stderr_str="Job <1001> is not found\n", finished_file_list=[self.job1_tag_finished])
+        lsf = LSF(context=context)
+        job_state_dict = lsf.check_status_many(self.submission.belonging_jobs)
+        self.assertEqual(job_state_dict[self.job1.job_hash], JobStatus.finished)
+        self.assertEqual(job_state_dict[self.job2.job_hash], JobStatus.running)
+
+    def test_lsf_job_name(self):
+        # a job which is not an element of a job array has the index 0, whatever its job name is
+        stdout_str = ("1001 0 RUN\n"
+            "1002 0 PEND\n")
+        context = _get_mock_context(stdout_str)
+        job_state_dict = LSF(context=context).check_status_many(self.submission.belonging_jobs)
+        self.assertEqual(job_state_dict[self.job1.job_hash], JobStatus.running)
+        self.assertEqual(job_state_dict[self.job2.job_hash], JobStatus.waiting)
@@ -1,5 +1,7 @@
 import os,sys,json,glob,shutil,uuid,time
 import unittest
+from hashlib import sha1
+from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 __package__ = 'tests'
@@ -27,6 +29,59 @@ class TestJob(unittest.TestCase) :
         self.assertEqual(self.job.get_hash(), self.job2.get_hash())
         # self.assertEqual(self.submission, self.submission2)
 
+    def test_cached_hash(self):
+        with open('jsons/submission.json') as fp:
+            job_dict = json.load(fp)['belonging_jobs'][0]
+        # the hashes recorded in the json of an old submission are the same
+        self.assertEqual(self.job2.job_hash, list(job_dict.keys())[0])
+        job_content_dict = list(self.job.serialize(if_static=True).values())[0]
+        self.assertEqual(self.job.get_hash(), sha1(str(job_content_dict).encode('utf-8')).hexdigest())
+        submission_hash = self.submission2.get_hash()
+        self.assertEqual(submission_hash, sha1(str(self.submission2.serialize(if_static=True)).encode('utf-8')).hexdigest())
+        # the hashes are computed again when a task or the resources are changed
+        job_hash = self.job2.job_hash
+        task = self.job2.job_task_list[0]
+        task_hash = task.task_hash
+        task.command = task.command + ' -v seed 1'
+        self.assertNotEqual(task.task_hash, task_hash)
+        self.assertNotEqual(self.job2.job_hash, job_hash)
+        self.assertNotEqual(self.submission2.get_hash(), submission_hash)
+        self.assertEqual(self.submission2.get_hash(), sha1(str(self.submission2.serialize(if_static=True)).encode('utf-8')).hexdigest())
+        self.job2.resources = self.job2.resources.replace(queue_name='large')
+        self.assertEqual(self.submission2.get_hash(), sha1(str(self.submission2.serialize(if_static=True)).encode('utf-8')).hexdigest())
+
+    def test_cached_hash_read(self):
+        job_hash = self.job2.job_hash
+        # the hash is read again without serializing the tasks
+        with patch.object(Task, 'serialize', side_effect=RuntimeError('serialized')):
+            self.assertEqual(self.job2.job_hash, job_hash)
+        # a change of the resources is seen
+        self.job2.resources = self.job2.resources.replace(queue_name='large')
+        self.assertEqual(self.job2.job_hash, sha1(str(list(self.job2.serialize(if_static=True).values())[0]).encode('utf-8')).hexdigest())
+        self.assertNotEqual(self.job2.job_hash, job_hash)
+
+    def test_cached_hash_changed(self):
+        submission = Submission(work_base='0_md', resources=self.job2.resources)
+        submission.register_task_list([Task(command='lmp -i input.lammps', task_work_path='task.%03d' % ii,
+            forward_files=['conf.lmp', 'input.lammps'], backward_files=['log.lammps']) for ii in range(20)])
+        submission.generate_jobs()
+        submission_hash = submission.get_hash()
+        job_hash_list = [job.job_hash for job in submission.belonging_jobs]
+        # a change of a task serializes the tasks of its job only
+        task = submission.belonging_jobs[3].job_task_list[0]
+        serialize = Task.serialize
+        with patch.object(Task, 'serialize', autospec=True, side_effect=serialize) as mock_serialize:
+            task.command = 'lmp -i input.lammps -v seed 1'
+            self.assertEqual(task.task_hash, sha1(str(task.serialize()).encode('utf-8')).hexdigest())
+            mock_serialize.reset_mock()
+            new_submission_hash = submission.get_hash()
+        self.assertEqual(mock_serialize.call_count, len(submission.belonging_jobs[3].job_task_list))
+        self.assertNotEqual(new_submission_hash, submission_hash)
+        self.assertEqual(new_submission_hash, sha1(str(submission.serialize(if_static=True)).encode('utf-8')).hexdigest())
+        self.assertEqual([job.job_hash for job in submission.belonging_jobs],
+            job_hash_list[:3] + [submission.belonging_jobs[3].job_hash] + job_hash_list[4:])
+        self.assertNotEqual(submission.belonging_jobs[3].job_hash, job_hash_list[3])
+
     def test_serialize_deserialize(self):
         self.assertEqual(self.job, Job.deserialize(job_dict=self.job.serialize()))
 
@@ -1,5 +1,6 @@
 import os,sys,json,glob,shutil,uuid,time
 import unittest
+import copy, pickle
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 __package__ = 'tests'
@@ -31,3 +32,22 @@ class TestResources(unittest.TestCase) :
     def test_eq(self):
         self.assertNotEqual(self.resources, Resources(number_node=4, cpu_per_node=2, gpu_per_node=4, queue_name="V100_12_92", group_size=1))
             
+
+    def test_replace(self):
+        resources = self.resources.replace(queue_name='large')
+        self.assertEqual(resources.queue_name, 'large')
+        self.assertEqual(self.resources.serialize(), self.resources_dict)
+        resources.queue_name = 'small'
+        self.assertEqual(resources.serialize(), dict(self.resources_dict, queue_name='small'))
+        self.assertEqual(copy.deepcopy(self.resources), self.resources)
+        self.assertEqual(pickle.loads(pickle.dumps(self.resources)), self.resources)
+
+    def test_shared(self):
+        job = Job(job_task_list=[], resources=self.resources)
+        with self.assertRaises(RuntimeError):
+            self.resources.queue_name = 'large'
+        self.assertEqual(self.resources.queue_name, self.resources_dict['queue_name'])
+        # the copies are not shared
+        resources = copy.deepcopy(self.resources)
+        resources.queue_name = 'large'
+        self.assertEqual(resources.queue_name, 'large')
@@ -1,5 +1,6 @@
 import os,sys,json,glob,shutil,uuid,time
 import unittest
+from hashlib import sha1
 from unittest.mock import MagicMock, patch, PropertyMock
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -36,6 +37,64 @@ class TestSubmissionInit(unittest.TestCase):
         task_ll = [job.job_task_list for job in self.submission.belonging_jobs]
         self.assertEqual([[task3, task2], [task4, task1]], task_ll)
 
+    def test_share_files(self):
+        task_list = [Task(command='lmp -i in.lmp', task_work_path='task%d/' % ii, forward_files=['in.lmp', 'conf.lmp'])
+            for ii in range(4)]
+        self.submission.register_task_list(task_list=task_list)
+        self.submission.generate_jobs()
+        self.assertTrue(all([task.forward_files is task_list[0].forward_files for task in task_list]))
+        self.assertEqual(task_list[0].serialize()['forward_files'], ['in.lmp', 'conf.lmp'])
+        recovered_submission = Submission.deserialize(submission_dict=json.loads(json.dumps(self.submission.serialize())))
+        self.assertEqual(recovered_submission.submission_hash, self.submission.submission_hash)
+        recovered_task_list = [task for job in recovered_submission.belonging_jobs for task in job.job_task_list]
+        self.assertTrue(all([task.forward_files is recovered_task_list[0].forward_files for task in recovered_task_list]))
+        # the hashes follow a change of the resources of a job
+        job = recovered_submission.belonging_jobs[0]
+        job.resources = job.resources.replace(queue_name='large')
+        self.assertEqual(recovered_submission.get_hash(), sha1(str(recovered_submission.serialize(if_static=True)).encode('utf-8')).hexdigest())
+        self.assertNotEqual(recovered_submission.get_hash(), self.submission.submission_hash)
+        with self.assertRaises(AttributeError):
+            task_list[0].priority = 1
+
+    def test_job_resources(self):
+        self.submission.register_task_list(task_list=SampleClass.get_sample_task_list())
+        self.submission.generate_jobs()
+        job1, job2 = self.submission.belonging_jobs
+        # the jobs share the resources of the submission, which can not be changed in place any more
+        self.assertTrue(job1.resources is self.submission.resources and job2.resources is self.submission.resources)
+        with self.assertRaises(RuntimeError):
+            job1.resources.queue_name = 'large'
+        with self.assertRaises(RuntimeError):
+            self.submission.resources.cpu_per_node = 8
+        self.assertEqual(job2.resources.queue_name, 'V100_8_32')
+        # a changed copy changes one job only
+        job2_hash = job2.job_hash
+        job1.resources = job1.resources.replace(queue_name='large')
+        self.assertEqual((job2.resources.queue_name, self.submission.resources.queue_name), ('V100_8_32', 'V100_8_32'))
+        self.assertEqual(job2.get_hash(), job2_hash)
+        self.assertNotEqual(job1.get_hash(), job2.get_hash())
+        # the recovered jobs share the equal resources
+        recovered_submission = Submission.deserialize(submission_dict=json.loads(json.dumps(self.submission.serialize())))
+        self.assertEqual(recovered_submission.submission_hash, self.submission.get_hash())
+        job1, job2 = recovered_submission.belonging_jobs
+        self.assertIs(job2.resources, recovered_submission.resources)
+        self.assertEqual(job1.resources.queue_name, 'large')
+
+    def test_compact_model(self):
+        task_list = [Task(command='lmp -i in.lmp', task_work_path='task%d/' % ii, forward_files=['in.lmp', 'conf.lmp'],
+            backward_files=['log.lammps']) for ii in range(4)]
+        self.submission.register_task_list(task_list=task_list)
+        self.submission.generate_jobs()
+        # no __dict__ per object
+        for obj in [task_list[0], self.submission.belonging_jobs[0], self.submission.resources]:
+            self.assertTrue(hasattr(type(obj), '__slots__'))
+            self.assertFalse(hasattr(obj, '__dict__'))
+        # the jobs share one Resources, and the tasks share the file name tuples and the command
+        self.assertEqual(len(set([id(job.resources) for job in self.submission.belonging_jobs])), 1)
+        for attr in ['forward_files', 'backward_files', 'command']:
+            self.assertEqual(len(set([id(getattr(task, attr)) for task in task_list])), 1)
+        self.assertIsInstance(task_list[0].forward_files, tuple)
+
 class TestSubmission(unittest.TestCase):
     def setUp(self) :
         pbs = SampleClass.get_sample_pbs_local_context()
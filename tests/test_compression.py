@@ -0,0 +1,48 @@
+import os,sys,json,glob,shutil,uuid,time,io
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.compression import CompressionCodec, sample_entropy
+from .context import setUpModule
+
+class TestCompressionCodec(unittest.TestCase):
+    def setUp(self):
+        os.makedirs('tmp_compression', exist_ok=True)
+        with open('tmp_compression/conf.lmp', 'w') as fp:
+            for ii in range(2000):
+                fp.write("%d 1 %.6f %.6f %.6f\n" % (ii, ii*0.1, ii*0.2, ii*0.3))
+        with open('tmp_compression/graph.pb', 'wb') as fp:
+            fp.write(os.urandom(200000))
+
+    def tearDown(self):
+        shutil.rmtree('tmp_compression')
+
+    def test_round_trip(self):
+        data = b'dpdispatcher ' * 10000
+        for name in ['none', 'gzip', 'bz2', 'xz']:
+            codec = CompressionCodec(name)
+            fileobj = io.BytesIO()
+            with codec.open_writer(fileobj) as writer:
+                writer.write(data[:5000])
+                writer.write(data[5000:])
+            reader = codec.open_reader(io.BytesIO(fileobj.getvalue()))
+            self.assertEqual(reader.read(100) + reader.read(), data)
+
+    def test_level(self):
+        self.assertEqual(CompressionCodec('gzip').level, 6)
+        self.assertEqual(CompressionCodec('gzip', 1).get_remote_compress_cmd(), 'gzip -1')
+        with self.assertRaises(RuntimeError):
+            CompressionCodec('gzip', 10)
+        with self.assertRaises(RuntimeError):
+            CompressionCodec('none', 1)
+        with self.assertRaises(RuntimeError):
+            CompressionCodec('rar')
+
+    def test_auto(self):
+        self.assertLess(sample_entropy(['tmp_compression/conf.lmp']), 7.0)
+        self.assertGreater(sample_entropy(['tmp_compression/graph.pb']), 7.0)
+        codec = CompressionCodec('auto')
+        self.assertEqual(codec.resolve(['tmp_compression/conf.lmp']).name, 'gzip')
+        self.assertEqual(codec.resolve(['tmp_compression/graph.pb']).name, 'none')
+        self.assertEqual(codec.resolve(['tmp_compression/not_exist']).name, 'gzip')
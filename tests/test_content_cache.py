@@ -0,0 +1,134 @@
+import os,sys,json,glob,shutil,uuid,time
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.content_cache import get_evicted_entries, cache_dir_name, LocalContentCache
+from dpdispatcher.local_context import LocalContext, LocalSession
+from dpdispatcher.ssh_context import SSHContext
+from dpdispatcher.utils import get_sha256
+from .context import setUpModule
+from .local_ssh_session import LocalSSHSession
+
+def _get_fake_submission(submission_hash):
+    submission = MagicMock()
+    submission.work_base = ''
+    submission.submission_hash = submission_hash
+    submission.belonging_tasks = []
+    submission.forward_common_files = ['graph.pb', 'model']
+    return submission
+
+class TestEvictedEntries(unittest.TestCase):
+    def test_lru(self):
+        entry_list = [('a', 10, 3.), ('b', 10, 1.), ('c', 10, 2.)]
+        self.assertEqual(get_evicted_entries(entry_list, 30), [])
+        self.assertEqual(get_evicted_entries(entry_list, 15), ['b', 'c'])
+        self.assertEqual(get_evicted_entries(entry_list, 15, keep_entries={'b'}), ['c', 'a'])
+
+
+class TestContentCacheUpload(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_content_cache')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc', 'model'), exist_ok=True)
+        os.makedirs(os.path.join(self.tmp_dir, 'rmt'), exist_ok=True)
+        for fname in ['graph.pb', 'model/frozen.pb']:
+            with open(os.path.join(self.tmp_dir, 'loc', fname), 'w') as fp:
+                fp.write(str(uuid.uuid4()))
+        self.cache_root = os.path.join(self.tmp_dir, 'rmt', cache_dir_name)
+        self.sha256 = get_sha256(os.path.join(self.tmp_dir, 'loc', 'graph.pb'))
+
+    def tearDown(self):
+        for dirpath, dirnames, filenames in os.walk(self.tmp_dir):
+            for fname in filenames:
+                os.chmod(os.path.join(dirpath, fname), 0o644)
+        shutil.rmtree(self.tmp_dir)
+
+    def _check_uploaded(self, submission_hash):
+        for fname in ['graph.pb', 'model/frozen.pb']:
+            rfile = os.path.join(self.tmp_dir, 'rmt', submission_hash, fname)
+            self.assertFalse(os.path.islink(rfile))
+            with open(rfile) as fp, open(os.path.join(self.tmp_dir, 'loc', fname)) as fp1:
+                self.assertEqual(fp.read(), fp1.read())
+        self.assertEqual(os.stat(os.path.join(self.cache_root, self.sha256)).st_nlink, 1 + len(glob.glob(os.path.join(self.tmp_dir, 'rmt', '*', 'graph.pb'))))
+
+    def test_local_context(self):
+        context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}), remote_cache=True)
+        context.bind_submission(_get_fake_submission('hash1'))
+        context.upload(context.submission)
+        self._check_uploaded('hash1')
+        self.assertEqual(len(LocalContentCache(self.cache_root).list_entries()), 2)
+        # the entries checked when they were added are not hashed again
+        context.bind_submission(_get_fake_submission('hash2'))
+        with patch('dpdispatcher.content_cache.get_sha256', side_effect=RuntimeError('hashed')):
+            context.upload(context.submission)
+        self._check_uploaded('hash2')
+
+    def test_ssh_context(self):
+        ssh_session = LocalSSHSession(os.path.join(self.tmp_dir, 'rmt'))
+        context = SSHContext(os.path.join(self.tmp_dir, 'loc'), ssh_session, remote_cache=True)
+        context.bind_submission(_get_fake_submission('hash1'))
+        context.upload(context.submission)
+        self._check_uploaded('hash1')
+        self.assertEqual(len(LocalContentCache(self.cache_root).list_entries()), 2)
+        self.assertEqual(os.stat(os.path.join(self.cache_root, self.sha256)).st_mode & 0o222, 0)
+
+        # the second submission uploads nothing
+        ssh_session.exec_cmd_list = []
+        context._put_files = MagicMock()
+        context.bind_submission(_get_fake_submission('hash2'))
+        context.upload(context.submission)
+        context._put_files.assert_not_called()
+        self._check_uploaded('hash2')
+        # the entries checked when they were added are not hashed again
+        self.assertFalse(any(['sha256sum' in cmd for cmd in ssh_session.exec_cmd_list]))
+        # and an entry changed since is
+        os.chmod(os.path.join(self.cache_root, self.sha256), 0o644)
+        os.utime(os.path.join(self.cache_root, self.sha256), (0, 0))
+        ssh_session.exec_cmd_list = []
+        context.bind_submission(_get_fake_submission('hash3'))
+        context.upload(context.submission)
+        self.assertEqual(len([cmd for cmd in ssh_session.exec_cmd_list if 'sha256sum' in cmd]), 1)
+        self._check_uploaded('hash3')
+
+    def test_ssh_context_evict(self):
+        ssh_session = LocalSSHSession(os.path.join(self.tmp_dir, 'rmt'))
+        context = SSHContext(os.path.join(self.tmp_dir, 'loc'), ssh_session, remote_cache=True, remote_cache_max_bytes=0)
+        context.bind_submission(_get_fake_submission('hash1'))
+        context.upload(context.submission)
+        # the entries in use are kept
+        self.assertEqual(len(LocalContentCache(self.cache_root).list_entries()), 2)
+        with open(os.path.join(self.tmp_dir, 'loc', 'graph.pb'), 'w') as fp:
+            fp.write('new model')
+        context.bind_submission(_get_fake_submission('hash2'))
+        context.upload(context.submission)
+        self.assertEqual(len(LocalContentCache(self.cache_root).list_entries()), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_root, self.sha256)))
+        # the file of the first submission survives the eviction
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, 'rmt', 'hash1', 'graph.pb')))
+
+    def test_changed_entry(self):
+        ssh_session = LocalSSHSession(os.path.join(self.tmp_dir, 'rmt'))
+        context = SSHContext(os.path.join(self.tmp_dir, 'loc'), ssh_session, remote_cache=True)
+        context.bind_submission(_get_fake_submission('hash1'))
+        context.upload(context.submission)
+        # a job ignoring the mode writes through its link, which changes the entry
+        rfile = os.path.join(self.tmp_dir, 'rmt', 'hash1', 'graph.pb')
+        os.chmod(rfile, 0o644)
+        with open(rfile, 'a') as fp:
+            fp.write('appended by a job')
+        # the changed entry is uploaded again, and the next submission gets the right content
+        context.bind_submission(_get_fake_submission('hash2'))
+        context.upload(context.submission)
+        self.assertEqual(get_sha256(os.path.join(self.cache_root, self.sha256)), self.sha256)
+        self.assertTrue(os.path.samefile(os.path.join(self.tmp_dir, 'rmt', 'hash2', 'graph.pb'), os.path.join(self.cache_root, self.sha256)))
+        # the same with the local context
+        with open(rfile, 'a') as fp:
+            fp.write('appended by a job')
+        os.chmod(os.path.join(self.cache_root, self.sha256), 0o644)
+        with open(os.path.join(self.cache_root, self.sha256), 'a') as fp:
+            fp.write('appended by a job')
+        context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}), remote_cache=True)
+        context.bind_submission(_get_fake_submission('hash3'))
+        context.upload(context.submission)
+        self.assertEqual(get_sha256(os.path.join(self.tmp_dir, 'rmt', 'hash3', 'graph.pb')), self.sha256)
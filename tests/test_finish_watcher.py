@@ -0,0 +1,61 @@
+import os,sys,json,glob,shutil,uuid,time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.finish_watcher import FinishTagWatcher, _load_inotify_libc
+from dpdispatcher.lazy_local_context import LazyLocalContext
+from .context import setUpModule
+
+def _touch_later(fname, delay):
+    def touch():
+        time.sleep(delay)
+        with open(fname, 'w') as fp:
+            pass
+    thread = threading.Thread(target=touch)
+    thread.start()
+    return thread
+
+class TestFinishTagWatcher(unittest.TestCase):
+    use_inotify = False
+
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_finish_watcher')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        with open(os.path.join(self.tmp_dir, 'job0_job_tag_finished'), 'w') as fp:
+            pass
+        self.watcher = FinishTagWatcher(self.tmp_dir, poll_interval=0.05, use_inotify=self.use_inotify)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_wake_up(self):
+        thread = _touch_later(os.path.join(self.tmp_dir, 'job1_job_tag_finished'), 0.2)
+        start_time = time.monotonic()
+        self.assertTrue(self.watcher.wait(10))
+        self.assertLess(time.monotonic() - start_time, 5)
+        thread.join()
+
+    def test_timeout(self):
+        # neither the existing tags nor the other files wake the watcher up
+        thread = _touch_later(os.path.join(self.tmp_dir, 'job1.sub'), 0.05)
+        self.assertFalse(self.watcher.wait(0.3))
+        thread.join()
+
+
+@unittest.skipIf(_load_inotify_libc() is None, 'inotify is not available')
+class TestFinishTagWatcherInotify(TestFinishTagWatcher):
+    use_inotify = True
+
+    def test_backend(self):
+        self.assertEqual(self.watcher.backend, 'inotify')
+
+
+class TestContextFinishWatcher(unittest.TestCase):
+    def test_lazy_local_context(self):
+        context = LazyLocalContext('.', None)
+        watcher = context.create_finish_watcher()
+        self.assertEqual(watcher.watch_dir, context.remote_root)
+        watcher.close()
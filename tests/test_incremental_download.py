@@ -0,0 +1,71 @@
+import os,sys,json,glob,shutil,uuid,time
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import LocalContext, LocalSession
+from .context import JobStatus
+from .context import setUpModule
+from .context import Submission, Job, Task, Resources
+from .sample_class import SampleClass
+
+class TestDownloadFinishedJobs(unittest.TestCase):
+    def setUp(self):
+        self.submission = SampleClass.get_sample_submission()
+        self.batch = MagicMock()
+        self.submission.bind_batch(batch=self.batch)
+        self.job1, self.job2 = self.submission.belonging_jobs
+
+    def test_download_once(self):
+        self.job1.job_state = JobStatus.finished
+        self.job2.job_state = JobStatus.running
+        self.submission.download_finished_jobs()
+        self.batch.context.download_job.assert_called_once_with(self.job1)
+        self.assertTrue(self.job1.if_downloaded)
+        self.assertFalse(self.job2.if_downloaded)
+        # the download state is recorded in the submission json
+        write_str = self.batch.context.write_file.call_args[1]['write_str']
+        submission = Submission.deserialize(submission_dict=json.loads(write_str))
+        self.assertEqual([job.if_downloaded for job in submission.belonging_jobs], [True, False])
+
+        self.batch.context.reset_mock()
+        self.submission.download_finished_jobs()
+        self.batch.context.download_job.assert_not_called()
+        self.batch.context.write_file.assert_not_called()
+
+        self.job2.job_state = JobStatus.finished
+        self.submission.download_finished_jobs()
+        self.batch.context.download_job.assert_called_once_with(self.job2)
+
+    def test_deserialize_old_json(self):
+        submission = Submission.submission_from_json('jsons/submission.json')
+        self.assertFalse(any([job.if_downloaded for job in submission.belonging_jobs]))
+
+
+class TestLocalContextDownloadJob(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_incremental_download')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc'), exist_ok=True)
+        os.makedirs(os.path.join(self.tmp_dir, 'rmt'), exist_ok=True)
+        self.submission = SampleClass.get_sample_submission()
+        self.context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}))
+        self.context.bind_submission(self.submission)
+        for task in self.submission.belonging_tasks:
+            os.makedirs(os.path.join(self.context.remote_root, task.task_work_path), exist_ok=True)
+            os.makedirs(os.path.join(self.context.local_root, task.task_work_path), exist_ok=True)
+            with open(os.path.join(self.context.remote_root, task.task_work_path, 'log.lammps'), 'w') as fp:
+                fp.write(task.task_work_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_download_job(self):
+        job1, job2 = self.submission.belonging_jobs
+        self.context.download_job(job1)
+        for task in self.submission.belonging_tasks:
+            self.assertEqual(os.path.isfile(os.path.join(self.context.local_root, task.task_work_path, 'log.lammps')), 
+                task in job1.job_task_list)
+        self.context.download(self.submission, job_list=[job2])
+        for task in self.submission.belonging_tasks:
+            self.assertTrue(os.path.isfile(os.path.join(self.context.local_root, task.task_work_path, 'log.lammps')))
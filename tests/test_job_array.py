@@ -0,0 +1,275 @@
+import os,sys,json,glob,shutil,uuid,time
+import subprocess as sp
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import SPRetObj
+from dpdispatcher.lazy_local_context import LazyLocalContext
+from dpdispatcher.slurm import Slurm
+from dpdispatcher.pbs import PBS
+from dpdispatcher.lsf import LSF
+from dpdispatcher.shell import Shell
+from dpdispatcher.task_telemetry import get_task_telemetry_file, parse_task_telemetry
+from .context import JobStatus
+from .context import setUpModule
+from .context import Submission, Job, Task, Resources
+from .sample_class import SampleClass
+
+def _get_mock_context(submit_stdout_str, status_stdout_str='', finished_file_list=[]):
+    context = MagicMock()
+    context.remote_root = '/rmt'
+    context.block_checkcall = MagicMock(side_effect=lambda cmd: (None, SPRetObj(submit_stdout_str.encode('utf-8')), SPRetObj(b'')))
+    context.block_call = MagicMock(return_value=(0, None, SPRetObj(status_stdout_str.encode('utf-8')), SPRetObj(b'')))
+    context.check_file_exists = MagicMock(side_effect=lambda fname: fname in finished_file_list)
+    context.check_files_exist = MagicMock(side_effect=lambda fname_list: {fname: fname in finished_file_list for fname in fname_list})
+    return context
+
+def _get_submission(task_num=6):
+    resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=2)
+    submission = Submission(work_base='0_md/', resources=resources)
+    submission.register_task_list([Task(command='echo %d' % ii, task_work_path='task%d/' % ii) for ii in range(task_num)])
+    submission.generate_jobs()
+    return submission
+
+class TestSlurmJobArray(unittest.TestCase):
+    def test_do_submit_many(self):
+        submission = _get_submission()
+        context = _get_mock_context("Submitted batch job 777\n")
+        slurm = Slurm(context=context, if_job_array=True, array_throttle=2)
+        job_id_dict = slurm.do_submit_many(submission.belonging_jobs)
+        self.assertEqual(context.block_checkcall.call_count, 1)
+        self.assertIn('sbatch --array=0-2%2 ', context.block_checkcall.call_args[0][0])
+        self.assertEqual([job_id_dict[job.job_hash] for job in submission.belonging_jobs], ['777_0', '777_1', '777_2'])
+        script_str = context.write_file.call_args_list[0][1]['write_str']
+        self.assertEqual(script_str.count('_job_tag_finished\n'), 3)
+        self.assertIn('case $SLURM_ARRAY_TASK_ID in', script_str)
+
+    def test_group_by_resources(self):
+        submission = _get_submission()
+        job1, job2, job3 = submission.belonging_jobs
+        job3.resources = Resources(number_node=1, cpu_per_node=8, gpu_per_node=0, queue_name='normal', group_size=2)
+        context = _get_mock_context("Submitted batch job 778\n")
+        job_id_dict = Slurm(context=context, if_job_array=True).do_submit_many(submission.belonging_jobs)
+        self.assertEqual(context.block_checkcall.call_count, 2)
+        self.assertIn('sbatch --array=0-1 ', context.block_checkcall.call_args_list[0][0][0])
+        self.assertEqual(job_id_dict[job3.job_hash], '778')
+
+    def test_no_array(self):
+        submission = _get_submission()
+        context = _get_mock_context("Submitted batch job 779\n")
+        Slurm(context=context).do_submit_many(submission.belonging_jobs)
+        self.assertEqual(context.block_checkcall.call_count, 3)
+        self.assertNotIn('--array', context.block_checkcall.call_args[0][0])
+
+    def test_max_array_size(self):
+        submission = _get_submission(task_num=10)
+        context = _get_mock_context("Submitted batch job 782\n")
+        job_id_dict = Slurm(context=context, if_job_array=True, max_array_size=2).do_submit_many(submission.belonging_jobs)
+        # the 5 jobs are submitted as arrays of 2, 2 and 1 jobs
+        self.assertEqual(context.block_checkcall.call_count, 3)
+        self.assertIn('sbatch --array=0-1 ', context.block_checkcall.call_args_list[0][0][0])
+        self.assertIn('sbatch --array=0-1 ', context.block_checkcall.call_args_list[1][0][0])
+        self.assertNotIn('--array', context.block_checkcall.call_args_list[2][0][0])
+        self.assertEqual([job_id_dict[job.job_hash] for job in submission.belonging_jobs], ['782_0', '782_1', '782_0', '782_1', '782'])
+
+    def test_array_rejected(self):
+        submission = _get_submission()
+        context = _get_mock_context("Submitted batch job 783\n")
+        def block_checkcall(cmd):
+            if '--array' in cmd:
+                raise RuntimeError("sbatch: error: Batch job submission failed: Invalid job array specification")
+            return (None, SPRetObj(b"Submitted batch job 783\n"), SPRetObj(b''))
+        context.block_checkcall = MagicMock(side_effect=block_checkcall)
+        job_id_dict = Slurm(context=context, if_job_array=True).do_submit_many(submission.belonging_jobs)
+        # the jobs of the array rejected are submitted one by one
+        self.assertEqual(context.block_checkcall.call_count, 4)
+        self.assertEqual([job_id_dict[job.job_hash] for job in submission.belonging_jobs], ['783', '783', '783'])
+
+    def test_check_status_many(self):
+        submission = _get_submission()
+        job1, job2, job3 = submission.belonging_jobs
+        job1.job_id, job2.job_id, job3.job_id = '777_0', '777_1', '777_2'
+        context = _get_mock_context("", status_stdout_str="   777_1  R\n   777_2 PD\n", finished_file_list=[job1.job_hash + '_job_tag_finished'])
+        job_state_dict = Slurm(context=context).check_status_many(submission.belonging_jobs)
+        self.assertEqual(context.block_call.call_count, 1)
+        self.assertIn('-r -j 777', context.block_call.call_args[0][0])
+        self.assertNotIn('777_', context.block_call.call_args[0][0])
+        self.assertEqual([job_state_dict[job.job_hash] for job in submission.belonging_jobs],
+            [JobStatus.finished, JobStatus.running, JobStatus.waiting])
+
+    def test_submission(self):
+        submission = _get_submission()
+        context = _get_mock_context("Submitted batch job 780\n", status_stdout_str="   780_0 PD\n   780_1 PD\n   780_2 PD\n")
+        submission.bind_batch(batch=Slurm(context=context, if_job_array=True))
+        for job in submission.belonging_jobs:
+            job.job_state = JobStatus.unsubmitted
+        submission.handle_unexpected_submission_state()
+        self.assertEqual(context.block_checkcall.call_count, 1)
+        self.assertEqual([job.job_id for job in submission.belonging_jobs], ['780_0', '780_1', '780_2'])
+        self.assertEqual([job.job_state for job in submission.belonging_jobs], [JobStatus.waiting] * 3)
+        self.assertEqual([job.fail_count for job in submission.belonging_jobs], [1] * 3)
+
+        # the array element ids are kept when the submission is recovered from its json
+        recovered_submission = Submission.deserialize(submission_dict=json.loads(json.dumps(submission.serialize())))
+        recovered_submission.bind_batch(batch=Slurm(context=context, if_job_array=True))
+        self.assertEqual([job.job_id for job in recovered_submission.belonging_jobs], ['780_0', '780_1', '780_2'])
+        recovered_submission.get_submission_state()
+        self.assertEqual([job.job_state for job in recovered_submission.belonging_jobs], [JobStatus.waiting] * 3)
+
+        # only the terminated element is resubmitted
+        context = _get_mock_context("Submitted batch job 781\n", status_stdout_str="   781 PD\n")
+        recovered_submission.bind_batch(batch=Slurm(context=context, if_job_array=True))
+        recovered_submission.belonging_jobs[1].job_state = JobStatus.terminated
+        recovered_submission.handle_unexpected_submission_state()
+        self.assertEqual([job.job_id for job in recovered_submission.belonging_jobs], ['780_0', '781', '780_2'])
+
+
+class TestPBSJobArray(unittest.TestCase):
+    def test_do_submit_many(self):
+        submission = _get_submission()
+        context = _get_mock_context("1234[].pbs01\n")
+        job_id_dict = PBS(context=context, if_job_array=True, array_throttle=2).do_submit_many(submission.belonging_jobs)
+        self.assertEqual(context.block_checkcall.call_count, 1)
+        self.assertIn('qsub -J 0-2%2 ', context.block_checkcall.call_args[0][0])
+        self.assertEqual([job_id_dict[job.job_hash] for job in submission.belonging_jobs],
+            ['1234[0].pbs01', '1234[1].pbs01', '1234[2].pbs01'])
+        script_str = context.write_file.call_args_list[0][1]['write_str']
+        self.assertEqual(script_str.count('_job_tag_finished\n'), 3)
+        self.assertIn('case $PBS_ARRAY_INDEX in', script_str)
+
+    def test_max_array_size(self):
+        submission = _get_submission(task_num=10)
+        context = _get_mock_context("1235[].pbs01\n")
+        job_id_dict = PBS(context=context, if_job_array=True, max_array_size=3).do_submit_many(submission.belonging_jobs)
+        # the 5 jobs are submitted as arrays of 3 and 2 jobs
+        self.assertEqual(context.block_checkcall.call_count, 2)
+        self.assertIn('qsub -J 0-2 ', context.block_checkcall.call_args_list[0][0][0])
+        self.assertIn('qsub -J 0-1 ', context.block_checkcall.call_args_list[1][0][0])
+        self.assertEqual([job_id_dict[job.job_hash] for job in submission.belonging_jobs],
+            ['1235[0].pbs01', '1235[1].pbs01', '1235[2].pbs01', '1235[0].pbs01', '1235[1].pbs01'])
+
+    def test_check_status_many(self):
+        submission = _get_submission()
+        job1, job2, job3 = submission.belonging_jobs
+        job1.job_id, job2.job_id, job3.job_id = '1234[0].pbs01', '1234[1].pbs01', '1234[2].pbs01'
+        status_stdout_str = ("Job id            Name             User              Time Use S Queue\n"
+            "----------------  ---------------- ----------------  -------- - -----\n"
+            "1234[].pbs01      dpdisp           dp                       0 B normal\n"
+            "1234[0].pbs01     dpdisp           dp                00:00:01 X normal\n"
+            "1234[1].pbs01     dpdisp           dp                00:00:01 X normal\n"
+            "1234[2].pbs01     dpdisp           dp                       0 Q normal\n")
+        context = _get_mock_context("", status_stdout_str=status_stdout_str, finished_file_list=[job1.job_hash + '_job_tag_finished'])
+        job_state_dict = PBS(context=context).check_status_many(submission.belonging_jobs)
+        self.assertEqual(context.block_call.call_count, 1)
+        self.assertIn("qstat -x -t '1234[].pbs01'", context.block_call.call_args[0][0])
+        # the element without its job_tag_finished has failed, and is resubmitted alone
+        self.assertEqual([job_state_dict[job.job_hash] for job in submission.belonging_jobs],
+            [JobStatus.finished, JobStatus.terminated, JobStatus.waiting])
+
+
+class TestLSFJobArray(unittest.TestCase):
+    def test_do_submit_many(self):
+        submission = _get_submission()
+        context = _get_mock_context("Job <5678> is submitted to queue <normal>.\n")
+        lsf = LSF(context=context, if_job_array=True, array_throttle=2)
+        job_id_dict = lsf.do_submit_many(submission.belonging_jobs)
+        self.assertEqual(context.block_checkcall.call_count, 1)
+        array_hash = lsf.get_array_hash(submission.belonging_jobs)
+        self.assertIn("bsub -J 'dpdisp_%s[1-3]%%2' < " % array_hash[:8], context.block_checkcall.call_args[0][0])
+        self.assertEqual([job_id_dict[job.job_hash] for job in submission.belonging_jobs], ['5678[1]', '5678[2]', '5678[3]'])
+        script_str = context.write_file.call_args_list[0][1]['write_str']
+        self.assertIn('case $LSB_JOBINDEX in', script_str)
+        # each element writes its own logs
+        self.assertIn('#BSUB -o %J_%I.out\n', script_str)
+        self.assertIn('#BSUB -e %J_%I.err\n', script_str)
+        self.assertIn('#BSUB -o %J.out\n', lsf.gen_script(submission.belonging_jobs[0]))
+        self.assertIn('\n1)\n', script_str)
+        self.assertNotIn('\n0)\n', script_str)
+
+    def test_check_status_many(self):
+        submission = _get_submission()
+        job1, job2, job3 = submission.belonging_jobs
+        job1.job_id, job2.job_id, job3.job_id = '5678[1]', '5678[2]', '5678[3]'
+        job3.job_id = '5679'
+        status_stdout_str = ("5678 1 DONE\n"
+            "5678 2 RUN\n"
+            "5679 0 PEND\n")
+        context = _get_mock_context("", status_stdout_str=status_stdout_str, finished_file_list=[job1.job_hash + '_job_tag_finished'])
+        job_state_dict = LSF(context=context).check_status_many(submission.belonging_jobs)
+        self.assertEqual(context.block_call.call_count, 1)
+        self.assertIn('bjobs -o "jobid jobindex stat" -noheader 5678 5679', context.block_call.call_args[0][0])
+        self.assertNotIn('5678[', context.block_call.call_args[0][0])
+        self.assertEqual([job_state_dict[job.job_hash] for job in submission.belonging_jobs],
+            [JobStatus.finished, JobStatus.running, JobStatus.waiting])
+
+    def test_max_array_size(self):
+        submission = _get_submission(task_num=10)
+        context = _get_mock_context("Job <5680> is submitted to queue <normal>.\n")
+        lsf = LSF(context=context, if_job_array=True, max_array_size=3)
+        job_id_dict = lsf.do_submit_many(submission.belonging_jobs)
+        # the 5 jobs are submitted as arrays of 3 and 2 jobs
+        self.assertEqual(context.block_checkcall.call_count, 2)
+        self.assertIn("bsub -J 'dpdisp_%s[1-3]' < " % lsf.get_array_hash(submission.belonging_jobs[:3])[:8],
+            context.block_checkcall.call_args_list[0][0][0])
+        self.assertIn("bsub -J 'dpdisp_%s[1-2]' < " % lsf.get_array_hash(submission.belonging_jobs[3:])[:8],
+            context.block_checkcall.call_args_list[1][0][0])
+        self.assertEqual([job_id_dict[job.job_hash] for job in submission.belonging_jobs],
+            ['5680[1]', '5680[2]', '5680[3]', '5680[1]', '5680[2]'])
+
+
+@unittest.skipIf(not shutil.which('bash'), 'requires bash')
+class TestRunArrayScript(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_job_array')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_run_element(self):
+        submission = _get_submission()
+        for task in submission.belonging_tasks:
+            os.makedirs(os.path.join(self.tmp_dir, task.task_work_path))
+        slurm = Slurm(context=LazyLocalContext(self.tmp_dir, None), if_job_array=True)
+        with open(os.path.join(self.tmp_dir, 'array.sub'), 'w') as fp:
+            fp.write(slurm.gen_array_script(submission.belonging_jobs, 'SLURM_ARRAY_TASK_ID'))
+        sp.check_call(['bash', 'array.sub'], cwd=self.tmp_dir, env=dict(os.environ, SLURM_ARRAY_TASK_ID='1'))
+        job1, job2, job3 = submission.belonging_jobs
+        self.assertEqual([os.path.isfile(os.path.join(self.tmp_dir, job.job_hash + '_job_tag_finished')) for job in submission.belonging_jobs],
+            [False, True, False])
+        for task in job2.job_task_list:
+            self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, task.task_work_path, task.task_hash + '_task_tag_finished')))
+        self.assertNotEqual(sp.call(['bash', 'array.sub'], cwd=self.tmp_dir, env=dict(os.environ, SLURM_ARRAY_TASK_ID='3'), stderr=sp.DEVNULL), 0)
+
+    def test_run_pbs_element(self):
+        # the PBS array element runs the dynamic runner and records the telemetry in the remote root,
+        # though it is not run from it
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=2,
+            task_runner='dynamic', if_telemetry=True)
+        submission = Submission(work_base='0_md/', resources=resources)
+        submission.register_task_list([Task(command='echo %d > out' % ii, task_work_path='task%d/' % ii) for ii in range(4)])
+        submission.generate_jobs()
+        for task in submission.belonging_tasks:
+            os.makedirs(os.path.join(self.tmp_dir, task.task_work_path))
+        os.makedirs(os.path.join(self.tmp_dir, 'home'))
+        pbs = PBS(context=LazyLocalContext(self.tmp_dir, None), if_job_array=True)
+        with open(os.path.join(self.tmp_dir, 'array.sub'), 'w') as fp:
+            fp.write(pbs.gen_array_script(submission.belonging_jobs, 'PBS_ARRAY_INDEX'))
+        sp.check_call(['bash', os.path.join(self.tmp_dir, 'array.sub')], cwd=os.path.join(self.tmp_dir, 'home'),
+            env=dict(os.environ, PBS_ARRAY_INDEX='1', PBS_O_WORKDIR=self.tmp_dir, HOME=os.path.join(self.tmp_dir, 'home')))
+        job1, job2 = submission.belonging_jobs
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, job2.job_hash + '_job_tag_finished')))
+        for task in job2.job_task_list:
+            self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, task.task_work_path, 'out')))
+        with open(os.path.join(self.tmp_dir, get_task_telemetry_file(job2.job_hash))) as fp:
+            self.assertEqual(sorted(parse_task_telemetry(fp.read())), sorted([task.task_hash for task in job2.job_task_list]))
+        self.assertFalse(os.path.isfile(os.path.join(self.tmp_dir, job1.job_hash + '_job_tag_finished')))
+
+
+class TestBatchJobArray(unittest.TestCase):
+    def test_unsupported(self):
+        with self.assertRaises(RuntimeError):
+            Shell(context=_get_mock_context(""), if_job_array=True)
+        self.assertFalse(Shell(context=_get_mock_context("")).if_job_array)
@@ -0,0 +1,81 @@
+import os,sys,json,glob,shutil,uuid,time
+import random
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.job_packing import pack_lpt, pack_ffd
+from .context import setUpModule
+from .context import Submission, Job, Task, Resources
+from .sample_class import SampleClass
+
+def _get_heavy_tailed_costs(task_num, seed=1):
+    rng = random.Random(seed)
+    return [rng.paretovariate(1.5) for ii in range(task_num)]
+
+class TestPacking(unittest.TestCase):
+    def _check_packing(self, index_ll, task_num, group_size):
+        self.assertEqual(sorted([index for index_list in index_ll for index in index_list]), list(range(task_num)))
+        self.assertTrue(all([0 < len(index_list) <= group_size for index_list in index_ll]))
+
+    def test_lpt(self):
+        self.assertEqual(pack_lpt([1, 5, 2, 4, 3, 3], 3), [[1, 5, 0], [3, 4, 2]])
+        cost_list = _get_heavy_tailed_costs(200)
+        index_ll = pack_lpt(cost_list, 10)
+        self._check_packing(index_ll, 200, 10)
+        self.assertEqual(len(index_ll), 20)
+        self.assertEqual(index_ll, pack_lpt(cost_list, 10))
+
+    def test_ffd(self):
+        cost_list = _get_heavy_tailed_costs(200)
+        index_ll = pack_ffd(cost_list, 10)
+        self._check_packing(index_ll, 200, 10)
+        capacity = max(max(cost_list), sum(cost_list) / 20)
+        self.assertTrue(all([sum([cost_list[ii] for ii in index_list]) <= capacity * (1 + 1e-6) for index_list in index_ll]))
+        self.assertEqual(index_ll, pack_ffd(cost_list, 10))
+
+    def test_balance(self):
+        cost_list = _get_heavy_tailed_costs(400)
+        def get_spread(index_ll):
+            job_cost_list = [sum([cost_list[ii] for ii in index_list]) for index_list in index_ll]
+            return max(job_cost_list) - min(job_cost_list)
+        sliced_index_ll = [list(range(ii, ii + 8)) for ii in range(0, 400, 8)]
+        self.assertLess(get_spread(pack_lpt(cost_list, 8)), get_spread(sliced_index_ll))
+
+
+class TestGenerateJobsPacking(unittest.TestCase):
+    def _get_submission(self):
+        submission = SampleClass.get_sample_empty_submission()
+        task_list = [Task(command='lmp -i in.lmp -v steps %d' % steps, task_work_path='task%d/' % ii)
+            for ii, steps in enumerate([100, 800, 200, 700, 300, 600, 400, 500])]
+        submission.register_task_list(task_list)
+        return submission
+
+    def test_lpt(self):
+        submission = self._get_submission()
+        steps_dict = {task.task_hash: int(task.command.split()[-1]) for task in submission.belonging_tasks}
+        submission.generate_jobs(packing='lpt', task_cost=lambda task: steps_dict[task.task_hash])
+        self.assertEqual(len(submission.belonging_jobs), 4)
+        self.assertEqual([sum([steps_dict[task.task_hash] for task in job.job_task_list]) for job in submission.belonging_jobs],
+            [900] * 4)
+        # the packing is deterministic, so is the submission hash
+        submission_again = self._get_submission()
+        submission_again.generate_jobs(packing='lpt', task_cost=lambda task: steps_dict[task.task_hash])
+        self.assertEqual(submission.submission_hash, submission_again.submission_hash)
+
+    def test_default_random(self):
+        submission = self._get_submission()
+        submission.generate_jobs()
+        submission_again = self._get_submission()
+        submission_again.generate_jobs(packing='random')
+        self.assertEqual(submission.submission_hash, submission_again.submission_hash)
+        with self.assertRaises(RuntimeError):
+            self._get_submission().generate_jobs(packing='round_robin')
+
+    def test_unknown_cost(self):
+        submission = self._get_submission()
+        cost_list = submission.get_task_costs(lambda task: None if task.task_work_path == 'task0/' else 2.)
+        self.assertEqual(cost_list, [2.] * 8)
+        self.assertEqual(submission.get_task_costs(), [1.] * 8)
+        with self.assertRaises(RuntimeError):
+            submission.get_task_costs('file_count')
@@ -0,0 +1,108 @@
+import os,sys,json,glob,shutil,uuid,time
+import subprocess as sp
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import LocalContext, LocalSession
+from dpdispatcher.lazy_local_context import LazyLocalContext
+from dpdispatcher.shell import Shell
+from dpdispatcher.slurm import Slurm
+from dpdispatcher.poll_policy import FixedPollPolicy
+from .context import setUpModule
+from .context import Submission, Job, Task, Resources
+
+def _get_pilot_submission(task_num, pilot_num):
+    resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', task_runner='pilot')
+    submission = Submission(work_base='.', resources=resources, poll_policy=FixedPollPolicy(interval=0.2))
+    submission.register_task_list([Task(command="bash -c 'echo ran >> count'", task_work_path='task%d/' % ii,
+        backward_files=['count'], task_need_resources=0.5) for ii in range(task_num)])
+    submission.generate_jobs(pilot_num=pilot_num)
+    return submission
+
+class TestPilotJobs(unittest.TestCase):
+    def test_generate_jobs(self):
+        submission = _get_pilot_submission(10, 3)
+        self.assertEqual([len(job.job_task_list) for job in submission.belonging_jobs], [4, 3, 3])
+        self.assertEqual(sorted([task.task_hash for job in submission.belonging_jobs for task in job.job_task_list]),
+            sorted([task.task_hash for task in submission.belonging_tasks]))
+        self.assertEqual(submission.submission_hash, _get_pilot_submission(10, 3).submission_hash)
+        self.assertEqual(len(_get_pilot_submission(2, 3).belonging_jobs), 2)
+        with self.assertRaises(RuntimeError):
+            _get_pilot_submission(10, 0)
+        with self.assertRaises(RuntimeError):
+            _get_pilot_submission(10, 3).generate_jobs(pilot_num=3, packing='lpt')
+        submission = Submission(work_base='.', resources=Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal'))
+        submission.register_task(Task(command='echo', task_work_path='task0/'))
+        with self.assertRaises(RuntimeError):
+            submission.generate_jobs(pilot_num=2)
+
+    def test_gen_script(self):
+        submission = _get_pilot_submission(4, 2)
+        job = submission.belonging_jobs[0]
+        slurm = Slurm(context=LazyLocalContext('.', None))
+        with self.assertRaises(RuntimeError):
+            slurm.gen_script(job)
+        job.pilot_queue_name = 'sub_pilot_queue'
+        script = slurm.gen_script(job)
+        self.assertIn('dp_pilot_root=$REMOTE_ROOT/sub_pilot_queue\n', script)
+        self.assertIn('dp_pilot_id=%s\n' % job.job_hash, script)
+        self.assertNotIn('echo ran', script)
+        queue_script = slurm.gen_pilot_queue_script(submission.belonging_jobs)
+        self.assertEqual(queue_script.count("<<'DP_PILOT_TASK_EOF'"), 4)
+        self.assertIn('#dp_slot 500\n', queue_script)
+
+
+@unittest.skipIf(not shutil.which('bash'), 'requires bash')
+class TestRunPilotJobs(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_pilot')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc'), exist_ok=True)
+        os.makedirs(os.path.join(self.tmp_dir, 'rmt'), exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_run_submission(self):
+        context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}))
+        submission = _get_pilot_submission(12, 3)
+        submission.bind_batch(batch=Shell(context=context))
+        for task in submission.belonging_tasks:
+            os.makedirs(os.path.join(context.local_root, task.task_work_path))
+        submission.run_submission()
+        # each task is run by one pilot only
+        for task in submission.belonging_tasks:
+            with open(os.path.join(context.local_root, task.task_work_path, 'count')) as fp:
+                self.assertEqual(fp.read(), 'ran\n')
+        pilot_root = os.path.join(context.remote_root, submission.submission_hash + '_pilot_queue')
+        self.assertEqual(os.listdir(os.path.join(pilot_root, 'queue')), ['.seeded'])
+        self.assertEqual(os.listdir(os.path.join(pilot_root, 'claimed')), [])
+
+    def test_requeue_killed_pilot(self):
+        context = LazyLocalContext(self.tmp_dir, None)
+        submission = _get_pilot_submission(6, 2)
+        submission.bind_batch(batch=Shell(context=context))
+        submission.write_pilot_queue()
+        job1, job2 = submission.belonging_jobs
+        for task in submission.belonging_tasks:
+            os.makedirs(os.path.join(self.tmp_dir, task.task_work_path))
+        # the second pilot was killed while it ran a task of its own
+        pilot_root = os.path.join(self.tmp_dir, job1.pilot_queue_name)
+        os.makedirs(os.path.join(pilot_root, 'queue'))
+        os.makedirs(os.path.join(pilot_root, 'claimed'))
+        sp.check_call(['bash', os.path.join(self.tmp_dir, job1.pilot_queue_name + '.sh')], cwd=os.path.join(pilot_root, 'queue'))
+        open(os.path.join(pilot_root, 'queue', '.seeded'), 'w').close()
+        killed_task = job2.job_task_list[0]
+        os.rename(os.path.join(pilot_root, 'queue', killed_task.task_hash),
+            os.path.join(pilot_root, 'claimed', killed_task.task_hash + '.' + job2.job_hash))
+
+        for job in [job1, job2]:
+            with open(os.path.join(self.tmp_dir, job.script_file_name), 'w') as fp:
+                fp.write(submission.batch.gen_script(job))
+            sp.check_call(['bash', job.script_file_name], cwd=self.tmp_dir, timeout=60)
+            self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, job.job_hash + '_job_tag_finished')))
+        for task in submission.belonging_tasks:
+            self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, task.task_work_path, task.task_hash + '_task_tag_finished')))
+            with open(os.path.join(self.tmp_dir, task.task_work_path, 'count')) as fp:
+                self.assertEqual(fp.read(), 'ran\n')
+        self.assertEqual(os.listdir(os.path.join(pilot_root, 'claimed')), [])
@@ -0,0 +1,94 @@
+import os,sys,json,glob,shutil,uuid,time
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import LocalContext, LocalSession
+from .context import JobStatus
+from .context import setUpModule
+from .sample_class import SampleClass
+
+class TestUploadAndSubmitJobs(unittest.TestCase):
+    def setUp(self):
+        self.submission = SampleClass.get_sample_submission()
+        self.batch = MagicMock()
+        self.batch.check_status = MagicMock(return_value=JobStatus.waiting)
+        self.submission.bind_batch(batch=self.batch)
+        self.job1, self.job2 = self.submission.belonging_jobs
+        for job in self.submission.belonging_jobs:
+            job.job_state = JobStatus.unsubmitted
+
+    def test_pipeline(self):
+        job1_submitted = threading.Event()
+        def upload_job(job):
+            # the upload of job2 only ends after job1 is submitted
+            if job is self.job2:
+                self.assertTrue(job1_submitted.wait(timeout=10))
+        def do_submit(job):
+            if job is self.job1:
+                job1_submitted.set()
+            return job.job_hash[:6]
+        self.batch.context.upload_job = MagicMock(side_effect=upload_job)
+        self.batch.do_submit = MagicMock(side_effect=do_submit)
+        self.submission.upload_and_submit_jobs(max_workers=2)
+        self.batch.context.upload.assert_called_once_with(self.submission, job_list=[])
+        self.assertEqual(self.batch.context.upload_job.call_count, 2)
+        self.assertEqual([call[0][0] for call in self.batch.do_submit.call_args_list], [self.job1, self.job2])
+        for job in self.submission.belonging_jobs:
+            self.assertEqual(job.job_id, job.job_hash[:6])
+            self.assertEqual(job.job_state, JobStatus.waiting)
+
+    def test_skip_submitted(self):
+        self.job1.job_state = JobStatus.running
+        self.batch.do_submit = MagicMock(return_value='1002')
+        self.submission.upload_and_submit_jobs()
+        self.batch.context.upload_job.assert_called_once_with(self.job2)
+        self.batch.do_submit.assert_called_once_with(self.job2)
+
+    def test_write_json_on_error(self):
+        job1_submitted = threading.Event()
+        def upload_job(job):
+            # the upload of job2 fails after job1 is submitted
+            if job is self.job2:
+                self.assertTrue(job1_submitted.wait(timeout=10))
+                raise RuntimeError('upload failed')
+        def do_submit(job):
+            job1_submitted.set()
+            return '1001'
+        self.batch.context.upload_job = MagicMock(side_effect=upload_job)
+        self.batch.do_submit = MagicMock(side_effect=do_submit)
+        with self.assertRaises(RuntimeError):
+            self.submission.upload_and_submit_jobs(max_workers=2)
+        # the job submitted before the error is recorded in the submission json
+        self.batch.do_submit.assert_called_once_with(self.job1)
+        submission_dict = json.loads(self.batch.context.write_file.call_args[1]['write_str'])
+        job_dict = [job_dict[self.job1.job_hash] for job_dict in submission_dict['belonging_jobs'] if self.job1.job_hash in job_dict][0]
+        self.assertEqual(job_dict['job_id'], '1001')
+
+
+class TestLocalContextUploadJob(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_pipeline_upload')
+        os.makedirs(os.path.join(self.tmp_dir, 'rmt'), exist_ok=True)
+        self.submission = SampleClass.get_sample_submission()
+        self.context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}))
+        self.context.bind_submission(self.submission)
+        for task in self.submission.belonging_tasks:
+            os.makedirs(os.path.join(self.context.local_root, task.task_work_path), exist_ok=True)
+            for fname in task.forward_files:
+                with open(os.path.join(self.context.local_root, task.task_work_path, fname), 'w') as fp:
+                    fp.write(task.task_work_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_upload_job(self):
+        job1, job2 = self.submission.belonging_jobs
+        cwd = os.getcwd()
+        self.context.upload_job(job1)
+        self.assertEqual(os.getcwd(), cwd)
+        for task in self.submission.belonging_tasks:
+            self.assertEqual(os.path.isfile(os.path.join(self.context.remote_root, task.task_work_path, 'conf.lmp')),
+                task in job1.job_task_list)
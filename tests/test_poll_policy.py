@@ -0,0 +1,55 @@
+import os,sys,json,glob,shutil,uuid,time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.poll_policy import FixedPollPolicy, AdaptivePollPolicy
+from .context import JobStatus
+from .context import setUpModule
+from .sample_class import SampleClass
+
+class TestFixedPollPolicy(unittest.TestCase):
+    def test_fixed(self):
+        policy = FixedPollPolicy(interval=60)
+        self.assertEqual(policy.next_interval({'job1': JobStatus.running}, 0.5), 60)
+        metrics = policy.get_metrics()
+        self.assertEqual(metrics['poll_count'], 1)
+        self.assertEqual(metrics['records'][0]['query_duration'], 0.5)
+
+    def test_submission_default(self):
+        submission = SampleClass.get_sample_submission()
+        self.assertIsInstance(submission.poll_policy, FixedPollPolicy)
+        self.assertEqual(submission.poll_policy.interval, 10)
+
+
+class TestAdaptivePollPolicy(unittest.TestCase):
+    def test_backoff(self):
+        policy = AdaptivePollPolicy(min_interval=2, max_interval=20, backoff_factor=2)
+        job_state_dict = {'job1': JobStatus.waiting, 'job2': JobStatus.waiting}
+        interval_list = [policy.next_interval(job_state_dict) for ii in range(5)]
+        self.assertEqual(interval_list, [4, 8, 16, 20, 20])
+        job_state_dict['job1'] = JobStatus.running
+        self.assertEqual(policy.next_interval(job_state_dict), 2)
+        self.assertEqual(policy.get_metrics()['records'][-1]['reason'], 'changed')
+        self.assertEqual(policy.get_metrics()['records'][-1]['changed_count'], 1)
+
+    def test_expected_end(self):
+        policy = AdaptivePollPolicy(min_interval=2, max_interval=600, expected_runtime=lambda job_hash: {'job1': 30}.get(job_hash))
+        with patch('dpdispatcher.poll_policy.time.time', return_value=1000.):
+            policy.next_interval({'job1': JobStatus.running, 'job2': JobStatus.running})
+        for ii in range(5):
+            with patch('dpdispatcher.poll_policy.time.time', return_value=1020.):
+                interval = policy.next_interval({'job1': JobStatus.running, 'job2': JobStatus.running})
+        # job1 is expected to end 10 seconds later
+        self.assertEqual(interval, 10)
+        self.assertEqual(policy.get_metrics()['records'][-1]['reason'], 'expected_end')
+
+    def test_slow_scheduler(self):
+        policy = AdaptivePollPolicy(min_interval=2, max_interval=600, max_query_load=0.05)
+        self.assertEqual(policy.next_interval({'job1': JobStatus.running}, query_duration=3.), 60)
+        self.assertEqual(policy.get_metrics()['records'][-1]['reason'], 'slow_scheduler')
+
+    def test_invalid(self):
+        with self.assertRaises(RuntimeError):
+            AdaptivePollPolicy(min_interval=10, max_interval=5)
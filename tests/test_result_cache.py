@@ -0,0 +1,159 @@
+import os,sys,json,glob,shutil,uuid,time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import LocalContext, LocalSession
+from dpdispatcher.shell import Shell
+from dpdispatcher.poll_policy import FixedPollPolicy
+from dpdispatcher.result_cache import TaskResultCache
+from .context import setUpModule
+from .context import Submission, Job, Task, Resources
+
+def _write_file(fname, write_str):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, 'w') as fp:
+        fp.write(write_str)
+
+def _read_file(fname):
+    with open(fname, 'r') as fp:
+        return fp.read()
+
+class TestTaskResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_result_cache')
+        self.work_root = os.path.join(self.tmp_dir, 'work')
+        for ii in range(3):
+            _write_file(os.path.join(self.work_root, 'task%d' % ii, 'input'), 'same input')
+        _write_file(os.path.join(self.work_root, 'graph.pb'), 'model')
+        self.cache = TaskResultCache(os.path.join(self.tmp_dir, 'cache'))
+
+    def tearDown(self):
+        for dirpath, dirnames, filenames in os.walk(self.tmp_dir):
+            for fname in filenames:
+                os.chmod(os.path.join(dirpath, fname), 0o644)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_task_keys(self):
+        task_list = [Task(command='lmp -i input', task_work_path='task%d/' % ii, forward_files=['input'], backward_files=['out'])
+            for ii in range(3)]
+        task_list.append(Task(command='lmp -i input', task_work_path='task3/', forward_files=['input'], backward_files=['out']))
+        key_list = self.cache.get_task_keys(task_list, self.work_root, ['graph.pb'])
+        # the same command and inputs in another directory have the same key
+        self.assertEqual(key_list[0], key_list[1])
+        self.assertIsNone(key_list[3])
+        _write_file(os.path.join(self.work_root, 'task2', 'input'), 'other input')
+        self.assertNotEqual(self.cache.get_task_keys(task_list[2:3], self.work_root, ['graph.pb'])[0], key_list[0])
+        _write_file(os.path.join(self.work_root, 'graph.pb'), 'new model')
+        self.assertNotEqual(self.cache.get_task_keys(task_list[:1], self.work_root, ['graph.pb'])[0], key_list[0])
+
+    def test_insert_restore(self):
+        task_root = os.path.join(self.work_root, 'task0')
+        self.assertFalse(self.cache.insert('key0', task_root, ['out', 'traj']))
+        _write_file(os.path.join(task_root, 'out'), 'result')
+        _write_file(os.path.join(task_root, 'traj', '0.lammpstrj'), 'frame')
+        self.assertTrue(self.cache.insert('key0', task_root, ['out', 'traj']))
+        self.assertFalse(self.cache.restore('key1', os.path.join(self.work_root, 'task1')))
+        self.assertTrue(self.cache.restore('key0', os.path.join(self.work_root, 'task1')))
+        self.assertEqual(_read_file(os.path.join(self.work_root, 'task1', 'out')), 'result')
+        self.assertEqual(_read_file(os.path.join(self.work_root, 'task1', 'traj', '0.lammpstrj')), 'frame')
+
+    def test_evict(self):
+        cache = TaskResultCache(os.path.join(self.tmp_dir, 'cache'), max_bytes=10)
+        for ii in range(3):
+            task_root = os.path.join(self.work_root, 'task%d' % ii)
+            _write_file(os.path.join(task_root, 'out'), 'result %d' % ii)
+            cache.insert('key%d' % ii, task_root, ['out'])
+            os.utime(cache.content_cache.get_entry_path(cache.lookup('key%d' % ii)['out']), (ii, ii))
+        # the least recently used results go first
+        self.assertEqual(sorted(cache.evict()), ['key0', 'key1'])
+        self.assertIsNone(cache.lookup('key0'))
+        self.assertIsNone(cache.lookup('key1'))
+        self.assertIsNotNone(cache.lookup('key2'))
+
+
+class TestSubmissionResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_submission_result_cache')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc'), exist_ok=True)
+        os.makedirs(os.path.join(self.tmp_dir, 'rmt'), exist_ok=True)
+        self.context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}))
+        self.result_cache = TaskResultCache(os.path.join(self.tmp_dir, 'cache'))
+        for ii in range(4):
+            _write_file(os.path.join(self.tmp_dir, 'loc', 'task%d' % ii, 'input'), 'input %d' % ii)
+
+    def tearDown(self):
+        for dirpath, dirnames, filenames in os.walk(self.tmp_dir):
+            for fname in filenames:
+                os.chmod(os.path.join(dirpath, fname), 0o644)
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_submission(self, command="bash -c 'cat input input > out'"):
+        # the results are added with the exit status of the tasks from their telemetry
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=2, if_telemetry=True)
+        # the cache looks for the files under work_base, as the jobs are generated before the batch is bound
+        submission = Submission(work_base=os.path.join(self.tmp_dir, 'loc'), resources=resources,
+            poll_policy=FixedPollPolicy(interval=0.2), result_cache=self.result_cache)
+        submission.register_task_list([Task(command=command, task_work_path='task%d/' % ii,
+            forward_files=['input'], backward_files=['out']) for ii in range(4)])
+        return submission
+
+    def test_run_submission(self):
+        submission = self._get_submission()
+        submission.generate_jobs()
+        self.assertEqual(len(submission.belonging_tasks), 4)
+        submission.bind_batch(batch=Shell(context=self.context))
+        submission.run_submission()
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp_dir, 'cache'))), 4 + 1)
+
+        _write_file(os.path.join(self.tmp_dir, 'loc', 'task3', 'input'), 'input changed')
+        for ii in range(4):
+            os.remove(os.path.join(self.tmp_dir, 'loc', 'task%d' % ii, 'out'))
+        submission = self._get_submission()
+        submission.generate_jobs()
+        self.assertEqual([task.task_work_path for task in submission.cached_tasks], ['task0/', 'task1/', 'task2/'])
+        self.assertEqual([task.task_work_path for task in submission.belonging_tasks], ['task3/'])
+        for ii in range(3):
+            self.assertEqual(_read_file(os.path.join(self.tmp_dir, 'loc', 'task%d' % ii, 'out')), 'input %d' % ii * 2)
+        submission.bind_batch(batch=Shell(context=self.context))
+        submission.run_submission()
+        self.assertEqual(_read_file(os.path.join(self.tmp_dir, 'loc', 'task3', 'out')), 'input changed' * 2)
+
+        # all the tasks are restored, and nothing is run
+        submission = self._get_submission()
+        submission.generate_jobs()
+        self.assertEqual(submission.belonging_jobs, [])
+        submission.bind_batch(batch=Shell(context=self.context))
+        self.assertTrue(submission.run_submission())
+
+    def test_insert_succeeded(self):
+        # the tasks failed are not added
+        submission = self._get_submission(command="bash -c 'echo partial > out; exit 1'")
+        submission.generate_jobs()
+        submission.bind_batch(batch=Shell(context=self.context))
+        submission.run_submission()
+        self.assertEqual(submission.insert_result_cache(), 0)
+        # nor without the telemetry
+        for task in submission.belonging_tasks:
+            task.telemetry = None
+        self.assertEqual(submission.insert_result_cache(), 0)
+
+    def test_insert_overwritten_input(self):
+        # the task overwrites its input, and its result is found by the key of the input before the run
+        submission = self._get_submission(command="bash -c 'cat input input > out; echo done > input'")
+        submission.belonging_tasks = submission.belonging_tasks[:1]
+        for task in submission.belonging_tasks:
+            task.backward_files = ['out', 'input']
+        submission.generate_jobs()
+        submission.bind_batch(batch=Shell(context=self.context))
+        submission.run_submission()
+        self.assertEqual(_read_file(os.path.join(self.tmp_dir, 'loc', 'task0', 'input')), 'done\n')
+
+        _write_file(os.path.join(self.tmp_dir, 'loc', 'task0', 'input'), 'input 0')
+        submission = self._get_submission(command="bash -c 'cat input input > out; echo done > input'")
+        submission.belonging_tasks = submission.belonging_tasks[:1]
+        for task in submission.belonging_tasks:
+            task.backward_files = ['out', 'input']
+        submission.generate_jobs()
+        self.assertEqual(submission.belonging_jobs, [])
+        self.assertEqual(_read_file(os.path.join(self.tmp_dir, 'loc', 'task0', 'out')), 'input 0' * 2)
@@ -0,0 +1,153 @@
+import os,sys,json,glob,shutil,uuid,time
+import sqlite3
+import unittest
+from unittest.mock import patch
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.runtime_history import RuntimeHistory, normalize_command, get_input_fingerprint, get_percentile
+from .context import setUpModule
+from .context import Submission, Job, Task, Resources
+from .sample_class import SampleClass
+
+def _get_record(task_hash, wall_time, command_key='lmp -i in.lmp', exit_status=0, end_time=None, input_fingerprint=None):
+    return {'command_key': command_key, 'task_hash': task_hash, 'input_fingerprint': input_fingerprint,
+        'task_need_resources': 1, 'wall_time': wall_time, 'max_rss': 1024, 'queue_wait': 5.,
+        'exit_status': exit_status, 'end_time': end_time if end_time is not None else wall_time}
+
+def _record_in_process(args):
+    db_path, worker = args
+    runtime_history = RuntimeHistory(db_path)
+    for ii in range(20):
+        runtime_history.record_many([_get_record('w%d_%d' % (worker, ii), 1. + ii)])
+    return worker
+
+class TestRuntimeHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_runtime_history')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.db_path = os.path.join(self.tmp_dir, 'history', 'runtime_history.db')
+        self.runtime_history = RuntimeHistory(self.db_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_wal(self):
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_normalize_command(self):
+        self.assertEqual(normalize_command('lmp  -v temp 300 -i in.lmp'), normalize_command('lmp -v temp 600.5 -i in.lmp'))
+        self.assertNotEqual(normalize_command('lmp -i in.lmp'), normalize_command('dp train input.json'))
+
+    def test_percentile(self):
+        self.assertEqual(get_percentile([1., 2., 3., 4., 5.], 50), 3.)
+        self.assertAlmostEqual(get_percentile([1., 2., 3., 4., 5.], 90), 4.6)
+        self.assertEqual(get_percentile([7.], 90), 7.)
+
+    def test_predict(self):
+        record_list = [_get_record('a', float(ii)) for ii in range(1, 11)]
+        record_list.append(_get_record('a', 1000., exit_status=1, end_time=2000.))
+        record_list.append(_get_record('b', 50., command_key='dp train input.json', input_fingerprint='f1'))
+        self.assertEqual(self.runtime_history.record_many(record_list), 12)
+        # a run recorded twice is skipped
+        self.assertEqual(self.runtime_history.record_many(record_list[:1]), 0)
+
+        prediction_list = self.runtime_history.predict_many([
+            {'command_key': 'lmp -i in.lmp', 'task_hash': 'a', 'input_fingerprint': None},
+            {'command_key': 'lmp -i in.lmp', 'task_hash': 'new', 'input_fingerprint': None},
+            {'command_key': 'dp train input.json', 'task_hash': 'new', 'input_fingerprint': 'f1'},
+            {'command_key': 'unknown', 'task_hash': 'new', 'input_fingerprint': None}], percentiles=(50, 90))
+        # the failed run is not used
+        self.assertEqual(prediction_list[0]['sample_count'], 10)
+        self.assertEqual(prediction_list[0]['source'], 'task_hash')
+        self.assertAlmostEqual(prediction_list[0][50], 5.5)
+        self.assertAlmostEqual(prediction_list[0][90], 9.1)
+        self.assertEqual(prediction_list[1]['source'], 'command_key')
+        self.assertEqual(prediction_list[2]['source'], 'input_fingerprint')
+        self.assertEqual(prediction_list[2]['mean'], 50.)
+        self.assertIsNone(prediction_list[3])
+
+    def test_max_samples(self):
+        runtime_history = RuntimeHistory(self.db_path, max_samples=5)
+        runtime_history.record_many([_get_record('a', float(ii)) for ii in range(1, 21)])
+        prediction, = runtime_history.predict_many([{'command_key': 'lmp -i in.lmp', 'task_hash': 'a'}])
+        # the latest runs are used
+        self.assertEqual(prediction['sample_count'], 5)
+        self.assertEqual(prediction[50], 18.)
+        # the latest by their end_time, whatever the order they were recorded in
+        runtime_history.record_many([_get_record('b', float(ii), end_time=100. - ii) for ii in range(1, 21)])
+        prediction, = runtime_history.predict_many([{'command_key': 'lmp -i in.lmp', 'task_hash': 'b'}])
+        self.assertEqual(prediction[50], 3.)
+
+    def test_bounded_query(self):
+        runtime_history = RuntimeHistory(self.db_path, max_samples=5)
+        connect = runtime_history._connect
+        def count_steps(run_num):
+            runtime_history.record_many([_get_record('r%d' % run_num, float(ii), command_key='cmd%d' % run_num) for ii in range(run_num)])
+            step_list = [0]
+            def connect_counted():
+                conn = connect()
+                conn.set_progress_handler(lambda: step_list.__setitem__(0, step_list[0] + 1) or 0, 100)
+                return conn
+            with patch.object(runtime_history, '_connect', side_effect=connect_counted):
+                prediction, = runtime_history.predict_many([{'command_key': 'cmd%d' % run_num, 'task_hash': 'r%d' % run_num}])
+            self.assertEqual(prediction['sample_count'], 5)
+            return step_list[0]
+        # only max_samples runs of each key are read, however many are recorded
+        self.assertLess(count_steps(5000), count_steps(10) + 10)
+
+    def test_concurrent_processes(self):
+        with Pool(4) as pool:
+            pool.map(_record_in_process, [(self.db_path, worker) for worker in range(4)])
+        prediction, = self.runtime_history.predict_many([{'command_key': 'lmp -i in.lmp', 'task_hash': 'new'}])
+        self.assertEqual(prediction['sample_count'], 80)
+
+    def test_predict_many_tasks(self):
+        task_num = 20000
+        self.runtime_history.record_many([_get_record('t%d' % ii, 1. + ii % 7, command_key='cmd%d' % (ii % 100)) for ii in range(task_num)])
+        key_dict_list = [{'command_key': 'cmd%d' % (ii % 100), 'task_hash': 't%d' % ii} for ii in range(task_num)]
+        start_time = time.perf_counter()
+        prediction_list = self.runtime_history.predict_many(key_dict_list)
+        self.assertLess(time.perf_counter() - start_time, 10.)
+        self.assertEqual([prediction['source'] for prediction in prediction_list], ['task_hash'] * task_num)
+
+
+class TestSubmissionRuntimeHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_submission_runtime_history')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.runtime_history = RuntimeHistory(os.path.join(self.tmp_dir, 'runtime_history.db'))
+        self.submission = SampleClass.get_sample_submission()
+        self.submission.runtime_history = self.runtime_history
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_record_and_predict(self):
+        self.assertEqual(self.submission.predict_task_runtimes(), {task.task_hash: None for task in self.submission.belonging_tasks})
+        for job in self.submission.belonging_jobs:
+            job.submit_time = 90.
+            for ii, task in enumerate(job.job_task_list):
+                task.telemetry = {'start_time': 100. + ii, 'end_time': 110. + ii, 'wall_time': 10., 'exit_status': 0, 'max_rss': None, 'run_count': 1}
+            job.telemetry = {'start_time': 100., 'end_time': 110. + ii, 'wall_time': 10. + ii, 'max_rss': None,
+                'task_count': len(job.job_task_list), 'failed_task_count': 0}
+        self.assertEqual(self.submission.record_runtime_history(), 4)
+        with sqlite3.connect(self.runtime_history.db_path) as conn:
+            self.assertEqual(set(conn.execute('SELECT queue_wait FROM task_runtime').fetchall()), {(10.,)})
+        prediction_dict = self.submission.predict_task_runtimes(percentiles=(50,))
+        for task in self.submission.belonging_tasks:
+            self.assertEqual(prediction_dict[task.task_hash][50], 10.)
+            self.assertEqual(prediction_dict[task.task_hash]['source'], 'task_hash')
+
+    def test_input_fingerprint(self):
+        task = Task(command='echo', task_work_path='task0/', forward_files=['in'])
+        self.assertIsNone(get_input_fingerprint(task, self.tmp_dir))
+        os.makedirs(os.path.join(self.tmp_dir, 'task0'))
+        with open(os.path.join(self.tmp_dir, 'task0', 'in'), 'w') as fp:
+            fp.write('1')
+        fingerprint = get_input_fingerprint(task, self.tmp_dir)
+        with open(os.path.join(self.tmp_dir, 'task0', 'in'), 'w') as fp:
+            fp.write('2')
+        self.assertNotEqual(get_input_fingerprint(task, self.tmp_dir), fingerprint)
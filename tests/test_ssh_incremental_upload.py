@@ -0,0 +1,123 @@
+import os,sys,json,glob,shutil,uuid,time
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.ssh_context import SSHContext
+from .context import setUpModule
+from .local_ssh_session import LocalSSHSession
+
+class TestSSHIncrementalUpload(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_ssh_incremental_upload')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc', 'task0', 'dir0'), exist_ok=True)
+        self.file_list = ['task0/test0', 'task0/dir0/test1', 'graph.pb']
+        for fname in self.file_list:
+            with open(os.path.join(self.tmp_dir, 'loc', fname), 'w') as fp:
+                fp.write(str(uuid.uuid4()))
+        self.ssh_session = LocalSSHSession(os.path.join(self.tmp_dir, 'rmt'))
+        self.context = SSHContext(os.path.join(self.tmp_dir, 'loc'), self.ssh_session, incremental_upload=True)
+        self.context.local_root = os.path.join(self.tmp_dir, 'loc')
+        self.context.remote_root = os.path.join(self.tmp_dir, 'rmt', 'hash')
+        self.context.job_uuid = 'hash'
+        self.put_file_list = []
+        self.context._put_files = MagicMock(side_effect=self._put_files)
+
+    def _put_files(self, files, dereference=True, archive_name=None):
+        self.put_file_list.extend(files)
+        SSHContext._put_files(self.context, files, dereference=dereference, archive_name=archive_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_skip_unchanged(self):
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(sorted(self.put_file_list), sorted(self.file_list))
+        manifest = self.context._read_upload_manifest()
+        self.assertEqual(sorted(manifest.keys()), sorted(self.file_list))
+
+        # nothing changed
+        self.put_file_list = []
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(self.put_file_list, [])
+
+        # mtime changed, content unchanged
+        os.utime(os.path.join(self.tmp_dir, 'loc', 'graph.pb'), (0, 0))
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(self.put_file_list, [])
+        self.assertEqual(self.context._read_upload_manifest()['graph.pb'][1], 0)
+
+        # content changed
+        with open(os.path.join(self.tmp_dir, 'loc', 'task0/test0'), 'w') as fp:
+            fp.write('changed content')
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(self.put_file_list, ['task0/test0'])
+        with open(os.path.join(self.tmp_dir, 'rmt', 'hash', 'task0/test0')) as fp:
+            self.assertEqual(fp.read(), 'changed content')
+
+    def test_remote_changed(self):
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        # the remote copies are changed or removed between the uploads, and the local files are not
+        with open(os.path.join(self.tmp_dir, 'rmt', 'hash', 'task0/test0'), 'w') as fp:
+            fp.write('changed remotely')
+        os.remove(os.path.join(self.tmp_dir, 'rmt', 'hash', 'graph.pb'))
+        self.put_file_list = []
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(sorted(self.put_file_list), ['graph.pb', 'task0/test0'])
+        for fname in ['task0/test0', 'graph.pb']:
+            with open(os.path.join(self.tmp_dir, 'loc', fname)) as fp_loc, open(os.path.join(self.tmp_dir, 'rmt', 'hash', fname)) as fp_rmt:
+                self.assertEqual(fp_rmt.read(), fp_loc.read())
+        # the same content, only touched remotely
+        os.utime(os.path.join(self.tmp_dir, 'rmt', 'hash', 'graph.pb'), (0, 0))
+        self.put_file_list = []
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(self.put_file_list, ['graph.pb'])
+        self.put_file_list = []
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(self.put_file_list, [])
+
+    def test_remote_changed_sha256(self):
+        self.context.remote_cache = True
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        # the size and the mtime of the remote copy are kept, and its content is checked with remote_cache
+        remote_fname = os.path.join(self.tmp_dir, 'rmt', 'hash', 'graph.pb')
+        remote_stat = os.stat(remote_fname)
+        with open(remote_fname, 'r+') as fp:
+            fp.write('x')
+        os.utime(remote_fname, (remote_stat.st_atime, remote_stat.st_mtime))
+        self.put_file_list = []
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(self.put_file_list, ['graph.pb'])
+
+    def test_old_manifest(self):
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        # a manifest without the remote size and mtime is checked by the size of the remote copies, then completed
+        manifest = {fname: record[:3] for fname, record in self.context._read_upload_manifest().items()}
+        self.context._write_upload_manifest(manifest)
+        self.put_file_list = []
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(self.put_file_list, [])
+        self.assertTrue(all([len(record) == 5 for record in self.context._read_upload_manifest().values()]))
+
+    def test_batch(self):
+        self.context.incremental_upload_batch_bytes = 1
+        self.context._put_files_incremental(['task0', 'graph.pb'])
+        self.assertEqual(self.context._put_files.call_count, 3)
+
+    def test_parallel(self):
+        # the transfers of two jobs overlap: each one only ends after the other one started
+        started_event_dict = {'task0/test0': threading.Event(), 'graph.pb': threading.Event()}
+        def put_files(files, dereference=True, archive_name=None):
+            started_event_dict[files[0]].set()
+            other_fname = [fname for fname in started_event_dict if fname != files[0]][0]
+            self.assertTrue(started_event_dict[other_fname].wait(timeout=10))
+            self._put_files(files, dereference=dereference, archive_name=archive_name)
+        self.context._put_files = MagicMock(side_effect=put_files)
+        thread = threading.Thread(target=self.context._put_files_incremental, args=(['task0/test0'],), kwargs={'archive_name': 'job0'})
+        thread.start()
+        self.context._put_files_incremental(['graph.pb'], archive_name='job1')
+        thread.join()
+        # the records of both are merged into the manifest
+        self.assertEqual(sorted(self.context._read_upload_manifest().keys()), ['graph.pb', 'task0/test0'])
@@ -0,0 +1,74 @@
+import os,sys,json,glob,shutil,uuid,time
+import unittest
+import threading
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.ssh_context import SSHSession
+from .context import setUpModule
+
+def _mock_setup_ssh(self):
+    self._close_sftp_pool()
+    transport = MagicMock()
+    self.ssh = MagicMock()
+    self.ssh.get_transport = MagicMock(return_value=transport)
+    def open_sftp():
+        sftp = MagicMock()
+        sftp.get_channel.return_value.closed = False
+        sftp.get_channel.return_value.get_transport.return_value = transport
+        return sftp
+    self.ssh.open_sftp = MagicMock(side_effect=open_sftp)
+
+class TestSSHSessionPool(unittest.TestCase):
+    @patch.object(SSHSession, '_setup_ssh', _mock_setup_ssh)
+    def setUp(self):
+        self.ssh_session = SSHSession(hostname='localhost', remote_root='/tmp', username='dp')
+
+    def test_reuse(self):
+        for ii in range(10):
+            with self.ssh_session.sftp_client() as sftp:
+                sftp.stat('foo')
+        channel_stats = self.ssh_session.get_channel_stats()
+        self.assertEqual(channel_stats['sftp_open'], 1)
+        self.assertEqual(channel_stats['sftp_reuse'], 9)
+        self.assertEqual(self.ssh_session.ssh.open_sftp.call_count, 1)
+
+    def test_nested(self):
+        with self.ssh_session.sftp_client() as sftp1:
+            with self.ssh_session.sftp_client() as sftp2:
+                self.assertIsNot(sftp1, sftp2)
+        self.assertEqual(self.ssh_session.get_channel_stats()['sftp_open'], 2)
+        self.assertEqual(len(self.ssh_session._sftp_pool), 2)
+
+    def test_closed_channel(self):
+        with self.ssh_session.sftp_client() as sftp:
+            pass
+        sftp.get_channel.return_value.closed = True
+        with self.ssh_session.sftp_client() as sftp2:
+            self.assertIsNot(sftp, sftp2)
+        self.assertEqual(self.ssh_session.get_channel_stats()['sftp_open'], 2)
+
+    @patch.object(SSHSession, '_setup_ssh', _mock_setup_ssh)
+    def test_reconnect(self):
+        with self.ssh_session.sftp_client() as sftp:
+            pass
+        self.ssh_session._setup_ssh()
+        self.assertEqual(len(self.ssh_session._sftp_pool), 0)
+        sftp.close.assert_called()
+
+    def test_concurrent_reconnect(self):
+        # the connection is broken; the threads finding it broken reconnect it once
+        self.ssh_session.ssh.get_transport.return_value.send_ignore.side_effect = EOFError
+        def connect(**kwargs):
+            time.sleep(0.1)
+        with patch('dpdispatcher.ssh_context.paramiko.SSHClient') as ssh_client:
+            ssh_client.return_value.connect.side_effect = connect
+            thread_list = [threading.Thread(target=self.ssh_session.ensure_alive, kwargs={'sleep_time': 0}) for ii in range(8)]
+            for thread in thread_list:
+                thread.start()
+            for thread in thread_list:
+                thread.join()
+        self.assertEqual(ssh_client.call_count, 1)
+        self.assertIs(self.ssh_session.ssh, ssh_client.return_value)
+        self.assertEqual(self.ssh_session.get_channel_stats()['reconnect'], 1)
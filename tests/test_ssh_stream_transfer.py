@@ -0,0 +1,60 @@
+import os,sys,json,glob,shutil,uuid,time
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.ssh_context import SSHContext
+from .context import setUpModule
+from .local_ssh_session import LocalSSHSession
+
+class TestSSHStreamTransfer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_ssh_stream_transfer')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc', 'task0', 'dir0'), exist_ok=True)
+        self.file_list = ['task0/test0', 'task0/dir0/test1']
+        for fname in self.file_list:
+            with open(os.path.join(self.tmp_dir, 'loc', fname), 'w') as fp:
+                fp.write(str(uuid.uuid4()))
+        self.ssh_session = LocalSSHSession(os.path.join(self.tmp_dir, 'rmt'))
+        self.context = self._get_context(stream_transfer=True)
+
+    def _get_context(self, **kwargs):
+        context = SSHContext(os.path.join(self.tmp_dir, 'loc'), self.ssh_session, **kwargs)
+        context.local_root = os.path.join(self.tmp_dir, 'loc')
+        context.remote_root = os.path.join(self.tmp_dir, 'rmt', 'hash')
+        context.job_uuid = 'hash'
+        return context
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_get_files(self):
+        self.context._put_files(self.file_list)
+        for fname in self.file_list:
+            with open(os.path.join(self.tmp_dir, 'loc', fname)) as fp:
+                local_str = fp.read()
+            with open(os.path.join(self.tmp_dir, 'rmt', 'hash', fname)) as fp:
+                self.assertEqual(fp.read(), local_str)
+        # no temporary tarball on either side
+        self.assertFalse(glob.glob(os.path.join(self.tmp_dir, '*', '*.tgz')))
+        self.assertFalse(glob.glob(os.path.join(self.tmp_dir, 'rmt', 'hash', '*.tgz')))
+
+        with open(os.path.join(self.tmp_dir, 'rmt', 'hash', 'task0', 'log'), 'w') as fp:
+            fp.write('result')
+        self.context._get_files(['task0/log'])
+        with open(os.path.join(self.tmp_dir, 'loc', 'task0', 'log')) as fp:
+            self.assertEqual(fp.read(), 'result')
+
+    def test_get_files_missing(self):
+        os.makedirs(self.context.remote_root, exist_ok=True)
+        with self.assertRaises(RuntimeError):
+            self.context._get_files(['task0/not_exist'])
+
+    def test_compression(self):
+        for stream_transfer in [True, False]:
+            for compression, compress_level in [('none', None), ('gzip', 1), ('bz2', None), ('xz', 0), ('auto', None)]:
+                with self.subTest(stream_transfer=stream_transfer, compression=compression):
+                    shutil.rmtree(os.path.join(self.tmp_dir, 'rmt'), ignore_errors=True)
+                    self.context = self._get_context(stream_transfer=stream_transfer, compression=compression, compress_level=compress_level)
+                    self.test_put_get_files()
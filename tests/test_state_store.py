@@ -0,0 +1,193 @@
+import os,sys,json,glob,shutil,uuid,time
+import sqlite3
+import unittest
+from unittest.mock import patch
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import LocalContext, LocalSession
+from dpdispatcher.shell import Shell
+from dpdispatcher.poll_policy import FixedPollPolicy
+from dpdispatcher.state_store import JournalStateStore, SQLiteStateStore
+from .context import JobStatus
+from .context import setUpModule
+from .context import Submission, Job, Task, Resources
+
+class TestJournalStateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_state_store')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc'), exist_ok=True)
+        os.makedirs(os.path.join(self.tmp_dir, 'rmt'), exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_submission(self, state_store):
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=2)
+        submission = Submission(work_base='.', resources=resources, state_store=state_store)
+        submission.register_task_list([Task(command='echo %d' % ii, task_work_path='task%d/' % ii) for ii in range(8)])
+        submission.generate_jobs()
+        context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}))
+        submission.bind_batch(batch=Shell(context=context))
+        return submission
+
+    def _read_journal(self, submission):
+        with open(os.path.join(submission.batch.context.remote_root, submission.submission_hash + '.journal')) as fp:
+            return fp.read()
+
+    def test_save_load(self):
+        submission = self._get_submission(JournalStateStore())
+        for job in submission.belonging_jobs:
+            job.job_state = JobStatus.unsubmitted
+        submission.submission_to_json(if_query_state=False)
+        self.assertEqual(self._read_journal(submission), '')
+        job1, job2, job3, job4 = submission.belonging_jobs
+        job1.job_state, job1.job_id, job1.fail_count = JobStatus.running, '11', 1
+        job2.job_state = JobStatus.waiting
+        submission.submission_to_json(if_query_state=False)
+        submission.submission_to_json(if_query_state=False)
+        # only the jobs changed are recorded
+        self.assertEqual(len(self._read_journal(submission).splitlines()), 2)
+        job1.job_state = JobStatus.finished
+        submission.submission_to_json(if_query_state=False)
+        self.assertEqual(len(self._read_journal(submission).splitlines()), 3)
+
+        recovered_submission = self._get_submission(JournalStateStore())
+        recovered_submission.try_recover_from_json()
+        self.assertEqual([job.job_state for job in recovered_submission.belonging_jobs],
+            [JobStatus.finished, JobStatus.waiting, JobStatus.unsubmitted, JobStatus.unsubmitted])
+        self.assertEqual((recovered_submission.belonging_jobs[0].job_id, recovered_submission.belonging_jobs[0].fail_count), ('11', 1))
+
+    def test_compact(self):
+        submission = self._get_submission(JournalStateStore(min_compact_records=2))
+        submission.submission_to_json(if_query_state=False)
+        for job_state in [JobStatus.waiting, JobStatus.running, JobStatus.waiting, JobStatus.running, JobStatus.finished]:
+            submission.belonging_jobs[0].job_state = job_state
+            submission.submission_to_json(if_query_state=False)
+        # the journal is compacted once it has as many records as the jobs; the snapshot has the last state
+        self.assertEqual(self._read_journal(submission), '')
+        with open(os.path.join(submission.batch.context.remote_root, submission.submission_hash + '.json')) as fp:
+            submission_dict = json.load(fp)
+        self.assertEqual(submission_dict['journal_generation'], 1)
+        self.assertEqual(list(submission_dict['belonging_jobs'][0].values())[0]['job_state'], JobStatus.finished)
+
+    def test_load_broken_journal(self):
+        submission = self._get_submission(JournalStateStore())
+        submission.submission_to_json(if_query_state=False)
+        submission.belonging_jobs[0].job_state = JobStatus.running
+        submission.submission_to_json(if_query_state=False)
+        journal_name = os.path.join(submission.batch.context.remote_root, submission.submission_hash + '.journal')
+        job_hash = submission.belonging_jobs[1].job_hash
+        with open(journal_name, 'a') as fp:
+            # a record of an older generation, and a record cut short by a crash
+            fp.write(json.dumps({'generation': -1, 'job_hash': job_hash, 'job_state': JobStatus.finished,
+                'job_id': '', 'fail_count': 0, 'if_downloaded': False, 'submit_time': None}) + '\n')
+            fp.write('{"generation":0,"job_hash":"%s","job_st' % job_hash)
+
+        state_store = JournalStateStore()
+        recovered_submission = self._get_submission(state_store)
+        recovered_submission.try_recover_from_json()
+        self.assertEqual([job.job_state for job in recovered_submission.belonging_jobs[:2]], [JobStatus.running, None])
+        # the journal is compacted at the next save instead of appended to
+        recovered_submission.submission_to_json(if_query_state=False)
+        self.assertEqual(self._read_journal(recovered_submission), '')
+        self.assertEqual(state_store.generation, 1)
+
+    def test_run_submission(self):
+        submission = self._get_submission(JournalStateStore())
+        submission.poll_policy = FixedPollPolicy(interval=0.2)
+        for ii in range(8):
+            os.makedirs(os.path.join(self.tmp_dir, 'loc', 'task%d' % ii), exist_ok=True)
+        check_status_many = Shell.check_status_many
+        check_all_finished = Submission.check_all_finished
+        with patch.object(Shell, 'check_status_many', autospec=True, side_effect=check_status_many) as mock_check_status_many, \
+            patch.object(Submission, 'check_all_finished', autospec=True, side_effect=check_all_finished) as mock_check_all_finished:
+            submission.run_submission()
+        # the states are queried once by each check, and not again to save them at the end
+        self.assertEqual(mock_check_status_many.call_count, mock_check_all_finished.call_count)
+        self.assertEqual([job.job_state for job in submission.belonging_jobs], [JobStatus.finished] * 4)
+
+    def test_recover_json(self):
+        # a submission json written without the store is recovered too
+        submission = self._get_submission(None)
+        submission.belonging_jobs[0].job_state = JobStatus.running
+        submission.submission_to_json(if_query_state=False)
+        recovered_submission = self._get_submission(JournalStateStore())
+        recovered_submission.try_recover_from_json()
+        self.assertEqual(recovered_submission.belonging_jobs[0].job_state, JobStatus.running)
+        recovered_submission.submission_to_json(if_query_state=False)
+        self.assertEqual(recovered_submission.state_store.generation, 0)
+
+
+def _get_work_submission(work_index, state_store=None):
+    resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=2)
+    submission = Submission(work_base='work%d' % work_index, resources=resources, state_store=state_store)
+    submission.register_task_list([Task(command='echo %d' % ii, task_work_path='task%d/' % ii) for ii in range(6)])
+    submission.generate_jobs()
+    return submission
+
+def _save_in_process(args):
+    db_path, work_index = args
+    submission = _get_work_submission(work_index, SQLiteStateStore(db_path))
+    for job_state in [JobStatus.unsubmitted, JobStatus.waiting, JobStatus.running, JobStatus.finished]:
+        for job in submission.belonging_jobs:
+            job.job_state = job_state
+            submission.state_store.save(submission)
+    return submission.submission_hash
+
+class TestSQLiteStateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_sqlite_state_store')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc'), exist_ok=True)
+        os.makedirs(os.path.join(self.tmp_dir, 'rmt'), exist_ok=True)
+        self.db_path = os.path.join(self.tmp_dir, 'state', 'dpdispatcher_state.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_wal(self):
+        SQLiteStateStore(self.db_path)
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_save_load(self):
+        submission = _get_work_submission(0, SQLiteStateStore(self.db_path))
+        context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}))
+        submission.bind_batch(batch=Shell(context=context))
+        self.assertIsNone(submission.state_store.load(submission))
+        for job in submission.belonging_jobs:
+            job.job_state = JobStatus.waiting
+        submission.submission_to_json(if_query_state=False)
+        job1, job2, job3 = submission.belonging_jobs
+        job1.job_state, job1.job_id, job1.fail_count, job1.if_downloaded = JobStatus.finished, '11', 1, True
+        job2.job_state = JobStatus.running
+        submission.submission_to_json(if_query_state=False)
+
+        # another process queries the jobs running
+        state_store = SQLiteStateStore(self.db_path)
+        self.assertEqual(state_store.get_submission_hashes(), [submission.submission_hash])
+        self.assertEqual([job_dict['job_hash'] for job_dict in state_store.get_jobs(submission.submission_hash,
+            job_state_list=[JobStatus.running, JobStatus.waiting])], [job2.job_hash, job3.job_hash])
+        self.assertEqual(state_store.get_state_counts(submission.submission_hash),
+            {JobStatus.finished: 1, JobStatus.running: 1, JobStatus.waiting: 1})
+        job_dict = state_store.get_jobs(submission.submission_hash)[0]
+        self.assertEqual((job_dict['job_state'], job_dict['job_id'], job_dict['fail_count'], job_dict['if_downloaded']),
+            (JobStatus.finished, '11', 1, True))
+
+        recovered_submission = _get_work_submission(0, state_store)
+        recovered_submission.bind_batch(batch=Shell(context=context))
+        recovered_submission.try_recover_from_json()
+        self.assertEqual(recovered_submission.serialize(), submission.serialize())
+        recovered_submission.belonging_jobs[2].job_state = JobStatus.finished
+        recovered_submission.submission_to_json(if_query_state=False)
+        self.assertEqual(state_store.get_state_counts(submission.submission_hash), {JobStatus.finished: 2, JobStatus.running: 1})
+
+    def test_processes(self):
+        SQLiteStateStore(self.db_path)
+        with Pool(4) as pool:
+            submission_hash_list = pool.map(_save_in_process, [(self.db_path, work_index) for work_index in range(4)])
+        state_store = SQLiteStateStore(self.db_path)
+        self.assertEqual(sorted(state_store.get_submission_hashes()), sorted(submission_hash_list))
+        for submission_hash in submission_hash_list:
+            self.assertEqual(state_store.get_state_counts(submission_hash), {JobStatus.finished: 3})
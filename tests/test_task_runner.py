@@ -0,0 +1,223 @@
+import os,sys,json,glob,shutil,uuid,time
+import subprocess as sp
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.lazy_local_context import LazyLocalContext
+from dpdispatcher.shell import Shell
+from dpdispatcher.slurm import Slurm
+from dpdispatcher.pbs import PBS
+from .context import setUpModule
+from .context import Job, Task, Resources
+
+def _get_job(duration_list, task_need_resources, task_runner):
+    resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', 
+        group_size=len(duration_list), task_runner=task_runner)
+    task_list = [Task(command="bash -c 'echo start $(date +%s.%N) >> ../timeline; sleep {duration}; echo end $(date +%s.%N) >> ../timeline'".format(duration=duration), 
+        task_work_path='task%d/' % ii, task_need_resources=task_need_resources) for ii, duration in enumerate(duration_list)]
+    return Job(job_task_list=task_list, resources=resources)
+
+class TestWaveTaskRunner(unittest.TestCase):
+    def test_wave(self):
+        context = LazyLocalContext('.', None)
+        job = _get_job([1, 1, 1, 1, 1], 0.5, 'wave')
+        script = Slurm(context=context).gen_script(job)
+        self.assertEqual(script.count('\nwait\n'), 3)
+        self.assertNotIn('dp_acquire_slot', script)
+        # the script is the same when generated again
+        self.assertEqual(script, Slurm(context=context).gen_script(job))
+
+    def test_serialize(self):
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal')
+        self.assertNotIn('task_runner', resources.serialize())
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', task_runner='dynamic')
+        self.assertEqual(Resources.deserialize(resources.serialize()).task_runner, 'dynamic')
+        with self.assertRaises(RuntimeError):
+            Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', task_runner='fifo')
+
+
+@unittest.skipIf(not shutil.which('bash'), 'requires bash')
+class TestDynamicTaskRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_task_runner')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.context = LazyLocalContext(self.tmp_dir, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _run(self, job):
+        for task in job.job_task_list:
+            os.makedirs(os.path.join(self.tmp_dir, task.task_work_path), exist_ok=True)
+        script = Shell(context=self.context).gen_script(job)
+        with open(os.path.join(self.tmp_dir, 'job.sub'), 'w') as fp:
+            fp.write(script)
+        sp.check_call(['bash', 'job.sub'], cwd=self.tmp_dir)
+        with open(os.path.join(self.tmp_dir, 'timeline')) as fp:
+            event_list = sorted([(float(line.split()[1]), line.split()[0]) for line in fp])
+        max_running = 0
+        running = 0
+        for event_time, event in event_list:
+            running += 1 if event == 'start' else -1
+            max_running = max(running, max_running)
+        return event_list, max_running
+
+    def test_dynamic(self):
+        job = _get_job([1.5, 0.1, 0.1, 0.1, 0.1], 0.5, 'dynamic')
+        event_list, max_running = self._run(job)
+        self.assertEqual(max_running, 2)
+        # the short tasks run beside the long one, instead of waiting for it
+        self.assertEqual([event for event_time, event in event_list][-1], 'end')
+        self.assertLess(event_list[-1][0] - event_list[0][0], 1.5 + 0.8)
+        for task in job.job_task_list:
+            self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, task.task_work_path, task.task_hash + '_task_tag_finished')))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, job.job_hash + '_job_tag_finished')))
+
+    def test_dynamic_pbs(self):
+        # the PBS script is run from the directory qsub is called in, not from the remote root
+        job = _get_job([0.1, 0.1, 0.1], 0.5, 'dynamic')
+        for task in job.job_task_list:
+            os.makedirs(os.path.join(self.tmp_dir, task.task_work_path), exist_ok=True)
+        os.makedirs(os.path.join(self.tmp_dir, 'home'))
+        with open(os.path.join(self.tmp_dir, 'job.sub'), 'w') as fp:
+            fp.write(PBS(context=self.context).gen_script(job))
+        sp.check_call(['bash', os.path.join(self.tmp_dir, 'job.sub')], cwd=os.path.join(self.tmp_dir, 'home'),
+            env=dict(os.environ, PBS_O_WORKDIR=self.tmp_dir, HOME=os.path.join(self.tmp_dir, 'home')))
+        with open(os.path.join(self.tmp_dir, 'timeline')) as fp:
+            self.assertEqual(len(fp.readlines()), 6)
+        for task in job.job_task_list:
+            self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, task.task_work_path, task.task_hash + '_task_tag_finished')))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, job.job_hash + '_job_tag_finished')))
+
+    def test_dynamic_gpu(self):
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=2, queue_name='normal', 
+            group_size=6, if_cuda_multi_devices=True, task_runner='dynamic')
+        command = "bash -c 'echo start $(date +%s.%N) $CUDA_VISIBLE_DEVICES >> ../timeline; sleep {duration}; echo end $(date +%s.%N) $CUDA_VISIBLE_DEVICES >> ../timeline'"
+        duration_need_list = [(0.8, 0.5), (0.1, 0.5), (0.1, 0.5), (0.1, 0.5), (0.2, 1.0), (0.1, 0.25)]
+        task_list = [Task(command=command.format(duration=duration), task_work_path='task%d/' % ii, 
+            task_need_resources=need) for ii, (duration, need) in enumerate(duration_need_list)]
+        job = Job(job_task_list=task_list, resources=resources)
+        event_list, max_running = self._run(job)
+        with open(os.path.join(self.tmp_dir, 'timeline')) as fp:
+            event_list = sorted([(float(line.split()[1]), line.split()[0], line.split()[2]) for line in fp])
+        # a whole GPU is never given to two running tasks
+        gpu_use = {'0': 0, '1': 0}
+        for event_time, event, devices in event_list:
+            for device in devices.split(','):
+                gpu_use[device] += 1 if event == 'start' else -1
+                self.assertLessEqual(gpu_use[device], 1)
+        self.assertIn('0,1', [devices for event_time, event, devices in event_list])
+
+    def test_dynamic_gpu_script(self):
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=4, queue_name='normal', 
+            group_size=3, if_cuda_multi_devices=True, task_runner='dynamic')
+        task_list = [Task(command='echo', task_work_path='task%d/' % ii, task_need_resources=need) 
+            for ii, need in enumerate([0.5, 0.25, 0.1])]
+        script = Shell(context=self.context).gen_script(Job(job_task_list=task_list, resources=resources))
+        self.assertIn('dp_gpu_free=(1000 1000 1000 1000)', script)
+        self.assertIn('dp_acquire_slot 500 gpu 2 1000', script)
+        self.assertIn('dp_acquire_slot 250 gpu 1 1000', script)
+        self.assertIn('dp_acquire_slot 100 gpu 1 400', script)
+        self.assertIn('export CUDA_VISIBLE_DEVICES=$dp_alloc_gpu', script)
+
+
+def _get_pin_sets(script):
+    # the offsets of the cores in the ones the job may use
+    return [set(int(cpu) for cpu in line.split('taskset -pc $(dp_cpu_list ')[1].split(')')[0].split(','))
+        for line in script.split('\n') if 'taskset -pc $(dp_cpu_list ' in line]
+
+class TestCpuAffinity(unittest.TestCase):
+    def test_wave_pin_sets(self):
+        context = LazyLocalContext('.', None)
+        for cpu_per_node, need_list in [(8, [0.25] * 8), (8, [0.5, 0.25, 0.125, 0.125, 0.5, 0.5]), (6, [0.3, 0.3, 0.3, 0.4, 0.5]), (4, [1.0, 0.5, 0.5])]:
+            resources = Resources(number_node=1, cpu_per_node=cpu_per_node, gpu_per_node=0, queue_name='normal', 
+                group_size=len(need_list), task_runner='wave', cpu_affinity='taskset')
+            task_list = [Task(command='echo', task_work_path='task%d/' % ii, task_need_resources=need) for ii, need in enumerate(need_list)]
+            script = Shell(context=context).gen_script(Job(job_task_list=task_list, resources=resources))
+            self.assertEqual(len(_get_pin_sets(script)), len(need_list))
+            # the pin sets of the tasks of each wave do not overlap, and lie on the node
+            for wave in script.split('\nwait\n'):
+                pin_set_list = _get_pin_sets(wave)
+                all_cpus = set().union(*pin_set_list) if pin_set_list else set()
+                self.assertEqual(len(all_cpus), sum([len(pin_set) for pin_set in pin_set_list]))
+                self.assertTrue(all_cpus <= set(range(cpu_per_node)))
+        self.assertEqual(_get_pin_sets(script), [{0, 1, 2, 3}, {0, 1}, {2, 3}])
+
+    def test_options(self):
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', task_runner='dynamic', cpu_affinity='numactl')
+        self.assertEqual(Resources.deserialize(resources.serialize()).cpu_affinity, 'numactl')
+        self.assertNotIn('cpu_affinity', Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal').serialize())
+        with self.assertRaises(RuntimeError):
+            Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', cpu_affinity='hwloc')
+        # a task needing less than one core can not be pinned
+        task = Task(command='echo', task_work_path='task0/', task_need_resources=0.1)
+        with self.assertRaises(RuntimeError):
+            Shell(context=LazyLocalContext('.', None)).gen_script(Job(job_task_list=[task], resources=resources))
+
+
+@unittest.skipIf(not shutil.which('bash') or not shutil.which('taskset'), 'requires bash and taskset')
+class TestDynamicCpuAffinity(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_cpu_affinity')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.context = LazyLocalContext(self.tmp_dir, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_dynamic_pin_sets(self):
+        cpu_per_node = min(len(os.sched_getaffinity(0)), 4)
+        resources = Resources(number_node=1, cpu_per_node=cpu_per_node, gpu_per_node=0, queue_name='normal', 
+            group_size=8, task_runner='dynamic', cpu_affinity='taskset')
+        # the tasks run on the first cpu_per_node cores the job may use
+        command = "bash -c 'echo start $(date +%s.%N) $(taskset -pc $$ | cut -d: -f2) >> ../timeline; sleep {duration}; echo end $(date +%s.%N) $(taskset -pc $$ | cut -d: -f2) >> ../timeline'"
+        task_list = [Task(command=command.format(duration=0.1 * (1 + ii % 3)), task_work_path='task%d/' % ii, 
+            task_need_resources=1 / cpu_per_node) for ii in range(8)]
+        job = Job(job_task_list=task_list, resources=resources)
+        allowed_cpus = sorted(os.sched_getaffinity(0))
+        for task in task_list:
+            os.makedirs(os.path.join(self.tmp_dir, task.task_work_path))
+        with open(os.path.join(self.tmp_dir, 'job.sub'), 'w') as fp:
+            fp.write(Shell(context=self.context).gen_script(job))
+        sp.check_call(['bash', 'job.sub'], cwd=self.tmp_dir)
+        with open(os.path.join(self.tmp_dir, 'timeline')) as fp:
+            event_list = sorted([(float(line.split()[1]), line.split()[0], line.split()[2]) for line in fp])
+        self.assertEqual(len(event_list), 16)
+        # a core is never given to two running tasks
+        cpu_use = {}
+        for event_time, event, cpus in event_list:
+            self.assertIn(int(cpus), allowed_cpus[:cpu_per_node])
+            cpu_use[cpus] = cpu_use.get(cpus, 0) + (1 if event == 'start' else -1)
+            self.assertLessEqual(cpu_use[cpus], 1)
+
+    def _write_wave_job(self, cpu_per_node):
+        resources = Resources(number_node=1, cpu_per_node=cpu_per_node, gpu_per_node=0, queue_name='normal',
+            group_size=2, task_runner='wave', cpu_affinity='taskset')
+        task_list = [Task(command="bash -c 'taskset -pc $$ | cut -d: -f2 > cpus'", task_work_path='task%d/' % ii,
+            task_need_resources=0.5 if cpu_per_node > 1 else 1) for ii in range(2)]
+        job = Job(job_task_list=task_list, resources=resources)
+        for task in task_list:
+            os.makedirs(os.path.join(self.tmp_dir, task.task_work_path))
+        with open(os.path.join(self.tmp_dir, 'job.sub'), 'w') as fp:
+            fp.write(Shell(context=self.context).gen_script(job))
+        return job
+
+    def test_shared_node(self):
+        # the job is given the last cores of the node, as by the cgroup of a scheduler on a shared node
+        job_cpus = sorted(os.sched_getaffinity(0))[-2:]
+        job = self._write_wave_job(len(job_cpus))
+        sp.check_call(['taskset', '-c', ','.join([str(cpu) for cpu in job_cpus]), 'bash', 'job.sub'], cwd=self.tmp_dir)
+        task_cpu_list = []
+        for task in job.job_task_list:
+            with open(os.path.join(self.tmp_dir, task.task_work_path, 'cpus')) as fp:
+                task_cpu_list.append(int(fp.read()))
+        self.assertEqual(sorted(set(task_cpu_list)), job_cpus)
+
+    def test_too_few_cores(self):
+        # the script fails instead of running the tasks unpinned
+        job = self._write_wave_job(len(os.sched_getaffinity(0)) + 1)
+        self.assertNotEqual(sp.call(['bash', 'job.sub'], cwd=self.tmp_dir, stderr=sp.DEVNULL), 0)
+        for task in job.job_task_list:
+            self.assertFalse(os.path.isfile(os.path.join(self.tmp_dir, task.task_work_path, task.task_hash + '_task_tag_finished')))
+        self.assertFalse(os.path.isfile(os.path.join(self.tmp_dir, job.job_hash + '_job_tag_finished')))
@@ -0,0 +1,117 @@
+import os,sys,json,glob,shutil,uuid,time
+import subprocess as sp
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+__package__ = 'tests'
+from dpdispatcher.local_context import LocalContext, LocalSession
+from dpdispatcher.lazy_local_context import LazyLocalContext
+from dpdispatcher.shell import Shell
+from dpdispatcher.slurm import Slurm
+from dpdispatcher.pbs import PBS
+from dpdispatcher.poll_policy import FixedPollPolicy
+from dpdispatcher.runtime_history import RuntimeHistory
+from dpdispatcher.task_telemetry import get_task_telemetry_file, parse_task_telemetry, summarize_job_telemetry
+from .context import setUpModule
+from .context import Submission, Job, Task, Resources
+
+class TestParseTaskTelemetry(unittest.TestCase):
+    def test_parse(self):
+        record_str = ("aaa 100.5 110.5 0 2048\n"
+            "bbb 100.0 101.0 1 -\n"
+            "broken line\n"
+            "bbb 200.0 204.0 0 -\n")
+        task_telemetry_dict = parse_task_telemetry(record_str)
+        self.assertEqual(task_telemetry_dict['aaa'], {'start_time': 100.5, 'end_time': 110.5, 'exit_status': 0,
+            'max_rss': 2048, 'wall_time': 10., 'run_count': 1})
+        # the last run of a task counts
+        self.assertEqual(task_telemetry_dict['bbb']['exit_status'], 0)
+        self.assertEqual(task_telemetry_dict['bbb']['run_count'], 2)
+        self.assertIsNone(task_telemetry_dict['bbb']['max_rss'])
+
+        job_telemetry = summarize_job_telemetry([task_telemetry_dict['aaa'], task_telemetry_dict['bbb'], None])
+        self.assertEqual(job_telemetry, {'start_time': 100.5, 'end_time': 204.0, 'wall_time': 103.5,
+            'max_rss': 2048, 'task_count': 2, 'failed_task_count': 0})
+        self.assertIsNone(summarize_job_telemetry([None]))
+
+
+class TestTelemetryScript(unittest.TestCase):
+    def test_gen_script(self):
+        context = LazyLocalContext('.', None)
+        task_list = [Task(command="echo 'a b'", task_work_path='task0/'), Task(command='echo', task_work_path='task1/')]
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=2)
+        script = Slurm(context=context).gen_script(Job(job_task_list=task_list, resources=resources))
+        self.assertNotIn('dp_run_task', script)
+        self.assertNotIn('if_telemetry', resources.serialize())
+
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=2,
+            if_telemetry=True, cpu_affinity='numactl')
+        self.assertTrue(Resources.deserialize(resources.serialize()).if_telemetry)
+        job = Job(job_task_list=task_list, resources=resources)
+        script = Slurm(context=context).gen_script(job)
+        self.assertIn('dp_run_task() {', script)
+        self.assertIn("dp_run_task $REMOTE_ROOT/{record} {task_hash} numactl --physcpubind=$(dp_cpu_list 0,1,2,3) --localalloc bash -c 'echo '\"'\"'a b'\"'\"''".format(
+            record=get_task_telemetry_file(job.job_hash), task_hash=task_list[0].task_hash), script)
+
+
+@unittest.skipIf(not shutil.which('bash'), 'requires bash')
+class TestTelemetryRunSubmission(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.abspath('tmp_task_telemetry')
+        os.makedirs(os.path.join(self.tmp_dir, 'loc'), exist_ok=True)
+        os.makedirs(os.path.join(self.tmp_dir, 'rmt'), exist_ok=True)
+        self.context = LocalContext(os.path.join(self.tmp_dir, 'loc'), LocalSession({'work_path': os.path.join(self.tmp_dir, 'rmt')}))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_run_submission(self):
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=3, if_telemetry=True)
+        runtime_history = RuntimeHistory(os.path.join(self.tmp_dir, 'runtime_history.db'))
+        submission = Submission(work_base='.', resources=resources, poll_policy=FixedPollPolicy(interval=0.2),
+            runtime_history=runtime_history)
+        task_list = [Task(command='sleep 0.2; echo done > out', task_work_path='task0/', backward_files=['out'], task_need_resources=0.5),
+            Task(command='echo done > out; exit 3', task_work_path='task1/', backward_files=['out'], task_need_resources=0.5),
+            Task(command='echo done > out', task_work_path='task2/', backward_files=['out'], task_need_resources=0.5)]
+        submission.register_task_list(task_list)
+        submission.generate_jobs()
+        submission.bind_batch(batch=Shell(context=self.context))
+        for task in task_list:
+            os.makedirs(os.path.join(self.context.local_root, task.task_work_path))
+        submission.run_submission()
+
+        job, = submission.belonging_jobs
+        self.assertTrue(os.path.isfile(os.path.join(self.context.local_root, get_task_telemetry_file(job.job_hash))))
+        for task in task_list + job.job_task_list:
+            self.assertEqual(task.telemetry['exit_status'], 3 if task.task_work_path == 'task1/' else 0)
+            self.assertEqual(task.telemetry['run_count'], 1)
+            self.assertGreaterEqual(task.telemetry['wall_time'], 0)
+        self.assertGreaterEqual(task_list[0].telemetry['wall_time'], 0.2)
+        self.assertEqual(job.telemetry['task_count'], 3)
+        self.assertEqual(job.telemetry['failed_task_count'], 1)
+        if os.path.exists('/usr/bin/time'):
+            self.assertGreater(job.telemetry['max_rss'], 0)
+        else:
+            self.assertIsNone(job.telemetry['max_rss'])
+        # the runs are added to the runtime history, and the failed one is not used in the predictions
+        prediction_dict = submission.predict_task_runtimes()
+        self.assertIsNone(prediction_dict[task_list[1].task_hash])
+        self.assertGreaterEqual(prediction_dict[task_list[0].task_hash][50], 0.2)
+
+    def test_run_pbs_script(self):
+        # the record is written in the remote root, though the PBS script is not run from it
+        context = LazyLocalContext(os.path.join(self.tmp_dir, 'rmt'), None)
+        resources = Resources(number_node=1, cpu_per_node=4, gpu_per_node=0, queue_name='normal', group_size=2, if_telemetry=True)
+        task_list = [Task(command='echo done > out', task_work_path='task0/', task_need_resources=0.5),
+            Task(command='exit 3', task_work_path='task1/', task_need_resources=0.5)]
+        job = Job(job_task_list=task_list, resources=resources)
+        for task in task_list:
+            os.makedirs(os.path.join(context.remote_root, task.task_work_path))
+        with open(os.path.join(context.remote_root, 'job.sub'), 'w') as fp:
+            fp.write(PBS(context=context).gen_script(job))
+        sp.check_call(['bash', os.path.join(context.remote_root, 'job.sub')], cwd=os.path.join(self.tmp_dir, 'loc'),
+            env=dict(os.environ, PBS_O_WORKDIR=context.remote_root, HOME=os.path.join(self.tmp_dir, 'loc')))
+        with open(os.path.join(context.remote_root, get_task_telemetry_file(job.job_hash))) as fp:
+            task_telemetry_dict = parse_task_telemetry(fp.read())
+        self.assertEqual({task_hash: telemetry['exit_status'] for task_hash, telemetry in task_telemetry_dict.items()},
+            {task_list[0].task_hash: 0, task_list[1].task_hash: 3})